@@ -1,18 +1,37 @@
-from flask import Flask, render_template, request, jsonify, flash, redirect, url_for
+from flask import Flask, Request, Response, render_template, request, jsonify, flash, redirect, url_for
+import hashlib
 import os
+import re
+import threading
+import time
+import uuid
+from werkzeug.http import parse_content_range_header
 from werkzeug.utils import secure_filename
-from main import process_voip_call
-from data_processing.pcap_processor import extract_packets, filter_voip_packets
 from ml_models.model import VoIPQualityModel
 from ml_models.advanced_metrics import AdvancedVoIPMetrics
 from ml_models.traffic_analyzer import VoIPTrafficAnalyzer
+from ml_models.parallel_analysis import call_records
+from ml_models.streaming_analysis import StreamingCaptureAnalysis
+from ml_models.timeline import build_timeline
 from utils.logger import setup_logger
 from utils.config import Config
+from utils.profiling import StageProfiler, metrics
+from utils.result_cache import AnalysisCache, HashingFile, HashingReader, file_digest
+from utils.metrics_store import MetricsStore
+
+
+class HashingRequest(Request):
+    """Hash uploaded files while Werkzeug spools them, so the digest is ready when the upload is."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingFile(super()._get_file_stream(total_content_length, content_type, filename, content_length))
+
 
 app = Flask(__name__)
+app.request_class = HashingRequest
 app.config['SECRET_KEY'] = 'your-secret-key-here'  # Required for flash messages
 app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['MAX_CONTENT_LENGTH'] = Config.MAX_UPLOAD_BYTES
 
 # Ensure upload directory exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -20,8 +39,128 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 # Setup logger
 logger = setup_logger()
 
+# Analysis results keyed by capture content
+result_cache = AnalysisCache()
+
+# Per-call metrics of every analyzed capture
+metrics_store = MetricsStore()
+
+# Resumable upload sessions: upload_id -> session dict
+upload_sessions = {}
+upload_sessions_lock = threading.Lock()
+
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'pcap', 'pcapng'}
+    parts = filename.lower().rsplit('.', 2)
+    if len(parts) == 3 and parts[2] in {'gz', 'zst', 'xz'}:
+        return parts[1] in {'pcap', 'pcapng'}
+    return '.' in filename and parts[-1] in {'pcap', 'pcapng'}
+
+def wants_json():
+    return request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json'
+
+def analyze_stream(stream, profiler):
+    """
+    Analyze a capture (pcap/pcapng, optionally compressed) from a file-like
+    object, parsing it in bounded blocks as it is read.
+    """
+    analysis = StreamingCaptureAnalysis()
+    with profiler.stage('stream_ingest') as stage:
+        for block in iter(lambda: stream.read(Config.UPLOAD_BLOCK_BYTES), b''):
+            analysis.feed(block)
+        state = analysis.finish()
+        stage.packets = analysis.packet_count
+    return state
+
+def analyze_file(filepath, profiler):
+    """Analyze a capture on disk and return its ChunkState (None if no VoIP packets)."""
+    with open(filepath, 'rb') as f:
+        return analyze_stream(f, profiler)
+
+def build_report(state, profiler):
+    """
+    Turn an analysis state into the call_data, qos_report, traffic_behavior,
+    anomalies, per-call metrics, timeline and duplicate counts shown to users
+    (None if there were no VoIP packets).
+    """
+    if state is None:
+        return None
+    quality_metrics = AdvancedVoIPMetrics()
+    traffic_analyzer = VoIPTrafficAnalyzer()
+
+    call_data = state.call_data()
+    patterns = state.traffic_patterns()
+    with profiler.stage('traffic_behavior'):
+        traffic_behavior = traffic_analyzer.analyze_traffic_behavior(patterns)
+    with profiler.stage('anomaly_fit', packets=patterns['packet_count']):
+        anomalies = traffic_analyzer.detect_anomalies(patterns)
+    flow_metrics = state.flow_metrics()
+    with profiler.stage('qos_report'):
+        qos_report = quality_metrics.generate_qos_report(call_data, flow_metrics)
+    with profiler.stage('per_call'):
+        calls = call_records(state.calls, quality_metrics)
+    with profiler.stage('timeline'):
+        timeline = build_timeline(patterns, flow_metrics)
+    return {
+        'call_data': call_data,
+        'qos_report': qos_report,
+        'traffic_behavior': traffic_behavior,
+        'anomalies': anomalies,
+        'calls': calls,
+        'timeline': timeline,
+        'duplicates': state.duplicates.summary()
+    }
+
+def record_calls(digest, filename, results):
+    """Add the per-call metrics of a capture to the metrics store, once per capture."""
+    if results is not None and not metrics_store.has_capture(digest):
+        metrics_store.record_capture(digest, filename, results['calls'])
+
+def cached_report(digest, filename, analyze, profiler):
+    """
+    Return (analysis id, report) for the capture with the given SHA-256
+    digest, running analyze() and storing its report only on a cache miss.
+    The analysis id is the cache key, under which the timeline is served.
+    """
+    key = result_cache.make_key(digest)
+    results = result_cache.get(key)
+    if results is None:
+        results = build_report(analyze(), profiler)
+        if results is not None:
+            result_cache.put(key, results)
+    record_calls(digest, filename, results)
+    return key, results
+
+def report_json(results, filename, analysis_id):
+    return {
+        'filename': filename,
+        'analysis_id': analysis_id,
+        'call_data': results['call_data'],
+        'qos_report': results['qos_report'],
+        'traffic_behavior': results['traffic_behavior'],
+        'duplicates': results['duplicates'],
+        'anomalies': [
+            {key: float(value) if key != 'protocol' and value is not None else value
+             for key, value in anomaly.items()}
+            for anomaly in results['anomalies']
+        ]
+    }
+
+def render_analysis(results, filename, analysis_id):
+    if results is None:
+        if wants_json():
+            return jsonify({'error': 'No VoIP packets found in the file'}), 422
+        flash('No VoIP packets found in the file', 'error')
+        return redirect(url_for('index'))
+
+    if wants_json():
+        return jsonify(report_json(results, filename, analysis_id))
+    return render_template('results.html',
+                         filename=filename,
+                         analysis_id=analysis_id,
+                         call_data=results['call_data'],
+                         qos_report=results['qos_report'],
+                         traffic_behavior=results['traffic_behavior'],
+                         duplicates=results['duplicates'])
 
 @app.route('/')
 def index():
@@ -40,36 +179,14 @@ def analyze():
         
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
         
         try:
-            # Initialize analyzers
-            quality_metrics = AdvancedVoIPMetrics()
-            traffic_analyzer = VoIPTrafficAnalyzer()
-            
-            # Process PCAP
-            packets = extract_packets(filepath)
-            voip_packets = filter_voip_packets(packets)
-            
-            if not voip_packets:
-                flash('No VoIP packets found in the file', 'error')
-                return redirect(url_for('index'))
-                
-            # Analyze call
-            call_data = process_voip_call(voip_packets)
-            patterns = traffic_analyzer.extract_traffic_patterns(voip_packets)
-            traffic_behavior = traffic_analyzer.analyze_traffic_behavior(patterns)
-            flow_metrics = quality_metrics.analyze_call_flow(voip_packets)
-            qos_report = quality_metrics.generate_qos_report(call_data, flow_metrics)
-            
-            # Clean up
-            os.remove(filepath)
-            
-            return render_template('results.html', 
-                                 call_data=call_data,
-                                 qos_report=qos_report,
-                                 traffic_behavior=traffic_behavior)
+            # The upload was hashed while it was received; analyze it straight
+            # from the upload stream only if this capture has not been seen before
+            profiler = StageProfiler(registry=metrics)
+            analysis_id, results = cached_report(file.stream.hexdigest(), filename,
+                                                 lambda: analyze_stream(file.stream, profiler), profiler)
+            return render_analysis(results, filename, analysis_id)
             
         except Exception as e:
             logger.error(f"Analysis error: {str(e)}")
@@ -79,6 +196,201 @@ def analyze():
     flash('Invalid file type', 'error')
     return redirect(url_for('index'))
 
+@app.route('/analyze/stream', methods=['POST'])
+def analyze_raw_stream():
+    """
+    Analyze a capture sent as the raw request body (e.g. curl -T capture.pcap).
+
+    Clients that send the body's SHA-256 in an X-Content-SHA256 header get a
+    cached result without the body being read.
+    """
+    filename = secure_filename(request.args.get('filename', 'capture.pcap'))
+    try:
+        profiler = StageProfiler(registry=metrics)
+        claimed_digest = request.headers.get('X-Content-SHA256', '').lower()
+        analysis_id = result_cache.make_key(claimed_digest) if claimed_digest else None
+        results = result_cache.get(analysis_id) if claimed_digest else None
+        if results is None:
+            # Hash the body while it is being analyzed and cache under the actual digest
+            stream = HashingReader(request.stream)
+            results = build_report(analyze_stream(stream, profiler), profiler)
+            if claimed_digest and claimed_digest != stream.hexdigest():
+                logger.warning(f"X-Content-SHA256 does not match the uploaded body for {filename}")
+            analysis_id = result_cache.make_key(stream.hexdigest())
+            if results is not None:
+                result_cache.put(analysis_id, results)
+            record_calls(stream.hexdigest(), filename, results)
+        if results is None:
+            return jsonify({'error': 'No VoIP packets found in the file'}), 422
+        return jsonify(report_json(results, filename, analysis_id))
+    except Exception as e:
+        logger.error(f"Analysis error: {str(e)}")
+        return jsonify({'error': str(e)}), 400
+
+def get_upload_session(upload_id):
+    """Return an upload session, recovering it from its spool file after a restart."""
+    try:
+        upload_id = uuid.UUID(upload_id).hex
+    except ValueError:
+        return None
+    with upload_sessions_lock:
+        session = upload_sessions.get(upload_id)
+        if session is None:
+            path = os.path.join(app.config['UPLOAD_FOLDER'], f'{upload_id}.part')
+            if not os.path.exists(path):
+                return None
+            # The in-memory analysis and hash are gone; the spooled file is
+            # hashed and analyzed on completion
+            session = {
+                'id': upload_id, 'path': path, 'filename': 'capture.pcap',
+                'offset': os.path.getsize(path), 'analysis': None, 'sha256': None,
+                'lock': threading.Lock(), 'updated_at': os.path.getmtime(path), 'expired': False
+            }
+            upload_sessions[upload_id] = session
+        return session
+
+def expire_upload_sessions(now=None):
+    """
+    Drop upload sessions idle for longer than Config.UPLOAD_SESSION_TTL, and
+    spool files left without a session (e.g. by a restart) for as long.
+    Sessions busy receiving a chunk are left alone.
+    """
+    cutoff = (time.time() if now is None else now) - Config.UPLOAD_SESSION_TTL
+    with upload_sessions_lock:
+        for upload_id, session in list(upload_sessions.items()):
+            if session['updated_at'] < cutoff and session['lock'].acquire(blocking=False):
+                try:
+                    session['expired'] = True
+                    del upload_sessions[upload_id]
+                    if os.path.exists(session['path']):
+                        os.remove(session['path'])
+                finally:
+                    session['lock'].release()
+        active = {session['path'] for session in upload_sessions.values()}
+
+        for entry in os.scandir(app.config['UPLOAD_FOLDER']):
+            if entry.name.endswith('.part') and entry.path not in active:
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """Start a resumable upload. Chunks are then sent with PUT /uploads/<id>."""
+    expire_upload_sessions()
+    upload_id = uuid.uuid4().hex
+    filename = secure_filename(request.args.get('filename', 'capture.pcap')) or 'capture.pcap'
+    path = os.path.join(app.config['UPLOAD_FOLDER'], f'{upload_id}.part')
+    open(path, 'wb').close()
+    with upload_sessions_lock:
+        upload_sessions[upload_id] = {
+            'id': upload_id, 'path': path, 'filename': filename, 'offset': 0,
+            'analysis': StreamingCaptureAnalysis(), 'sha256': hashlib.sha256(),
+            'lock': threading.Lock(), 'updated_at': time.time(), 'expired': False
+        }
+    return jsonify({'upload_id': upload_id, 'offset': 0}), 201
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    """Return how many bytes have been received, i.e. where to resume."""
+    session = get_upload_session(upload_id)
+    if session is None:
+        return jsonify({'error': 'Unknown upload'}), 404
+    return jsonify({'upload_id': session['id'], 'offset': session['offset']})
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """
+    Append one chunk. The chunk must carry a Content-Range header starting at
+    the current offset; otherwise 409 is returned with the offset to resume from.
+    Chunks over Config.UPLOAD_CHUNK_MAX_BYTES, or taking the upload over
+    Config.MAX_UPLOAD_BYTES, get 413 with the offset received so far.
+    """
+    session = get_upload_session(upload_id)
+    if session is None:
+        return jsonify({'error': 'Unknown upload'}), 404
+    if request.content_length and request.content_length > Config.UPLOAD_CHUNK_MAX_BYTES:
+        return jsonify({'error': 'Chunk too large', 'max_bytes': Config.UPLOAD_CHUNK_MAX_BYTES}), 413
+
+    content_range = parse_content_range_header(request.headers.get('Content-Range'))
+    with session['lock']:
+        if session['expired']:
+            return jsonify({'error': 'Unknown upload'}), 404
+        start = content_range.start if content_range else session['offset']
+        if start != session['offset']:
+            return jsonify({'upload_id': session['id'], 'offset': session['offset']}), 409
+        too_large = {'error': 'Upload too large', 'max_bytes': Config.MAX_UPLOAD_BYTES,
+                     'upload_id': session['id']}
+        if request.content_length and session['offset'] + request.content_length > Config.MAX_UPLOAD_BYTES:
+            return jsonify(dict(too_large, offset=session['offset'])), 413
+
+        session['updated_at'] = time.time()
+        received = 0
+        with open(session['path'], 'ab') as f:
+            for block in iter(lambda: request.stream.read(Config.UPLOAD_BLOCK_BYTES), b''):
+                # Bodies without Content-Length are only limited here
+                received += len(block)
+                if received > Config.UPLOAD_CHUNK_MAX_BYTES:
+                    return jsonify({'error': 'Chunk too large', 'max_bytes': Config.UPLOAD_CHUNK_MAX_BYTES,
+                                    'upload_id': session['id'], 'offset': session['offset']}), 413
+                if session['offset'] + len(block) > Config.MAX_UPLOAD_BYTES:
+                    return jsonify(dict(too_large, offset=session['offset'])), 413
+                f.write(block)
+                session['offset'] += len(block)
+                if session['sha256'] is not None:
+                    session['sha256'].update(block)
+                if session['analysis'] is not None:
+                    try:
+                        session['analysis'].feed(block)
+                    except ValueError as e:
+                        # Unreadable as a stream; fall back to analyzing the spooled file
+                        logger.info(f"Upload {session['id']}: streaming analysis disabled ({e})")
+                        session['analysis'] = None
+        session['updated_at'] = time.time()
+        return jsonify({'upload_id': session['id'], 'offset': session['offset']})
+
+def finish_upload_analysis(session, profiler):
+    if session['analysis'] is not None:
+        with profiler.stage('stream_ingest') as stage:
+            state = session['analysis'].finish()
+            stage.packets = session['analysis'].packet_count
+        return state
+    return analyze_file(session['path'], profiler)
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """Finish a resumable upload and return the analysis."""
+    session = get_upload_session(upload_id)
+    if session is None:
+        return jsonify({'error': 'Unknown upload'}), 404
+
+    with upload_sessions_lock:
+        upload_sessions.pop(session['id'], None)
+    try:
+        profiler = StageProfiler(registry=metrics)
+        with session['lock']:
+            if session['expired']:
+                return jsonify({'error': 'Unknown upload'}), 404
+            if session['sha256'] is not None:
+                digest = session['sha256'].hexdigest()
+            else:
+                with profiler.stage('hash'):
+                    digest = file_digest(session['path'])
+            analysis_id, results = cached_report(digest, session['filename'],
+                                                 lambda: finish_upload_analysis(session, profiler), profiler)
+        return render_analysis(results, session['filename'], analysis_id)
+    except Exception as e:
+        logger.error(f"Analysis error: {str(e)}")
+        if wants_json():
+            return jsonify({'error': str(e)}), 400
+        flash(f'Error analyzing file: {str(e)}', 'error')
+        return redirect(url_for('index'))
+    finally:
+        if os.path.exists(session['path']):
+            os.remove(session['path'])
+
 @app.route('/train', methods=['POST'])
 def train():
     if 'file' not in request.files:
@@ -136,5 +448,62 @@ def train():
     flash('Invalid file type', 'error')
     return redirect(url_for('index'))
 
+@app.route('/calls')
+def query_calls():
+    """
+    Query the metrics store. Filters: since, until (Unix time, ISO date or
+    age such as 7d), endpoint, call_id, mos_below, mos_above. With group_by
+    (caller, callee, endpoint, hour or day) aggregates are returned instead.
+    """
+    args = request.args
+    filters = {
+        'since': args.get('since'), 'until': args.get('until'),
+        'endpoint': args.get('endpoint'), 'call_id': args.get('call_id'),
+        'mos_below': args.get('mos_below', type=float), 'mos_above': args.get('mos_above', type=float)
+    }
+    try:
+        if 'group_by' in args or args.get('summary'):
+            return jsonify(metrics_store.summary(group_by=args.get('group_by'), **filters))
+        return jsonify(metrics_store.calls(
+            limit=args.get('limit', 100, type=int),
+            order_by=args.get('order_by', 'start_time'),
+            with_streams=bool(args.get('streams')),
+            **filters
+        ))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/analysis/<analysis_id>/timeline')
+def analysis_timeline(analysis_id):
+    """
+    Timeline of an analyzed capture. Without `series`, describes the capture
+    span and the available series. With it, returns that series between
+    `start` and `end` seconds since the capture start, reduced to at most
+    `points` points with per-point min/max.
+    """
+    if not re.fullmatch(r'[0-9a-f]{64}', analysis_id):
+        return jsonify({'error': 'Invalid analysis id'}), 400
+    results = result_cache.get(analysis_id)
+    timeline = results.get('timeline') if results else None
+    if timeline is None:
+        return jsonify({'error': 'Unknown analysis'}), 404
+
+    series = request.args.get('series')
+    if not series:
+        return jsonify(timeline.describe())
+    try:
+        return jsonify(timeline.query(
+            series,
+            start=request.args.get('start', type=float),
+            end=request.args.get('end', type=float),
+            points=request.args.get('points', type=int)
+        ))
+    except KeyError:
+        return jsonify({'error': f'Unknown series {series}'}), 404
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=False)
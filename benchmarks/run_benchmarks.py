@@ -0,0 +1,178 @@
+"""
+Benchmark the analysis and training pipeline on a synthetic capture.
+
+Results are written as JSON together with the git commit and the generator
+parameters, so runs can be compared across commits:
+
+    python -m benchmarks.run_benchmarks --output bench_before.json
+    git checkout my-branch
+    python -m benchmarks.run_benchmarks --output bench_after.json --compare bench_before.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic_capture import generate_capture
+from data_processing.dedup import deduplicate_packets
+from data_processing.pcap_processor import extract_packets, filter_voip_packets
+from ml_models.advanced_metrics import AdvancedVoIPMetrics
+from ml_models.feature_extraction import extract_features
+from ml_models.model import VoIPQualityModel
+from ml_models.traffic_analyzer import VoIPTrafficAnalyzer
+from ml_models.train import process_voip_calls, determine_call_quality
+from utils.logger import setup_logger, stop_logging
+
+LOG_RECORDS = 10000
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def measure(func, repeats, items=None):
+    """Run func `repeats` times and return timing statistics and its last result."""
+    timings = []
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    stats = {
+        'best': min(timings),
+        'mean': float(np.mean(timings)),
+        'repeats': repeats,
+        'items': items,
+        'items_per_second': items / min(timings) if items and min(timings) > 0 else None
+    }
+    return stats, result
+
+def run(capture, repeats, training_samples, seed):
+    results = {}
+    quality_metrics = AdvancedVoIPMetrics()
+    traffic_analyzer = VoIPTrafficAnalyzer()
+
+    results['extract_packets'], packets = measure(lambda: extract_packets(capture), repeats)
+    results['extract_packets']['items'] = len(packets)
+    results['extract_packets']['items_per_second'] = len(packets) / results['extract_packets']['best']
+
+    results['deduplicate_packets'], _ = measure(
+        lambda: list(deduplicate_packets(packets)), repeats, len(packets))
+    results['filter_voip_packets'], voip_packets = measure(
+        lambda: filter_voip_packets(packets), repeats, len(packets))
+    results['process_voip_calls'], calls = measure(
+        lambda: process_voip_calls(voip_packets), repeats, len(voip_packets))
+    results['analyze_call_flow'], _ = measure(
+        lambda: quality_metrics.analyze_call_flow(voip_packets), repeats, len(voip_packets))
+    results['extract_traffic_patterns'], patterns = measure(
+        lambda: traffic_analyzer.extract_traffic_patterns(voip_packets), repeats, len(voip_packets))
+    results['detect_anomalies'], _ = measure(
+        lambda: traffic_analyzer.detect_anomalies(patterns), repeats, len(patterns['packet_sizes']))
+
+    # The synthetic capture holds few calls; resample them with noise to get
+    # a training set of a realistic size.
+    rng = np.random.default_rng(seed)
+    X_calls = extract_features(calls)
+    y_calls = np.array([determine_call_quality(call) for call in calls])
+    rows = rng.integers(0, len(X_calls), training_samples)
+    X = X_calls[rows] * rng.normal(1.0, 0.05, (training_samples, X_calls.shape[1]))
+    y = y_calls[rows]
+
+    model = VoIPQualityModel()
+    results['train'], _ = measure(lambda: model.train(X, y), repeats, training_samples)
+    results['predict'], _ = measure(lambda: model.predict(X), repeats, training_samples)
+    results['predict_single'], _ = measure(lambda: model.predict(X[:1]), repeats, 1)
+
+    # Time spent in the logging thread per INFO record; the file is written by
+    # the background listener
+    with tempfile.TemporaryDirectory() as log_dir:
+        bench_logger = setup_logger('benchmarks.logging', os.path.join(log_dir, 'benchmark.log'),
+                                    rate_limit=False, console=False)
+        bench_logger.propagate = False
+        results['log_info'], _ = measure(
+            lambda: [bench_logger.info("Packet %d: %d bytes", i, 200) for i in range(LOG_RECORDS)],
+            repeats, LOG_RECORDS)
+        stop_logging('benchmarks.logging')
+    return results
+
+def compare(current, baseline):
+    print(f"{'benchmark':<28}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, stats in current['results'].items():
+        before = baseline['results'].get(name)
+        if not before:
+            continue
+        change = (stats['best'] - before['best']) / before['best'] * 100 if before['best'] else 0
+        print(f"{name:<28}{before['best']:>11.4f}s{stats['best']:>11.4f}s{change:>+9.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the VoIP analysis pipeline")
+    parser.add_argument('--capture', help='benchmark an existing capture instead of a synthetic one')
+    parser.add_argument('--dialogs', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--loss', type=float, default=0.01)
+    parser.add_argument('--jitter', type=float, default=0.005)
+    parser.add_argument('--reorder', type=float, default=0.001)
+    parser.add_argument('--ssrc-changes', type=int, default=1)
+    parser.add_argument('--background', type=float, default=0.05)
+    parser.add_argument('--format', choices=['pcap', 'pcapng'], default='pcap')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--training-samples', type=int, default=10000)
+    parser.add_argument('--output', default='bench_output.json', help='JSON results file')
+    parser.add_argument('--compare', help='baseline JSON results to compare against')
+    args = parser.parse_args()
+
+    generator = {
+        'dialogs': args.dialogs, 'duration': args.duration, 'loss': args.loss,
+        'jitter': args.jitter, 'reorder': args.reorder, 'ssrc_changes': args.ssrc_changes,
+        'background': args.background, 'seed': args.seed, 'format': args.format
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        capture = args.capture
+        if not capture:
+            capture = os.path.join(tmp, f'synthetic.{args.format}')
+            generate_capture(capture, fmt=args.format, **{k: v for k, v in generator.items() if k != 'format'})
+        results = run(capture, args.repeats, args.training_samples, args.seed)
+        capture_size = os.path.getsize(capture)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'capture': args.capture,
+        'capture_bytes': capture_size,
+        'generator': None if args.capture else generator,
+        'results': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for name, stats in results.items():
+        rate = f"{stats['items_per_second']:,.0f}/s" if stats['items_per_second'] else ''
+        print(f"{name:<28}{stats['best']:>10.4f}s {rate}")
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
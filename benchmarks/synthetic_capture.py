@@ -0,0 +1,305 @@
+"""
+Deterministic synthetic SIP/RTP capture generator.
+
+Builds N concurrent SIP dialogs (INVITE/200 OK with SDP, ACK, BYE/200 OK)
+with bidirectional RTP at a fixed packet time, and writes them as pcap or
+pcapng. Loss, jitter, reordering and mid-call SSRC changes are configurable.
+The same arguments and seed always produce a byte-identical file.
+
+Usage:
+    python -m benchmarks.synthetic_capture out.pcap --dialogs 50 --duration 60 --loss 0.01
+"""
+import argparse
+import random
+import struct
+
+ETHERTYPE_IPV4 = 0x0800
+LINKTYPE_ETHERNET = 1
+RTP_PAYLOAD_SIZE = 160  # 20ms of G.711
+NTP_EPOCH_OFFSET = 2208988800
+
+
+def _checksum(data):
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+def _ip(address):
+    return bytes(int(part) for part in address.split('.'))
+
+def build_udp_frame(src_ip, dst_ip, sport, dport, payload, ip_id=0):
+    """Return an Ethernet/IPv4/UDP frame carrying payload."""
+    udp = struct.pack('!HHHH', sport, dport, 8 + len(payload), 0) + payload
+    ip_header = struct.pack(
+        '!BBHHHBBH4s4s', 0x45, 0, 20 + len(udp), ip_id & 0xFFFF, 0x4000, 64, 17, 0,
+        _ip(src_ip), _ip(dst_ip)
+    )
+    ip_header = ip_header[:10] + struct.pack('!H', _checksum(ip_header)) + ip_header[12:]
+    ether = b'\x00\x16\x3e\x00\x00\x02' + b'\x00\x16\x3e\x00\x00\x01' + struct.pack('!H', ETHERTYPE_IPV4)
+    return ether + ip_header + udp
+
+def build_rtp(seq, timestamp, ssrc, payload_type=0, marker=False):
+    header = struct.pack('!BBHII', 0x80, (0x80 if marker else 0) | payload_type,
+                         seq & 0xFFFF, timestamp & 0xFFFFFFFF, ssrc)
+    return header + bytes(RTP_PAYLOAD_SIZE)
+
+def _ntp(unix_time):
+    ntp = unix_time + NTP_EPOCH_OFFSET
+    return int(ntp), int((ntp % 1) * 2 ** 32)
+
+def build_rtcp_sr(ssrc, send_time, rtp_ts, packet_count, octet_count, report=None):
+    """
+    Return an RTCP compound packet: a sender report with at most one report
+    block (ssrc, fraction_lost, cumulative_lost, highest_seq, jitter, lsr, dlsr)
+    followed by an SDES CNAME.
+    """
+    ntp_sec, ntp_frac = _ntp(send_time)
+    blocks = b''
+    if report:
+        source, fraction_lost, cumulative_lost, highest_seq, jitter, lsr, dlsr = report
+        blocks = struct.pack('!IIIIII', source, (fraction_lost << 24) | (cumulative_lost & 0xFFFFFF),
+                             highest_seq, jitter, lsr, dlsr)
+    body = struct.pack('!IIIIII', ssrc, ntp_sec, ntp_frac, rtp_ts & 0xFFFFFFFF,
+                       packet_count, octet_count) + blocks
+    sr = struct.pack('!BBH', 0x80 | (1 if report else 0), 200, len(body) // 4) + body
+
+    cname = f'{ssrc:08x}@synthetic'.encode()
+    item = struct.pack('!BB', 1, len(cname)) + cname
+    chunk = struct.pack('!I', ssrc) + item + bytes(4 - len(item) % 4)
+    sdes = struct.pack('!BBH', 0x81, 202, len(chunk) // 4) + chunk
+    return sr + sdes
+
+def build_sip(first_line, call_id, cseq, branch, from_uri, to_uri, contact_ip, sdp=None):
+    body = sdp or ''
+    lines = [
+        first_line,
+        f'Via: SIP/2.0/UDP {contact_ip}:5060;branch=z9hG4bK{branch}',
+        f'From: <{from_uri}>;tag=a{branch}',
+        f'To: <{to_uri}>',
+        f'Call-ID: {call_id}',
+        f'CSeq: {cseq}',
+        f'Contact: <sip:{contact_ip}:5060>',
+        'Max-Forwards: 70',
+    ]
+    if body:
+        lines.append('Content-Type: application/sdp')
+    lines.append(f'Content-Length: {len(body)}')
+    return ('\r\n'.join(lines) + '\r\n\r\n' + body).encode()
+
+def build_sdp(session_id, ip, port, payload_type=0):
+    return '\r\n'.join([
+        'v=0',
+        f'o=- {session_id} {session_id} IN IP4 {ip}',
+        's=-',
+        f'c=IN IP4 {ip}',
+        't=0 0',
+        f'm=audio {port} RTP/AVP {payload_type} 101',
+        f'a=rtpmap:{payload_type} PCMU/8000',
+        'a=rtpmap:101 telephone-event/8000',
+        'a=ptime:20',
+        'a=sendrecv',
+    ]) + '\r\n'
+
+
+def generate_packets(dialogs=10, duration=30.0, ptime=0.02, loss=0.0, jitter=0.0,
+                     reorder=0.0, ssrc_changes=0, background=0.0, seed=42, start_time=1700000000.0,
+                     rtcp_interval=0.0, rtt=0.0, port_offset=0, duplicates=0.0):
+    """
+    Generate (timestamp, frame) tuples for a synthetic capture, sorted by time.
+
+    Parameters:
+        dialogs (int): Number of concurrent SIP dialogs.
+        duration (float): Media duration of each call in seconds.
+        ptime (float): RTP packet interval in seconds.
+        loss (float): Probability that an RTP packet is dropped.
+        jitter (float): Standard deviation of the network delay added to RTP packets (s).
+        reorder (float): Probability that an RTP packet is delayed past its successor.
+        ssrc_changes (int): Number of SSRC changes per media stream during the call.
+        background (float): Non-VoIP UDP packets per RTP packet (DNS-like noise).
+        seed (int): Random seed.
+        start_time (float): Capture start time (Unix seconds).
+        rtcp_interval (float): Seconds between RTCP sender reports of each
+            side (0 disables RTCP). RTCP uses the RTP port + 1.
+        rtt (float): Round-trip time reported through RTCP LSR/DLSR (s); the
+            capture point is taken halfway along the path.
+        port_offset (int): Added to the media ports negotiated in SDP, e.g. to
+            move them outside Config.RTP_PORT_RANGE.
+        duplicates (float): Probability that a packet is captured again at a
+            second tap up to 2 ms later.
+    """
+    rng = random.Random(seed)
+    packets = []
+    ip_id = 0
+
+    def emit(timestamp, src, dst, sport, dport, payload):
+        nonlocal ip_id
+        ip_id += 1
+        packets.append((timestamp, build_udp_frame(src, dst, sport, dport, payload, ip_id)))
+
+    for n in range(dialogs):
+        caller_ip = f'10.1.{n // 250}.{n % 250 + 1}'
+        callee_ip = f'10.2.{n // 250}.{n % 250 + 1}'
+        caller_port = 10000 + 2 * (n % 2500) + port_offset
+        callee_port = 20000 - 2 * (n % 2500) + port_offset
+        call_id = f'{seed}-{n}@synthetic'
+        from_uri = f'sip:caller{n}@{caller_ip}'
+        to_uri = f'sip:callee{n}@{callee_ip}'
+
+        t = start_time + rng.uniform(0, max(duration * 0.1, ptime))
+        emit(t, caller_ip, callee_ip, 5060, 5060, build_sip(
+            f'INVITE {to_uri} SIP/2.0', call_id, '1 INVITE', f'{n}i', from_uri, to_uri, caller_ip,
+            build_sdp(1000 + n, caller_ip, caller_port)))
+        t += rng.uniform(0.05, 0.5)
+        emit(t, callee_ip, caller_ip, 5060, 5060, build_sip(
+            'SIP/2.0 200 OK', call_id, '1 INVITE', f'{n}i', from_uri, to_uri, callee_ip,
+            build_sdp(2000 + n, callee_ip, callee_port)))
+        t += 0.01
+        emit(t, caller_ip, callee_ip, 5060, 5060, build_sip(
+            f'ACK {to_uri} SIP/2.0', call_id, '1 ACK', f'{n}a', from_uri, to_uri, caller_ip))
+        media_start = t + 0.01
+
+        count = int(duration / ptime)
+        stream_ssrcs = []
+        for src, dst, sport, dport in ((caller_ip, callee_ip, caller_port, callee_port),
+                                       (callee_ip, caller_ip, callee_port, caller_port)):
+            ssrcs = []
+            stream_ssrcs.append(ssrcs)
+            ssrc = rng.getrandbits(32)
+            seq = rng.getrandbits(16)
+            rtp_ts = rng.getrandbits(32)
+            change_at = set(rng.sample(range(1, count), min(ssrc_changes, max(count - 1, 0))))
+            for i in range(count):
+                if i in change_at:
+                    ssrc = rng.getrandbits(32)
+                    seq = rng.getrandbits(16)
+                ssrcs.append((ssrc, seq))
+                sent = media_start + i * ptime
+                seq, rtp_ts = (seq + 1) & 0xFFFF, (rtp_ts + int(ptime * 8000)) & 0xFFFFFFFF
+                if rng.random() < loss:
+                    continue
+                delay = abs(rng.gauss(0, jitter)) if jitter else 0.0
+                if rng.random() < reorder:
+                    delay += 1.5 * ptime
+                emit(sent + delay, src, dst, sport, dport, build_rtp(seq, rtp_ts, ssrc, marker=(i == 0)))
+                if background and rng.random() < background:
+                    emit(sent + rng.uniform(0, ptime), '192.168.0.1', '192.168.0.53',
+                         rng.randint(30000, 60000), 53, bytes(rng.getrandbits(8) for _ in range(40)))
+
+        if rtcp_interval:
+            emit_rtcp(emit, media_start, count, ptime, loss, jitter, rtcp_interval, rtt, stream_ssrcs,
+                      ((caller_ip, callee_ip, caller_port + 1, callee_port + 1),
+                       (callee_ip, caller_ip, callee_port + 1, caller_port + 1)))
+
+        t = media_start + count * ptime + rng.uniform(0.01, 0.1)
+        emit(t, caller_ip, callee_ip, 5060, 5060, build_sip(
+            f'BYE {to_uri} SIP/2.0', call_id, '2 BYE', f'{n}b', from_uri, to_uri, caller_ip))
+        emit(t + rng.uniform(0.01, 0.1), callee_ip, caller_ip, 5060, 5060, build_sip(
+            'SIP/2.0 200 OK', call_id, '2 BYE', f'{n}b', from_uri, to_uri, callee_ip))
+
+    if duplicates:
+        packets += [(timestamp + rng.uniform(0.0002, 0.002), frame)
+                    for timestamp, frame in packets if rng.random() < duplicates]
+    packets.sort(key=lambda p: p[0])
+    return packets
+
+def emit_rtcp(emit, media_start, count, ptime, loss, jitter, interval, rtt, stream_ssrcs, endpoints):
+    """
+    Emit alternating sender reports of both sides of a call, each with a
+    report block about the other side's stream. Only uses the arguments, so
+    enabling RTCP does not change the rest of the capture.
+    """
+    last_sr = [None, None]  # (middle 32 NTP bits, send time) of each side's last SR
+    reports = []
+    for side in (0, 1):
+        k = 1
+        while True:
+            send_time = media_start + k * interval + side * interval / 2
+            i = int((send_time - media_start) / ptime)
+            if i >= count:
+                break
+            reports.append((send_time, side, i))
+            k += 1
+
+    for send_time, side, i in sorted(reports):
+        other = 1 - side
+        ssrc = stream_ssrcs[side][i][0]
+        source, highest_seq = stream_ssrcs[other][i]
+        report = None
+        if last_sr[other] is not None:
+            lsr, sr_sent = last_sr[other]
+            dlsr = send_time - (sr_sent + rtt / 2)
+            lost = int(i * loss)
+            report = (source, min(int(loss * 256), 255), lost, highest_seq,
+                      int(jitter * 8000), lsr, max(int(dlsr * 65536), 0))
+        ntp_sec, ntp_frac = _ntp(send_time)
+        last_sr[side] = ((ntp_sec & 0xFFFF) << 16 | ntp_frac >> 16, send_time)
+        src, dst, sport, dport = endpoints[side]
+        emit(send_time + rtt / 4, src, dst, sport, dport, build_rtcp_sr(
+            ssrc, send_time, int((send_time - media_start) * 8000), i, i * RTP_PAYLOAD_SIZE, report))
+
+def write_pcap(path, packets, nanosecond=False):
+    """Write (timestamp, frame) tuples as a little-endian classic pcap file."""
+    magic = 0xA1B23C4D if nanosecond else 0xA1B2C3D4
+    scale = 10 ** 9 if nanosecond else 10 ** 6
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<IHHiIII', magic, 2, 4, 0, 0, 65535, LINKTYPE_ETHERNET))
+        for timestamp, frame in packets:
+            ticks = round(timestamp * scale)
+            f.write(struct.pack('<IIII', ticks // scale, ticks % scale, len(frame), len(frame)))
+            f.write(frame)
+
+def _pcapng_block(block_type, body):
+    body += bytes(-len(body) % 4)
+    length = len(body) + 12
+    return struct.pack('<II', block_type, length) + body + struct.pack('<I', length)
+
+def write_pcapng(path, packets):
+    """Write (timestamp, frame) tuples as a pcapng file with one microsecond interface."""
+    with open(path, 'wb') as f:
+        f.write(_pcapng_block(0x0A0D0D0A, struct.pack('<IHHq', 0x1A2B3C4D, 1, 0, -1)))
+        f.write(_pcapng_block(0x00000001, struct.pack('<HHI', LINKTYPE_ETHERNET, 0, 65535)))
+        for timestamp, frame in packets:
+            ticks = round(timestamp * 10 ** 6)
+            f.write(_pcapng_block(0x00000006, struct.pack(
+                '<IIIII', 0, ticks >> 32, ticks & 0xFFFFFFFF, len(frame), len(frame)) + frame))
+
+def generate_capture(path, fmt='pcap', **kwargs):
+    """Generate a synthetic capture file and return the number of packets written."""
+    packets = generate_packets(**kwargs)
+    if fmt == 'pcapng':
+        write_pcapng(path, packets)
+    else:
+        write_pcap(path, packets)
+    return len(packets)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic SIP/RTP capture")
+    parser.add_argument('output', help='output file')
+    parser.add_argument('--format', choices=['pcap', 'pcapng'], default='pcap')
+    parser.add_argument('--dialogs', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--ptime', type=float, default=0.02)
+    parser.add_argument('--loss', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--reorder', type=float, default=0.0)
+    parser.add_argument('--ssrc-changes', type=int, default=0)
+    parser.add_argument('--background', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--rtcp-interval', type=float, default=0.0)
+    parser.add_argument('--rtt', type=float, default=0.0)
+    parser.add_argument('--port-offset', type=int, default=0)
+    parser.add_argument('--duplicates', type=float, default=0.0)
+    args = parser.parse_args()
+
+    written = generate_capture(
+        args.output, fmt=args.format, dialogs=args.dialogs, duration=args.duration,
+        ptime=args.ptime, loss=args.loss, jitter=args.jitter, reorder=args.reorder,
+        ssrc_changes=args.ssrc_changes, background=args.background, seed=args.seed,
+        rtcp_interval=args.rtcp_interval, rtt=args.rtt, port_offset=args.port_offset,
+        duplicates=args.duplicates
+    )
+    print(f"Wrote {written} packets to {args.output}")
@@ -0,0 +1,134 @@
+"""
+Duplicate packet removal for captures merged from several taps.
+
+The same datagram seen at two mirror ports or capture points is recognized
+by its IP ID, 5-tuple and either the RTP header (SSRC, sequence number,
+timestamp) or a digest of the payload. Keys are remembered in a two-
+generation set whose generations are consecutive `window`-second slots of
+capture time, so memory stays bounded by the packets of two windows
+whatever the capture length. Because the slots are aligned to multiples of
+`window`, the filter's state at any point depends only on the packets of
+the two slots before it, and chunked analysis can rebuild it by replaying
+those packets. SIP retransmissions are new datagrams with their own IP ID and are
+kept.
+
+Packet and duplicate counts are kept per tap: the pcapng interface a
+packet was captured on, or the capture file for classic pcap, which has
+no interfaces.
+"""
+import hashlib
+import logging
+import math
+from data_processing.pcap_processor import udp_layers, is_rtp_payload
+from utils.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def packet_key(ip, udp, payload):
+    """Return the identity of a UDP datagram that is the same at every tap."""
+    if payload is not None and is_rtp_payload(payload):
+        content = payload[:12]  # SSRC, sequence number and timestamp
+    else:
+        content = hashlib.blake2b(payload or b'', digest_size=8).digest()
+    return hash((
+        ip.getfieldval('id'), ip.getfieldval('src'), ip.getfieldval('dst'),
+        udp.getfieldval('sport'), udp.getfieldval('dport'),
+        len(payload) if payload is not None else -1, content
+    ))
+
+
+class DuplicateStats:
+    """Packet and duplicate counts per tap, mergeable across chunks."""
+
+    def __init__(self):
+        self.taps = {}  # tap -> [packets, duplicates]
+
+    def add(self, tap, duplicate):
+        counts = self.taps.setdefault(tap, [0, 0])
+        counts[0] += 1
+        if duplicate:
+            counts[1] += 1
+
+    def merge(self, other):
+        for tap, (packets, duplicates) in other.taps.items():
+            counts = self.taps.setdefault(tap, [0, 0])
+            counts[0] += packets
+            counts[1] += duplicates
+        return self
+
+    @property
+    def duplicates(self):
+        return sum(duplicates for _, duplicates in self.taps.values())
+
+    def summary(self):
+        """Return overall and per-tap duplicate counts and rates, worst tap first."""
+        packets = sum(count for count, _ in self.taps.values())
+        duplicates = self.duplicates
+        return {
+            'packets': packets,
+            'duplicates': duplicates,
+            'duplicate_rate': duplicates / packets if packets else 0,
+            'taps': [
+                {'tap': tap, 'packets': count, 'duplicates': dups, 'duplicate_rate': dups / count}
+                for tap, (count, dups) in sorted(self.taps.items(), key=lambda t: t[1][1] / t[1][0],
+                                                 reverse=True)
+            ]
+        }
+
+
+class PacketDeduplicator:
+    """
+    Time-windowed duplicate filter for a time-ordered packet stream.
+
+    Duplicates arriving up to `window` seconds after the original are always
+    caught (up to twice that, depending on where the generation boundary
+    falls). A generation also rotates early once it holds `max_entries`
+    keys; past that rate the state no longer depends on the last two slots
+    only.
+    Non-UDP packets are passed through untouched. Packets without a capture
+    interface (sniffed_on) are counted under `tap`, e.g. the capture file name.
+    """
+
+    def __init__(self, window=None, max_entries=None, tap='capture'):
+        self.window = window if window is not None else Config.DEDUP_WINDOW_SECONDS
+        self.max_entries = max_entries or Config.DEDUP_MAX_ENTRIES
+        self.tap = tap
+        self.stats = DuplicateStats()
+        self._current = set()
+        self._previous = set()
+        self._generation = None  # index of the current window-aligned slot
+
+    def is_duplicate(self, packet):
+        """Record a packet and return True if the same datagram was seen within the window."""
+        layers = udp_layers(packet)
+        if layers is None:
+            return False
+        ip, udp, payload = layers
+
+        generation = math.floor(float(packet.time) / self.window)
+        if self._generation is None:
+            self._generation = generation
+        elif generation > self._generation:
+            # A gap of two windows or more leaves nothing worth keeping
+            self._previous = self._current if generation == self._generation + 1 else set()
+            self._current = set()
+            self._generation = generation
+        elif len(self._current) >= self.max_entries:
+            self._previous = self._current
+            self._current = set()
+
+        key = packet_key(ip, udp, payload)
+        duplicate = key in self._current or key in self._previous
+        # Copies are remembered too, so a slot's keys do not depend on earlier slots
+        self._current.add(key)
+        self.stats.add(packet.sniffed_on or self.tap, duplicate)
+        return duplicate
+
+
+def deduplicate_packets(packets, deduplicator=None):
+    """Yield the packets of a time-ordered stream without tap duplicates."""
+    deduplicator = deduplicator or PacketDeduplicator()
+    for packet in packets:
+        if not deduplicator.is_duplicate(packet):
+            yield packet
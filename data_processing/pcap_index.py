@@ -0,0 +1,128 @@
+import logging
+import os
+import struct
+from collections import deque
+from scapy.all import PcapReader
+
+logger = logging.getLogger(__name__)
+
+# Classic pcap magic numbers -> (struct byte order, nanosecond timestamps)
+PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': ('<', False),
+    b'\xa1\xb2\xc3\xd4': ('>', False),
+    b'\x4d\x3c\xb2\xa1': ('<', True),
+    b'\xa1\xb2\x3c\x4d': ('>', True),
+}
+GLOBAL_HEADER_LEN = 24
+RECORD_HEADER_LEN = 16
+
+def read_global_header(f):
+    """Read a classic pcap global header and return (endian, nanosecond, linktype)."""
+    header = f.read(GLOBAL_HEADER_LEN)
+    if len(header) < GLOBAL_HEADER_LEN or header[:4] not in PCAP_MAGIC:
+        raise ValueError("Chunked analysis requires an uncompressed classic pcap file")
+    endian, nanosecond = PCAP_MAGIC[header[:4]]
+    linktype = struct.unpack(endian + 'I', header[20:24])[0]
+    return endian, nanosecond, linktype
+
+def scan_record_offsets(pcap_file):
+    """
+    Yield (offset, timestamp) for every record in a pcap file.
+
+    Only the 16-byte record headers are read; packet bodies are skipped with
+    a seek, so the scan costs a small fraction of a full parse.
+    """
+    with open(pcap_file, 'rb', buffering=1 << 20) as f:
+        endian, nanosecond, _ = read_global_header(f)
+        record_header = struct.Struct(endian + 'IIII')
+        divisor = 1e9 if nanosecond else 1e6
+        offset = GLOBAL_HEADER_LEN
+        while True:
+            f.seek(offset)
+            header = f.read(RECORD_HEADER_LEN)
+            if len(header) < RECORD_HEADER_LEN:
+                break
+            sec, frac, caplen, _ = record_header.unpack(header)
+            yield offset, sec + frac / divisor
+            offset += RECORD_HEADER_LEN + caplen
+
+def plan_chunks(pcap_file, num_chunks=None, chunk_seconds=None, lead_seconds=0):
+    """
+    Split a pcap file into contiguous record ranges.
+
+    Parameters:
+        pcap_file (str): Path to the capture.
+        num_chunks (int): Target number of roughly equal-sized (by bytes) chunks.
+        chunk_seconds (float): Start a new chunk every chunk_seconds of capture
+            time instead. Takes precedence over num_chunks.
+        lead_seconds (float): Capture time before each chunk whose records
+            are described by 'lead_offset' and 'lead_count', for state that
+            a worker has to rebuild from the packets before its chunk.
+
+    Returns:
+        list: Chunk descriptors {'index', 'offset', 'count', 'start_time',
+        'lead_offset', 'lead_count'} in capture order.
+    """
+    if not num_chunks and not chunk_seconds:
+        raise ValueError("Either num_chunks or chunk_seconds must be given")
+
+    target_bytes = max((os.path.getsize(pcap_file) - GLOBAL_HEADER_LEN) / (num_chunks or 1), 1)
+    chunks = []
+    current = None
+    recent = deque()  # (offset, timestamp) of the records within lead_seconds
+
+    for offset, timestamp in scan_record_offsets(pcap_file):
+        while recent and recent[0][1] < timestamp - lead_seconds:
+            recent.popleft()
+        if current is not None:
+            if chunk_seconds:
+                split = timestamp - current['start_time'] >= chunk_seconds
+            else:
+                split = offset - current['offset'] >= target_bytes
+            if split:
+                chunks.append(current)
+                current = None
+        if current is None:
+            current = {
+                'index': len(chunks), 'offset': offset, 'count': 0, 'start_time': timestamp,
+                'lead_offset': recent[0][0] if recent else offset, 'lead_count': len(recent)
+            }
+        current['count'] += 1
+        if lead_seconds:
+            recent.append((offset, timestamp))
+
+    if current is not None:
+        chunks.append(current)
+
+    logger.info(f"Planned {len(chunks)} chunks for {pcap_file}")
+    return chunks
+
+def iter_chunk_records(pcap_file, chunk):
+    """
+    Yield (timestamp, frame bytes) for the records of a chunk without
+    dissecting them, for scans that only look at a few packets.
+    """
+    with open(pcap_file, 'rb', buffering=1 << 20) as f:
+        endian, nanosecond, _ = read_global_header(f)
+        record_header = struct.Struct(endian + 'IIII')
+        divisor = 1e9 if nanosecond else 1e6
+        f.seek(chunk['offset'])
+        for _ in range(chunk['count']):
+            header = f.read(RECORD_HEADER_LEN)
+            if len(header) < RECORD_HEADER_LEN:
+                break
+            sec, frac, caplen, _ = record_header.unpack(header)
+            data = f.read(caplen)
+            if len(data) < caplen:
+                break
+            yield sec + frac / divisor, data
+
+def iter_chunk_packets(pcap_file, chunk):
+    """Yield the Scapy packets of a single chunk produced by plan_chunks."""
+    with PcapReader(pcap_file) as reader:
+        reader.f.seek(chunk['offset'])
+        for _ in range(chunk['count']):
+            try:
+                yield reader.read_packet()
+            except EOFError:
+                break
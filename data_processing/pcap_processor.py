@@ -1,62 +1,173 @@
-import logging
-from scapy.all import rdpcap, UDP, Raw
-from scapy.layers.inet import IP
-import re
-
-logger = logging.getLogger(__name__)
-
-def extract_packets(pcap_file):
-    """Extract packets from a PCAP file using Scapy."""
-    try:
-        packets = rdpcap(pcap_file)
-        logger.info(f"Extracted {len(packets)} packets from {pcap_file}")
-        return packets
-    except Exception as e:
-        logger.error(f"Error reading PCAP file: {e}")
-        raise
-
-def is_sip_packet(packet):
-    """Check if a packet is a SIP packet."""
-    if UDP in packet and Raw in packet:
-        payload = str(packet[Raw].load)
-        return any(method in payload for method in [
-            'INVITE', 'ACK', 'BYE', 'CANCEL', 'OPTIONS', 'REGISTER',
-            'PRACK', 'SUBSCRIBE', 'NOTIFY', 'PUBLISH', 'INFO', 'REFER',
-            'MESSAGE', 'UPDATE'
-        ]) or 'SIP/2.0' in payload
-    return False
-
-def is_rtp_packet(packet):
-    """Check if a packet is an RTP packet."""
-    if UDP in packet:
-        # RTP typically uses even port numbers
-        dst_port = packet[UDP].dport
-        src_port = packet[UDP].sport
-        
-        # Check if either port is in the typical RTP range (10000-20000) and is even
-        is_rtp_port = lambda p: 10000 <= p <= 20000 and p % 2 == 0
-        
-        if (is_rtp_port(dst_port) or is_rtp_port(src_port)) and Raw in packet:
-            # Check RTP header pattern (first two bytes)
-            raw_data = packet[Raw].load
-            if len(raw_data) >= 12:  # Minimum RTP header size
-                version = (raw_data[0] >> 6) & 0x03  # Extract version from first 2 bits
-                return version == 2  # RTP version should be 2
-    return False
-
-def filter_voip_packets(packets):
-    """Filter VoIP-related packets (SIP and RTP) from the packet list."""
-    voip_packets = []
-    
-    for pkt in packets:
-        if IP in pkt:  # Only process IP packets
-            if is_sip_packet(pkt):
-                voip_packets.append(('SIP', pkt))
-            elif is_rtp_packet(pkt):
-                voip_packets.append(('RTP', pkt))
-    
-    sip_count = sum(1 for p in voip_packets if p[0] == 'SIP')
-    rtp_count = sum(1 for p in voip_packets if p[0] == 'RTP')
-    
-    logger.info(f"Filtered {len(voip_packets)} VoIP packets (SIP: {sip_count}, RTP: {rtp_count})")
-    return voip_packets
+import logging
+from scapy.all import UDP, Raw
+from scapy.packet import NoPayload
+from scapy.layers.inet import IP
+from data_processing.pcap_stream import iter_capture_packets
+from data_processing.rtcp import is_rtcp_payload
+from data_processing.sdp import MediaFlowTable
+from utils.config import Config
+import re
+
+logger = logging.getLogger(__name__)
+
+def extract_packets(pcap_file, digest=None):
+    """
+    Extract packets from a pcap or pcapng file, optionally gzip/zstd/xz
+    compressed, dissected with Scapy. A hashlib `digest` is updated with
+    the file's bytes as they are read.
+    """
+    try:
+        packets = list(iter_capture_packets(pcap_file, digest=digest))
+        logger.info(f"Extracted {len(packets)} packets from {pcap_file}")
+        return packets
+    except Exception as e:
+        logger.error(f"Error reading PCAP file: {e}")
+        raise
+
+SIP_MARKERS = (
+    b'INVITE', b'ACK', b'BYE', b'CANCEL', b'OPTIONS', b'REGISTER',
+    b'PRACK', b'SUBSCRIBE', b'NOTIFY', b'PUBLISH', b'INFO', b'REFER',
+    b'MESSAGE', b'UPDATE', b'SIP/2.0'
+)
+
+def udp_layers(packet):
+    """
+    Return (ip, udp, payload) for a UDP/IP packet, or None.
+
+    Walks the layer chain once instead of repeated `in`/getitem lookups, which
+    dominate the cost of classifying a packet with Scapy.
+    """
+    layer, ip = packet, None
+    while not isinstance(layer, UDP):
+        if isinstance(layer, IP):
+            ip = layer
+        layer = layer.payload
+        if isinstance(layer, NoPayload):
+            return None
+    if ip is None:
+        return None
+    payload = layer.payload
+    return ip, layer, payload.load if isinstance(payload, Raw) else None
+
+def is_sip_payload(payload):
+    """Check if a UDP payload looks like a SIP message."""
+    return any(marker in payload for marker in SIP_MARKERS)
+
+def extract_call_id(packet):
+    """Extract Call-ID from SIP packet."""
+    if Raw in packet:
+        payload = packet[Raw].load.decode('utf-8', errors='ignore')
+        for line in payload.split('\r\n'):
+            if line.startswith('Call-ID:'):
+                return line.split(':', 1)[1].strip()
+    return str(hash(str(packet)))  # Fallback to packet hash if Call-ID not found
+
+def is_rtp_port(port):
+    """RTP typically uses even ports in the configured range (Config.RTP_PORT_RANGE)."""
+    low, high = Config.RTP_PORT_RANGE
+    return low <= port <= high and port % 2 == 0
+
+def is_rtcp_port(port):
+    """RTCP uses the odd port above an RTP port, or the RTP port itself with rtcp-mux."""
+    return is_rtp_port(port) or is_rtp_port(port - 1)
+
+def is_rtp_payload(payload):
+    """Check the RTP header pattern: at least 12 bytes, version 2."""
+    return len(payload) >= 12 and (payload[0] >> 6) & 0x03 == 2
+
+def is_sip_packet(packet):
+    """Check if a packet is a SIP packet."""
+    layers = udp_layers(packet)
+    return bool(layers and layers[2] is not None and is_sip_payload(layers[2]))
+
+def is_rtp_packet(packet):
+    """Check if a packet is an RTP packet."""
+    layers = udp_layers(packet)
+    if layers and layers[2] is not None:
+        _, udp, payload = layers
+        if is_rtp_port(udp.getfieldval('dport')) or is_rtp_port(udp.getfieldval('sport')):
+            return is_rtp_payload(payload)
+    return False
+
+def is_rtcp_packet(packet):
+    """Check if a packet is an RTCP (SR/RR/SDES/BYE/APP/FB/XR) compound packet on an RTCP port."""
+    layers = udp_layers(packet)
+    if layers and layers[2] is not None:
+        _, udp, payload = layers
+        if is_rtcp_port(udp.getfieldval('dport')) or is_rtcp_port(udp.getfieldval('sport')):
+            return is_rtcp_payload(payload)
+    return False
+
+def classify_voip_packet(pkt):
+    """Return 'SIP', 'RTCP' or 'RTP' for a VoIP packet, None for anything else."""
+    return _HEURISTIC_CLASSIFIER.classify(pkt)
+
+class VoIPPacketClassifier:
+    """
+    Stateful VoIP classifier for a time-ordered packet stream.
+
+    SDP in SIP messages populates a MediaFlowTable, and packets of negotiated
+    media flows are classified by an endpoint lookup, whatever their ports.
+    Other packets go through the SIP check and, unless `fallback_heuristics`
+    is off, the RTCP and RTP port/payload heuristics.
+    """
+
+    def __init__(self, fallback_heuristics=True, learn_flows=True):
+        self.flow_table = MediaFlowTable()
+        self.fallback_heuristics = fallback_heuristics
+        self.learn_flows = learn_flows
+
+    def classify(self, pkt):
+        """Return 'SIP', 'RTCP' or 'RTP' for a VoIP packet, None for anything else."""
+        layers = udp_layers(pkt)
+        if layers is None or layers[2] is None:
+            return None
+        ip, udp, payload = layers
+        sport, dport = udp.getfieldval('sport'), udp.getfieldval('dport')
+
+        if self.flow_table.endpoints:
+            endpoint = self.flow_table.lookup(ip.getfieldval('src'), sport, ip.getfieldval('dst'), dport)
+            if endpoint is not None:
+                # With rtcp-mux RTP and RTCP share the endpoint
+                if (endpoint['protocol'] == 'RTCP' or endpoint['rtcp_mux']) and is_rtcp_payload(payload):
+                    return 'RTCP'
+                if endpoint['protocol'] == 'RTP' and is_rtp_payload(payload):
+                    return 'RTP'
+
+        if is_sip_payload(payload):
+            if self.learn_flows:
+                self.flow_table.learn(payload, float(pkt.time))
+            return 'SIP'
+        if self.fallback_heuristics:
+            # RTCP packet types 200-207 look like RTP payload types 72-79 with
+            # the marker bit set (RFC 5761), so RTCP has to be ruled out first
+            if (is_rtcp_port(dport) or is_rtcp_port(sport)) and is_rtcp_payload(payload):
+                return 'RTCP'
+            if (is_rtp_port(dport) or is_rtp_port(sport)) and is_rtp_payload(payload):
+                return 'RTP'
+        return None
+
+_HEURISTIC_CLASSIFIER = VoIPPacketClassifier(learn_flows=False)
+
+def filter_voip_packets(packets, classifier=None):
+    """
+    Filter VoIP-related packets (SIP, RTP and RTCP) from the packet list.
+
+    Media flows negotiated in SDP are recognized on any port; pass a
+    VoIPPacketClassifier to keep what was learned across calls.
+    """
+    classifier = classifier or VoIPPacketClassifier()
+    voip_packets = []
+    
+    for pkt in packets:
+        protocol = classifier.classify(pkt)
+        if protocol:
+            voip_packets.append((protocol, pkt))
+    
+    sip_count = sum(1 for p in voip_packets if p[0] == 'SIP')
+    rtp_count = sum(1 for p in voip_packets if p[0] == 'RTP')
+    rtcp_count = sum(1 for p in voip_packets if p[0] == 'RTCP')
+    
+    logger.info(f"Filtered {len(voip_packets)} VoIP packets (SIP: {sip_count}, RTP: {rtp_count}, RTCP: {rtcp_count}, "
+                f"media endpoints from SDP: {len(classifier.flow_table)})")
+    return voip_packets
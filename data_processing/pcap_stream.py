@@ -0,0 +1,459 @@
+import glob
+import logging
+import lzma
+import os
+import struct
+import zlib
+from decimal import Decimal
+from scapy.all import conf
+from scapy.utils import EDecimal
+from data_processing.pcap_index import PCAP_MAGIC, GLOBAL_HEADER_LEN, RECORD_HEADER_LEN
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed for .zst captures
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Records larger than this are treated as corruption rather than buffered
+MAX_RECORD_LEN = 256 * 1024
+MAX_BLOCK_LEN = 16 * 1024 * 1024
+
+# Large sequential reads amortize syscall and decompression call overhead
+READ_BLOCK_SIZE = 4 * 1024 * 1024
+# Compressed input is fed to the decompressor in slices, and each
+# decompression call produces at most DECOMPRESS_OUTPUT bytes, so memory
+# stays bounded even for high compression ratios
+DECOMPRESS_SLICE = 64 * 1024
+DECOMPRESS_OUTPUT = 1024 * 1024
+
+PCAPNG_MAGIC = b'\x0a\x0d\x0d\x0a'
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+XZ_MAGIC = b'\xfd7zXZ\x00'
+
+CAPTURE_EXTENSIONS = ('.pcap', '.pcapng', '.cap')
+COMPRESSION_EXTENSIONS = ('', '.gz', '.zst', '.xz')
+
+def link_layer_class(linktype):
+    """Return the Scapy class used to dissect frames of a pcap link type."""
+    try:
+        return conf.l2types.num2layer[linktype]
+    except KeyError:
+        logger.warning(f"Unknown link type {linktype}, using Raw packets")
+        return conf.raw_layer
+
+def build_packet(link_layer, data, timestamp, wirelen=None, interface=None):
+    """
+    Dissect a captured frame the same way Scapy's pcap readers do. The
+    capture interface, if known, is kept in the packet's sniffed_on.
+    """
+    try:
+        packet = link_layer(data)
+    except Exception:
+        packet = conf.raw_layer(data)
+    if timestamp is not None:
+        packet.time = timestamp
+    packet.wirelen = wirelen
+    packet.sniffed_on = interface
+    return packet
+
+
+class PcapStreamParser:
+    """
+    Incremental (push) parser for classic pcap byte streams.
+
+    Handles both byte orders and the nanosecond variant. Bytes can be fed in
+    arbitrary pieces, e.g. as they arrive from an HTTP upload; every call
+    returns the packets whose records are now complete. Only the trailing
+    partial record is buffered, so memory stays bounded regardless of the
+    capture size.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._record_header = None
+        self._link_layer = None
+        self._time_unit = None
+        self.linktype = None
+        self.packet_count = 0
+
+    def _parse_global_header(self):
+        magic = bytes(self._buffer[:4])
+        if magic not in PCAP_MAGIC:
+            raise ValueError("Not a pcap stream (bad magic number)")
+        endian, nanosecond = PCAP_MAGIC[magic]
+        self.linktype = struct.unpack_from(endian + 'I', self._buffer, 20)[0]
+        self._record_header = struct.Struct(endian + 'IIII')
+        self._link_layer = link_layer_class(self.linktype)
+        self._time_unit = Decimal(10) ** Decimal(-9 if nanosecond else -6)
+        del self._buffer[:GLOBAL_HEADER_LEN]
+
+    def feed(self, data):
+        """Add bytes to the stream and return the packets completed by them."""
+        self._buffer += data
+        if self._record_header is None:
+            if len(self._buffer) < GLOBAL_HEADER_LEN:
+                return []
+            self._parse_global_header()
+
+        packets = []
+        buffer = self._buffer
+        offset = 0
+        while len(buffer) - offset >= RECORD_HEADER_LEN:
+            sec, frac, caplen, wirelen = self._record_header.unpack_from(buffer, offset)
+            if caplen > MAX_RECORD_LEN:
+                raise ValueError(f"Corrupt pcap stream (record of {caplen} bytes)")
+            end = offset + RECORD_HEADER_LEN + caplen
+            if len(buffer) < end:
+                break
+            packets.append(build_packet(
+                self._link_layer,
+                bytes(buffer[offset + RECORD_HEADER_LEN:end]),
+                EDecimal(sec + self._time_unit * frac),
+                wirelen
+            ))
+            offset = end
+        del buffer[:offset]
+        self.packet_count += len(packets)
+        return packets
+
+    def close(self):
+        """Finish the stream, warning about a truncated trailing record."""
+        if self._record_header is None and self._buffer:
+            raise ValueError("Not a pcap stream (truncated header)")
+        if self._buffer:
+            logger.warning(f"Ignoring {len(self._buffer)} bytes of a truncated trailing record")
+            self._buffer.clear()
+
+
+class PcapNgStreamParser:
+    """
+    Incremental (push) parser for pcapng byte streams.
+
+    Supports multiple sections and interfaces, per-interface link types and
+    timestamp resolution (if_tsresol) and offset (if_tsoffset), and the
+    Enhanced, Simple and obsolete Packet blocks. Other blocks are skipped.
+    Packets carry their interface's name (if_name), or its id, as sniffed_on.
+    """
+
+    SECTION_HEADER = 0x0A0D0D0A
+    INTERFACE_DESCRIPTION = 0x00000001
+    OBSOLETE_PACKET = 0x00000002
+    SIMPLE_PACKET = 0x00000003
+    ENHANCED_PACKET = 0x00000006
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.endian = None
+        self.interfaces = []  # (link layer class, linktype, tsresol, tsoffset, snaplen, name)
+        self.section = -1
+        self.packet_count = 0
+
+    def feed(self, data):
+        """Add bytes to the stream and return the packets completed by them."""
+        self._buffer += data
+        packets = []
+        buffer = self._buffer
+        offset = 0
+        while len(buffer) - offset >= 12:
+            if bytes(buffer[offset:offset + 4]) == PCAPNG_MAGIC:
+                # A section header carries its own byte order
+                magic = bytes(buffer[offset + 8:offset + 12])
+                if magic == b'\x4d\x3c\x2b\x1a':
+                    self.endian = '<'
+                elif magic == b'\x1a\x2b\x3c\x4d':
+                    self.endian = '>'
+                else:
+                    raise ValueError("Not a pcapng stream (bad byte-order magic)")
+            elif self.endian is None:
+                raise ValueError("Not a pcapng stream (missing section header)")
+
+            block_type, block_len = struct.unpack_from(self.endian + 'II', buffer, offset)
+            if block_len < 12 or block_len % 4 or block_len > MAX_BLOCK_LEN:
+                raise ValueError(f"Corrupt pcapng stream (block of {block_len} bytes)")
+            end = offset + block_len
+            if len(buffer) < end:
+                break
+            packet = self._read_block(block_type, bytes(buffer[offset + 8:end - 4]))
+            if packet is not None:
+                packets.append(packet)
+            offset = end
+        del buffer[:offset]
+        self.packet_count += len(packets)
+        return packets
+
+    def _read_options(self, data):
+        options = {}
+        offset = 0
+        while len(data) - offset >= 4:
+            code, length = struct.unpack_from(self.endian + 'HH', data, offset)
+            if code == 0:  # opt_endofopt
+                break
+            options[code] = data[offset + 4:offset + 4 + length]
+            offset += 4 + length + (-length) % 4
+        return options
+
+    def _read_block(self, block_type, body):
+        if block_type == self.SECTION_HEADER:
+            self.interfaces = []
+            self.section += 1
+        elif block_type == self.INTERFACE_DESCRIPTION:
+            linktype, snaplen = struct.unpack_from(self.endian + 'HxxI', body)
+            options = self._read_options(body[8:])
+            tsresol = 1000000
+            if options.get(9):  # if_tsresol; an empty option keeps the default
+                value = options[9][0]
+                tsresol = 2 ** (value & 0x7F) if value & 0x80 else 10 ** value
+            tsoffset = 0
+            if len(options.get(14, b'')) >= 8:  # if_tsoffset
+                tsoffset = struct.unpack(self.endian + 'q', options[14][:8])[0]
+            if 2 in options:  # if_name
+                name = options[2].rstrip(b'\0').decode('utf-8', 'replace')
+            else:
+                # Interface ids restart in every section (e.g. concatenated captures)
+                interface_id = len(self.interfaces)
+                name = f'interface {interface_id}' if self.section == 0 else f'interface {self.section}.{interface_id}'
+            self.interfaces.append((link_layer_class(linktype), linktype, tsresol, tsoffset, snaplen, name))
+        elif block_type == self.ENHANCED_PACKET:
+            interface_id, ts_high, ts_low, caplen, wirelen = struct.unpack_from(self.endian + '5I', body)
+            return self._packet(interface_id, body[20:20 + caplen], ts_high, ts_low, wirelen)
+        elif block_type == self.OBSOLETE_PACKET:
+            interface_id, _, ts_high, ts_low, caplen, wirelen = struct.unpack_from(self.endian + 'HH4I', body)
+            return self._packet(interface_id, body[20:20 + caplen], ts_high, ts_low, wirelen)
+        elif block_type == self.SIMPLE_PACKET:
+            # Simple packets are captured on the first interface and carry no timestamp
+            wirelen = struct.unpack_from(self.endian + 'I', body)[0]
+            snaplen = self.interfaces[0][4] if self.interfaces else 0
+            caplen = min(wirelen, snaplen) if snaplen else wirelen
+            return self._packet(0, body[4:4 + caplen], None, None, wirelen)
+        return None
+
+    def _packet(self, interface_id, data, ts_high, ts_low, wirelen):
+        if interface_id >= len(self.interfaces):
+            raise ValueError(f"Corrupt pcapng stream (unknown interface {interface_id})")
+        link_layer, _, tsresol, tsoffset, _, name = self.interfaces[interface_id]
+        timestamp = None
+        if ts_high is not None:
+            timestamp = EDecimal((ts_high << 32) + ts_low) / tsresol + tsoffset
+        return build_packet(link_layer, data, timestamp, wirelen, name)
+
+    def close(self):
+        if self._buffer:
+            logger.warning(f"Ignoring {len(self._buffer)} bytes of a truncated trailing block")
+            self._buffer.clear()
+
+
+class _StreamDecompressor:
+    """
+    Streaming decompressor that yields its output in pieces of bounded size
+    and continues across concatenated streams (gzip members, xz streams).
+    Subclasses create the decompressor of one stream and run a single
+    bounded step of it.
+    """
+
+    def __init__(self):
+        self._decompressor = None
+
+    def _new(self):
+        raise NotImplementedError
+
+    def _step(self, data):
+        """Return (output, input still to be passed, whether more output is pending)."""
+        raise NotImplementedError
+
+    def decompress(self, data):
+        """Yield the decompressed output of data."""
+        pending = False
+        while len(data) or pending:
+            if self._decompressor is None:
+                # Null bytes may pad the space between xz streams
+                data = bytes(data).lstrip(b'\0')
+                if not data:
+                    return
+                self._decompressor = self._new()
+            output, data, pending = self._step(data)
+            if output:
+                yield output
+            if self._decompressor.eof:
+                data = self._decompressor.unused_data + bytes(data)
+                self._decompressor = None
+                pending = False
+
+
+class _GzipDecompressor(_StreamDecompressor):
+    def _new(self):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def _step(self, data):
+        output = self._decompressor.decompress(data, DECOMPRESS_OUTPUT)
+        # A full output buffer may leave output pending without any input left
+        return output, self._decompressor.unconsumed_tail, len(output) == DECOMPRESS_OUTPUT
+
+
+class _XzDecompressor(_StreamDecompressor):
+    def _new(self):
+        return lzma.LZMADecompressor()
+
+    def _step(self, data):
+        # Input beyond what max_length allows is buffered by the decompressor
+        output = self._decompressor.decompress(data, DECOMPRESS_OUTPUT)
+        return output, b'', not self._decompressor.needs_input
+
+
+class _InputExhausted(Exception):
+    pass
+
+
+class _PushedInput:
+    """File-like source of a zstd stream reader that is fed by push."""
+
+    def __init__(self):
+        self._data = b''
+
+    def add(self, data):
+        self._data += bytes(data)
+
+    def read(self, size=-1):
+        # Returning b'' would end the reader's stream for good
+        if not self._data:
+            raise _InputExhausted
+        if size < 0:
+            size = len(self._data)
+        data, self._data = self._data[:size], self._data[size:]
+        return data
+
+
+class _ZstdDecompressor:
+    """
+    zstandard's decompressobj has no output limit, so zstd input is pushed
+    to a stream reader instead: it reads across concatenated frames and
+    read1() returns at most DECOMPRESS_OUTPUT bytes per call.
+    """
+
+    def __init__(self):
+        self._input = _PushedInput()
+        self._reader = zstandard.ZstdDecompressor().stream_reader(self._input, read_across_frames=True)
+
+    def decompress(self, data):
+        """Yield the decompressed output of data."""
+        self._input.add(data)
+        while True:
+            try:
+                output = self._reader.read1(DECOMPRESS_OUTPUT)
+            except _InputExhausted:
+                return
+            if not output:
+                return
+            yield output
+
+
+def _make_decompressor(head):
+    """Return a decompressor for the compression format starting with head, or None."""
+    if head.startswith(GZIP_MAGIC):
+        return _GzipDecompressor()
+    if head.startswith(XZ_MAGIC):
+        return _XzDecompressor()
+    if head.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise ValueError("Reading zstd-compressed captures requires the 'zstandard' package")
+        return _ZstdDecompressor()
+    return None
+
+
+class CaptureStreamParser:
+    """
+    Push parser for any supported capture stream.
+
+    Sniffs the first bytes to pick gzip/zstd/xz decompression (if any) and
+    then pcap or pcapng parsing. feed() is a generator and must be consumed.
+    """
+
+    def __init__(self):
+        self._head = b''  # raw bytes held back until the compression is known
+        self._capture_head = b''  # capture bytes held back until the format is known
+        self._decompressor = None
+        self._parser = None
+        self._detected = False
+
+    @property
+    def packet_count(self):
+        return self._parser.packet_count if self._parser else 0
+
+    def feed(self, data):
+        """Add raw (possibly compressed) bytes and yield the completed packets."""
+        if not self._detected:
+            self._head += data
+            if len(self._head) < 6:
+                return
+            data, self._head = self._head, b''
+            self._decompressor = _make_decompressor(data)
+            self._detected = True
+
+        if self._decompressor is None:
+            yield from self._parse(data)
+            return
+        for start in range(0, len(data), DECOMPRESS_SLICE):
+            for output in self._decompressor.decompress(data[start:start + DECOMPRESS_SLICE]):
+                yield from self._parse(output)
+
+    def _parse(self, data):
+        if self._parser is None:
+            # Decompressors can return fewer bytes than the magic number
+            self._capture_head += data
+            if len(self._capture_head) < 4:
+                return
+            data, self._capture_head = self._capture_head, b''
+            self._parser = self._make_parser(data)
+        yield from self._parser.feed(data)
+
+    @staticmethod
+    def _make_parser(head):
+        if head.startswith(PCAPNG_MAGIC):
+            return PcapNgStreamParser()
+        if head[:4] in PCAP_MAGIC:
+            return PcapStreamParser()
+        raise ValueError("Unsupported capture format (expected pcap or pcapng)")
+
+    def close(self):
+        """Finish the stream; returns packets held back by a short stream."""
+        packets = []
+        if not self._detected and self._head:
+            self._detected = True
+            self._decompressor = _make_decompressor(self._head)
+            head, self._head = self._head, b''
+            if self._decompressor is None:
+                packets = list(self._parse(head))
+            else:
+                for output in self._decompressor.decompress(head):
+                    packets.extend(self._parse(output))
+        if self._parser is None:
+            if self._capture_head:
+                self._make_parser(self._capture_head)
+            raise ValueError("Empty or unsupported capture stream")
+        self._parser.close()
+        return packets
+
+
+def iter_capture_packets(capture_file, block_size=READ_BLOCK_SIZE, digest=None):
+    """
+    Yield the packets of a pcap/pcapng file, optionally gzip/zstd/xz
+    compressed. A hashlib `digest` is updated with the file's bytes as they
+    are read.
+    """
+    parser = CaptureStreamParser()
+    with open(capture_file, 'rb', buffering=0) as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            if digest is not None:
+                digest.update(block)
+            yield from parser.feed(block)
+    yield from parser.close()
+
+def find_capture_files(directory):
+    """Return the capture files in a directory, including compressed ones."""
+    files = set()
+    for extension in CAPTURE_EXTENSIONS:
+        for compression in COMPRESSION_EXTENSIONS:
+            files.update(glob.glob(os.path.join(directory, f"*{extension}{compression}")))
+    return sorted(files)
@@ -0,0 +1,276 @@
+"""
+RTCP parsing (RFC 3550 SR/RR, RFC 3611 XR) and per-capture RTCP statistics.
+
+Round-trip time is derived from the LSR/DLSR fields of report blocks (and
+LRR/DLRR of XR DLRR blocks). When the sender report an LSR refers to was
+seen in the capture, the capture time between the two reports minus DLSR is
+the round trip between the capture point and the reporter, which needs no
+clock synchronization. The two directions of a call add up to the
+end-to-end RTT wherever the capture was taken. Reports whose SR was not
+captured fall back to taking the capture clock as the sender's NTP clock.
+
+Interarrival jitter is converted from RTP timestamp units with the clock
+rate negotiated for the stream in SDP (a=rtpmap), falling back to 8 kHz.
+"""
+import logging
+import struct
+from data_processing.sdp import media_endpoints, parse_sdp, sip_sdp_body
+from utils.running_stats import RunningStats
+
+logger = logging.getLogger(__name__)
+
+RTCP_SR = 200
+RTCP_RR = 201
+RTCP_XR = 207
+RTCP_PACKET_TYPES = range(200, 208)  # SR, RR, SDES, BYE, APP, RTPFB, PSFB, XR
+
+XR_RRTR = 4
+XR_DLRR = 5
+XR_VOIP_METRICS = 7
+
+NTP_EPOCH_OFFSET = 2208988800  # seconds from 1900-01-01 to 1970-01-01
+DEFAULT_CLOCK_RATE = 8000  # RTP clock of narrowband audio, for streams whose SDP was not seen
+MAX_RTT = 10.0  # seconds; larger values come from unrelated or bogus reports
+RTT_TOLERANCE = 0.005  # seconds; timestamp noise that can make a short segment negative
+
+
+def ntp_middle32(unix_time):
+    """Return the middle 32 bits of the NTP timestamp for a Unix time (LSR format)."""
+    return int((unix_time + NTP_EPOCH_OFFSET) * 65536) & 0xFFFFFFFF
+
+def is_rtcp_payload(payload):
+    """
+    Check whether a UDP payload is an RTCP compound packet: every packet has
+    version 2, an RTCP packet type, and the lengths add up to the payload.
+    """
+    offset = 0
+    while offset + 4 <= len(payload):
+        if payload[offset] >> 6 != 2 or payload[offset + 1] not in RTCP_PACKET_TYPES:
+            return False
+        offset += (struct.unpack_from('!H', payload, offset + 2)[0] + 1) * 4
+    return offset == len(payload) and offset > 0
+
+def _report_blocks(payload, offset, count, end):
+    blocks = []
+    for _ in range(count):
+        if offset + 24 > end:
+            break
+        ssrc, lost, highest_seq, jitter, lsr, dlsr = struct.unpack_from('!IIIIII', payload, offset)
+        cumulative_lost = lost & 0xFFFFFF
+        if cumulative_lost & 0x800000:
+            cumulative_lost -= 0x1000000
+        blocks.append({
+            'ssrc': ssrc,
+            'fraction_lost': (lost >> 24) / 256,
+            'cumulative_lost': cumulative_lost,
+            'highest_seq': highest_seq,
+            'jitter': jitter,
+            'lsr': lsr,
+            'dlsr': dlsr
+        })
+        offset += 24
+    return blocks
+
+def _xr_blocks(payload, offset, end):
+    blocks = []
+    while offset + 4 <= end:
+        block_type = payload[offset]
+        block_end = offset + 4 + struct.unpack_from('!H', payload, offset + 2)[0] * 4
+        if block_end > end:
+            break
+        if block_type == XR_RRTR and block_end - offset >= 12:
+            ntp_sec, ntp_frac = struct.unpack_from('!II', payload, offset + 4)
+            blocks.append({'type': XR_RRTR, 'lrr': ((ntp_sec & 0xFFFF) << 16) | (ntp_frac >> 16)})
+        elif block_type == XR_DLRR:
+            for sub in range(offset + 4, block_end - 11, 12):
+                ssrc, lrr, dlrr = struct.unpack_from('!III', payload, sub)
+                blocks.append({'type': XR_DLRR, 'ssrc': ssrc, 'lrr': lrr, 'dlrr': dlrr})
+        elif block_type == XR_VOIP_METRICS and block_end - offset >= 36:
+            ssrc, loss_rate, discard_rate = struct.unpack_from('!IBB', payload, offset + 4)
+            round_trip_delay, = struct.unpack_from('!H', payload, offset + 16)
+            r_factor, ext_r_factor, mos_lq, mos_cq = struct.unpack_from('!BBBB', payload, offset + 24)
+            blocks.append({
+                'type': XR_VOIP_METRICS,
+                'ssrc': ssrc,
+                'loss_rate': loss_rate / 256,
+                'discard_rate': discard_rate / 256,
+                'round_trip_delay': round_trip_delay,  # ms
+                'r_factor': r_factor if r_factor != 127 else None,
+                'mos_lq': mos_lq / 10 if mos_lq != 127 else None,
+                'mos_cq': mos_cq / 10 if mos_cq != 127 else None
+            })
+        offset = block_end
+    return blocks
+
+def parse_rtcp(payload):
+    """
+    Parse an RTCP compound packet.
+
+    Returns:
+        list: One dict per SR, RR or XR packet with its 'type' and sender
+        'ssrc'; SR/RR carry 'blocks' (report blocks) and SR the sender info,
+        XR carries its RRTR, DLRR and VoIP metrics 'blocks'. Other packet
+        types are skipped.
+    """
+    packets = []
+    offset = 0
+    while offset + 8 <= len(payload):
+        count = payload[offset] & 0x1F
+        packet_type = payload[offset + 1]
+        end = min(offset + (struct.unpack_from('!H', payload, offset + 2)[0] + 1) * 4, len(payload))
+        ssrc, = struct.unpack_from('!I', payload, offset + 4)
+
+        if packet_type == RTCP_SR and end - offset >= 28:
+            ntp_sec, ntp_frac, rtp_ts, packet_count, octet_count = struct.unpack_from('!IIIII', payload, offset + 8)
+            packets.append({
+                'type': RTCP_SR,
+                'ssrc': ssrc,
+                'ntp': ((ntp_sec & 0xFFFF) << 16) | (ntp_frac >> 16),
+                'rtp_timestamp': rtp_ts,
+                'packet_count': packet_count,
+                'octet_count': octet_count,
+                'blocks': _report_blocks(payload, offset + 28, count, end)
+            })
+        elif packet_type == RTCP_RR:
+            packets.append({
+                'type': RTCP_RR,
+                'ssrc': ssrc,
+                'blocks': _report_blocks(payload, offset + 8, count, end)
+            })
+        elif packet_type == RTCP_XR:
+            packets.append({
+                'type': RTCP_XR,
+                'ssrc': ssrc,
+                'blocks': _xr_blocks(payload, offset + 8, end)
+            })
+        offset = end
+    return packets
+
+def _direction(ssrc, reporter, endpoints):
+    """Return the (pair, reporter) key of a report about `ssrc` sent by `reporter`."""
+    if endpoints:
+        return frozenset(endpoints), endpoints[0]
+    return frozenset((ssrc, reporter)), reporter
+
+def _add_sample(rtt_stats, key, rtt):
+    if -RTT_TOLERANCE <= rtt <= MAX_RTT:
+        rtt_stats.setdefault(key, RunningStats()).update(max(rtt, 0.0))
+
+
+class RtcpStats:
+    """
+    Incremental RTCP statistics for a time-ordered run of packets.
+
+    States of consecutive runs are combined with merge(), so a capture can be
+    processed in chunks. Reports whose SR (or RRTR) is in an earlier chunk are
+    kept in `pending` until merged; those still unmatched at the end fall back
+    to the capture clock in summary().
+    """
+
+    def __init__(self, clock_rate=DEFAULT_CLOCK_RATE):
+        self.clock_rate = clock_rate
+        self.clock_rates = {}  # (address, port) -> RTP clock rate negotiated in SDP
+        self.report_count = 0
+        self.reference_times = {}  # (kind, ssrc, middle 32 NTP bits) -> capture time
+        self.pending = []  # (kind, ssrc, lsr, dlsr, capture time, pair, reporter)
+        self.rtt = {}  # (pair, reporter) -> RunningStats of capture-to-reporter round trips
+        self.remote = {}  # reported source SSRC -> latest report block
+        self.xr_voip = {}  # reported source SSRC -> latest XR VoIP metrics
+
+    def add(self, time, payload, endpoints=None):
+        """
+        Process one RTCP compound packet captured at `time`.
+
+        `endpoints` is the packet's ((src ip, port), (dst ip, port)); it ties
+        the two directions of a call together across SSRC changes. Without
+        it, directions are paired by SSRC.
+        """
+        for packet in parse_rtcp(payload):
+            self.report_count += 1
+            if packet['type'] == RTCP_SR:
+                self.reference_times[('SR', packet['ssrc'], packet['ntp'])] = time
+            if packet['type'] in (RTCP_SR, RTCP_RR):
+                for block in packet['blocks']:
+                    self.remote[block['ssrc']] = dict(block, reporter=packet['ssrc'], time=time, endpoints=endpoints)
+                    if block['lsr']:
+                        self._add_rtt('SR', block['ssrc'], block['lsr'], block['dlsr'], time,
+                                      *_direction(block['ssrc'], packet['ssrc'], endpoints))
+                continue
+            for block in packet['blocks']:
+                if block['type'] == XR_RRTR:
+                    self.reference_times[('RRTR', packet['ssrc'], block['lrr'])] = time
+                elif block['type'] == XR_DLRR and block['lrr']:
+                    self._add_rtt('RRTR', block['ssrc'], block['lrr'], block['dlrr'], time,
+                                  *_direction(block['ssrc'], packet['ssrc'], endpoints))
+                elif block['type'] == XR_VOIP_METRICS:
+                    self.xr_voip[block['ssrc']] = dict(block, reporter=packet['ssrc'], time=time)
+
+    def learn_clock_rates(self, payload):
+        """Record the RTP clock rates of the media endpoints in a SIP message's SDP."""
+        body = sip_sdp_body(payload)
+        if body is not None:
+            for endpoint, info in media_endpoints(parse_sdp(body)):
+                if info['clock_rate']:
+                    self.clock_rates[endpoint] = info['clock_rate']
+
+    def remote_jitter(self, block):
+        """Return the jitter of a report block in ms, using the clock rate of its stream."""
+        clock_rate = self.clock_rate
+        if block.get('endpoints'):
+            # The report travels between the RTCP endpoints of the reported call
+            src, dst = block['endpoints']
+            clock_rate = self.clock_rates.get(dst) or self.clock_rates.get(src) or clock_rate
+        return block['jitter'] / clock_rate * 1000
+
+    def _add_rtt(self, kind, ssrc, lsr, dlsr, time, pair, reporter):
+        reference_time = self.reference_times.get((kind, ssrc, lsr))
+        if reference_time is None:
+            self.pending.append((kind, ssrc, lsr, dlsr, time, pair, reporter))
+            return
+        _add_sample(self.rtt, (pair, reporter), time - reference_time - dlsr / 65536)
+
+    def merge(self, other):
+        """Append the state of the run that follows this one in time."""
+        self.report_count += other.report_count
+        self.clock_rates.update(other.clock_rates)
+        self.reference_times.update(other.reference_times)
+        for pending in other.pending:
+            self._add_rtt(*pending)
+        for key, stats in other.rtt.items():
+            self.rtt.setdefault(key, RunningStats()).merge(stats)
+        self.remote.update(other.remote)
+        self.xr_voip.update(other.xr_voip)
+        return self
+
+    def summary(self):
+        """Return RTT (ms) and the loss and jitter reported by the remote side."""
+        pairs = {}
+        for (pair, _), stats in self.rtt.items():
+            pairs.setdefault(pair, []).append(stats.mean)
+        round_trips = [sum(segments) for segments in pairs.values()]
+        samples = sum(stats.count for stats in self.rtt.values())
+
+        fallback = {}
+        for _, _, lsr, dlsr, time, pair, _ in self.pending:
+            if pair not in pairs:
+                rtt = ((ntp_middle32(time) - lsr) & 0xFFFFFFFF) / 65536 - dlsr / 65536
+                _add_sample(fallback, pair, rtt)
+        round_trips.extend(stats.mean for stats in fallback.values())
+        samples += sum(stats.count for stats in fallback.values())
+
+        if not round_trips:
+            # XR VoIP metrics carry a round trip delay measured by the endpoint
+            round_trips = [m['round_trip_delay'] / 1000 for m in self.xr_voip.values() if m['round_trip_delay']]
+            samples = len(round_trips)
+
+        blocks = list(self.remote.values())
+        mos_values = [m['mos_lq'] for m in self.xr_voip.values() if m['mos_lq'] is not None]
+        return {
+            'report_count': self.report_count,
+            'rtt_samples': samples,
+            'round_trip_time': sum(round_trips) / len(round_trips) * 1000 if round_trips else None,
+            'remote_packet_loss_rate': sum(b['fraction_lost'] for b in blocks) / len(blocks) if blocks else None,
+            'remote_cumulative_lost': sum(b['cumulative_lost'] for b in blocks),
+            'remote_jitter': sum(self.remote_jitter(b) for b in blocks) / len(blocks) if blocks else None,
+            'remote_mos': sum(mos_values) / len(mos_values) if mos_values else None
+        }
@@ -0,0 +1,225 @@
+"""
+SDP parsing and the media flow table learned from SIP offers/answers.
+
+Every SDP body seen in SIP (INVITE, 200 OK, re-INVITE, UPDATE, ...) records
+the negotiated RTP and RTCP endpoints of its media streams, so media packets
+can be recognized by an endpoint lookup regardless of the port they use.
+"""
+import logging
+from utils.config import Config
+
+logger = logging.getLogger(__name__)
+
+# Static RTP payload types (RFC 3551) for SDP that omits a=rtpmap
+STATIC_PAYLOAD_TYPES = {
+    0: ('PCMU', 8000),
+    3: ('GSM', 8000),
+    4: ('G723', 8000),
+    8: ('PCMA', 8000),
+    9: ('G722', 8000),
+    18: ('G729', 8000),
+}
+
+
+def parse_sdp(body):
+    """
+    Parse an SDP body.
+
+    Returns:
+        dict: 'origin' (o= line without the version), session 'connection'
+        address and a 'media' list with, per m= line, its 'media' type,
+        'port', 'connection', 'rtcp_port', 'rtcp_mux', 'payload_types' and
+        'codecs' (payload type -> (encoding name, clock rate)).
+    """
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', errors='ignore')
+
+    session = {'origin': None, 'connection': None, 'media': []}
+    current = None
+    for line in body.splitlines():
+        if len(line) < 2 or line[1] != '=':
+            continue
+        kind, value = line[0], line[2:].strip()
+
+        if kind == 'o':
+            fields = value.split()
+            # Leave out the session version, which changes on every re-offer
+            session['origin'] = ' '.join(fields[:2] + fields[3:]) if len(fields) >= 6 else value
+        elif kind == 'c':
+            fields = value.split()
+            address = fields[2].split('/')[0] if len(fields) >= 3 else None
+            if current is None:
+                session['connection'] = address
+            else:
+                current['connection'] = address
+        elif kind == 'm':
+            fields = value.split()
+            if len(fields) < 3:
+                current = None
+                continue
+            try:
+                port = int(fields[1].split('/')[0])
+            except ValueError:
+                current = None
+                continue
+            payload_types = [int(pt) for pt in fields[3:] if pt.isdigit()]
+            current = {
+                'media': fields[0],
+                'port': port,
+                'protocol': fields[2],
+                'connection': None,
+                'rtcp_port': port + 1,
+                'rtcp_mux': False,
+                'payload_types': payload_types,
+                'codecs': {pt: STATIC_PAYLOAD_TYPES[pt] for pt in payload_types if pt in STATIC_PAYLOAD_TYPES}
+            }
+            session['media'].append(current)
+        elif kind == 'a' and current is not None:
+            name, _, attribute = value.partition(':')
+            if name == 'rtpmap':
+                pt, _, encoding = attribute.partition(' ')
+                parts = encoding.split('/')
+                if pt.isdigit() and len(parts) >= 2 and parts[1].isdigit():
+                    current['codecs'][int(pt)] = (parts[0], int(parts[1]))
+            elif name == 'rtcp':
+                port = attribute.split()[0] if attribute else ''
+                if port.isdigit():
+                    current['rtcp_port'] = int(port)
+            elif name == 'rtcp-mux':
+                current['rtcp_mux'] = True
+
+    for media in session['media']:
+        media['connection'] = media['connection'] or session['connection']
+    return session
+
+def sip_sdp_body(payload):
+    """Return the SDP body of a SIP message payload, or None."""
+    _, separator, body = payload.partition(b'\r\n\r\n')
+    if separator and body.lstrip().startswith(b'v=') and b'\nm=' in body:
+        return body
+    return None
+
+def media_endpoints(session):
+    """
+    Yield ((address, port), info) for the RTP and RTCP endpoints of a parsed
+    SDP session. info holds the 'media' type, the 'codec' and 'clock_rate'
+    of the first listed payload type, 'rtcp_mux' and 'protocol'.
+    """
+    for media in session['media']:
+        address = media['connection']
+        # Port 0 removes the stream, 0.0.0.0 puts it on hold
+        if not media['port'] or not address or address in ('0.0.0.0', '::'):
+            continue
+        codec, clock_rate = (None, None)
+        if media['payload_types'] and media['payload_types'][0] in media['codecs']:
+            codec, clock_rate = media['codecs'][media['payload_types'][0]]
+        info = {
+            'media': media['media'],
+            'codec': codec,
+            'clock_rate': clock_rate,
+            'rtcp_mux': media['rtcp_mux']
+        }
+        yield (address, media['port']), dict(info, protocol='RTP')
+        if not media['rtcp_mux']:
+            yield (address, media['rtcp_port']), dict(info, protocol='RTCP')
+
+def sip_header(payload, *names):
+    """Return the value of a SIP header, given its lower-case long and compact names, or None."""
+    headers = payload.split(b'\r\n\r\n', 1)[0]
+    for line in headers.split(b'\r\n'):
+        name, separator, value = line.partition(b':')
+        if separator and name.strip().lower() in names:
+            return value.strip().decode('utf-8', errors='ignore')
+    return None
+
+def sip_call_id(payload):
+    """Return the Call-ID header value of a SIP message payload, or None."""
+    return sip_header(payload, b'call-id', b'i')
+
+
+class MediaFlowTable:
+    """
+    Negotiated media endpoints learned from SDP.
+
+    Maps (address, port) to the dialog, media type, codec and whether the
+    endpoint carries RTP or RTCP. A new offer or answer from the same SDP
+    originator in the same dialog (e.g. a re-INVITE moving the media)
+    replaces that side's previous endpoints. A dialog's endpoints are
+    forgotten on BYE or CANCEL, or once it has seen no SIP for `ttl` seconds
+    of capture time, so ports reused by later calls are not misattributed.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = Config.MEDIA_FLOW_TTL if ttl is None else ttl
+        self.endpoints = {}  # (address, port) -> endpoint info
+        self._sides = {}  # (call_id, origin) -> endpoints announced by that side
+        self._dialogs = {}  # call_id -> (sides with endpoints, time of last SIP)
+        self._next_expiry = None
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def learn(self, payload, time=None):
+        """
+        Update the table from a SIP message: record the media endpoints of
+        its SDP, or forget the dialog's endpoints on BYE and CANCEL.
+        `time` is the message's capture time, used to expire idle dialogs.
+        Returns the number of endpoints learned.
+        """
+        call_id = sip_call_id(payload)
+        if time is not None:
+            self._expire(time)
+            if call_id in self._dialogs:
+                self._dialogs[call_id][1] = time
+        if payload.startswith((b'BYE ', b'CANCEL ')):
+            self.forget(call_id)
+            return 0
+
+        body = sip_sdp_body(payload)
+        if body is None:
+            return 0
+        session = parse_sdp(body)
+
+        side = (call_id, session['origin'] or session['connection'])
+        self._drop_side(side)
+
+        learned = []
+        for endpoint, info in media_endpoints(session):
+            self.endpoints[endpoint] = dict(info, call_id=call_id, side=side)
+            learned.append(endpoint)
+        self._sides[side] = learned
+        dialog = self._dialogs.setdefault(call_id, [set(), time])
+        dialog[0].add(side)
+        if time is not None:
+            dialog[1] = time
+        return len(learned)
+
+    def forget(self, call_id):
+        """Remove the endpoints of a dialog."""
+        sides, _ = self._dialogs.pop(call_id, ((), None))
+        for side in sides:
+            self._drop_side(side)
+
+    def _drop_side(self, side):
+        for endpoint in self._sides.pop(side, ()):
+            if self.endpoints.get(endpoint, {}).get('side') == side:
+                del self.endpoints[endpoint]
+
+    def _expire(self, now):
+        # Sweeping every ttl/8 seconds bounds how long an idle dialog
+        # outlives its ttl without scanning the table per message
+        if not self.ttl or (self._next_expiry is not None and now < self._next_expiry):
+            return
+        self._next_expiry = now + self.ttl / 8
+        idle = [
+            call_id for call_id, (_, last_seen) in self._dialogs.items()
+            if last_seen is not None and now - last_seen > self.ttl
+        ]
+        for call_id in idle:
+            self.forget(call_id)
+        if idle:
+            logger.debug("Expired media endpoints of %d idle dialogs", len(idle))
+
+    def lookup(self, src, sport, dst, dport):
+        """Return the endpoint info for a UDP flow, matching the destination first."""
+        return self.endpoints.get((dst, dport)) or self.endpoints.get((src, sport))
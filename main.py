@@ -1,14 +1,22 @@
-import sys
+import argparse
+import hashlib
 import os
+import threading
 from pathlib import Path
 import numpy as np
+from data_processing.dedup import PacketDeduplicator, deduplicate_packets
 from data_processing.pcap_processor import extract_packets, filter_voip_packets
 from ml_models.feature_extraction import extract_features
 from ml_models.model import VoIPQualityModel
 from ml_models.advanced_metrics import AdvancedVoIPMetrics
 from ml_models.traffic_analyzer import VoIPTrafficAnalyzer
+from ml_models.parallel_analysis import analyze_capture_parallel, call_records, call_states
+from ml_models.timeline import build_timeline
 from utils.logger import setup_logger
 from utils.config import Config
+from utils.profiling import StageProfiler, metrics
+from utils.result_cache import AnalysisCache, file_digest
+from utils.metrics_store import MetricsStore
 
 def get_packet_time(packet_tuple):
     """Extract time from a packet tuple."""
@@ -58,107 +66,252 @@ def process_voip_call(voip_packets):
     
     return call_data
 
-def main(pcap_file):
-    # Set up logging
-    logger = setup_logger()
+def analyze_capture(pcap_file, profiler, logger, workers=1, chunk_seconds=None, digest=None):
+    """
+    Run the analysis pipeline on a capture.
 
-    # Ensure the PCAP file exists
-    if not os.path.isfile(pcap_file):
-        logger.error(f"PCAP file {pcap_file} does not exist.")
-        return
+    Returns a dict with call_data, qos_report, traffic_behavior, anomalies,
+    the per-call metrics (calls), the bucketed timeline and the tap duplicate
+    counts, or None if the capture holds no VoIP call. A hashlib `digest`
+    is updated with the capture's bytes while it is read (in parallel mode,
+    by a thread reading it alongside the workers).
+    """
+    # Initialize analyzers
+    quality_metrics = AdvancedVoIPMetrics()
+    traffic_analyzer = VoIPTrafficAnalyzer()
 
-    try:
-        # Initialize analyzers
-        quality_metrics = AdvancedVoIPMetrics()
-        traffic_analyzer = VoIPTrafficAnalyzer()
+    if workers > 1 or chunk_seconds:
+        # Steps 1-3: Extract, filter and process chunks of the capture in parallel
+        logger.info("Analyzing the PCAP file in parallel chunks...")
+        with profiler.stage('parallel_chunks') as stage:
+            hasher = threading.Thread(target=file_digest, args=(pcap_file, digest)) if digest is not None else None
+            if hasher is not None:
+                hasher.start()
+            try:
+                state = analyze_capture_parallel(pcap_file, workers=workers, chunk_seconds=chunk_seconds)
+            finally:
+                if hasher is not None:
+                    hasher.join()
+            call_data = state.call_data() if state else None
+            stage.packets = call_data['packet_count'] if call_data else 0
+
+        if not call_data:
+            logger.error("No VoIP packets found in the PCAP file.")
+            return None
 
+        patterns = state.traffic_patterns()
+        flow_metrics = state.flow_metrics()
+        with profiler.stage('per_call'):
+            calls = call_records(state.calls, quality_metrics)
+        duplicates = state.duplicates.summary()
+    else:
         # Step 1: Extract packets from the PCAP file
         logger.info("Extracting packets from the PCAP file...")
-        packets = extract_packets(pcap_file)
+        with profiler.stage('read') as stage:
+            packets = extract_packets(pcap_file, digest)
+            stage.packets = len(packets)
+
+        # Drop packets captured more than once (e.g. at several taps)
+        logger.info("Removing duplicate packets...")
+        deduplicator = PacketDeduplicator(tap=os.path.basename(pcap_file))
+        with profiler.stage('dedup', packets=len(packets)):
+            packets = list(deduplicate_packets(packets, deduplicator))
+        duplicates = deduplicator.stats.summary()
 
         # Step 2: Filter for VoIP packets
         logger.info("Filtering for VoIP packets...")
-        voip_packets = filter_voip_packets(packets)
+        with profiler.stage('filter', packets=len(packets)):
+            voip_packets = filter_voip_packets(packets)
 
         if not voip_packets:
             logger.error("No VoIP packets found in the PCAP file.")
-            return
+            return None
 
         # Step 3: Process VoIP packets into call data
         logger.info("Processing VoIP packets...")
-        call_data = process_voip_call(voip_packets)
+        with profiler.stage('call_grouping', packets=len(voip_packets)):
+            call_data = process_voip_call(voip_packets)
 
         if not call_data:
             logger.error("Could not process VoIP call data.")
-            return
+            return None
 
-        # Step 4: Perform advanced analysis
-        logger.info("Performing advanced analysis...")
-        
-        # Extract traffic patterns
-        patterns = traffic_analyzer.extract_traffic_patterns(voip_packets)
+        with profiler.stage('pattern_extraction', packets=len(voip_packets)):
+            patterns = traffic_analyzer.extract_traffic_patterns(voip_packets)
+        with profiler.stage('call_flow', packets=len(voip_packets)):
+            flow_metrics = quality_metrics.analyze_call_flow(voip_packets)
+        with profiler.stage('per_call', packets=len(voip_packets)):
+            calls = call_records(call_states(voip_packets, quality_metrics), quality_metrics)
+
+    # Step 4: Perform advanced analysis
+    logger.info("Performing advanced analysis...")
+    
+    # Analyze traffic patterns
+    with profiler.stage('traffic_behavior'):
         traffic_behavior = traffic_analyzer.analyze_traffic_behavior(patterns)
+    with profiler.stage('anomaly_fit', packets=patterns['packet_count']):
         anomalies = traffic_analyzer.detect_anomalies(patterns)
-        
-        # Calculate advanced metrics
-        flow_metrics = quality_metrics.analyze_call_flow(voip_packets)
+    
+    # Calculate advanced metrics
+    with profiler.stage('qos_report'):
         qos_report = quality_metrics.generate_qos_report(call_data, flow_metrics)
+    with profiler.stage('timeline'):
+        timeline = build_timeline(patterns, flow_metrics)
+
+    return {
+        'call_data': call_data,
+        'qos_report': qos_report,
+        'traffic_behavior': traffic_behavior,
+        'anomalies': anomalies,
+        'calls': calls,
+        'timeline': timeline,
+        'duplicates': duplicates
+    }
+
+def main(pcap_file, workers=1, chunk_seconds=None, profile=False, profile_dump=None, use_cache=True,
+         store_metrics=True, log_format=None):
+    # Set up logging
+    logger = setup_logger(json_format=log_format == 'json' if log_format else None)
+
+    # Ensure the PCAP file exists
+    if not os.path.isfile(pcap_file):
+        logger.error(f"PCAP file {pcap_file} does not exist.")
+        return
+
+    profiler = StageProfiler(
+        registry=metrics,
+        trace_allocations=bool(profile_dump),
+        cprofile=bool(profile_dump)
+    ).start()
+
+    try:
+        # Reuse the stored analysis if this exact capture was analyzed before.
+        # The digest of an unchanged file is remembered; otherwise the file
+        # is hashed while it is read for analysis.
+        cache = AnalysisCache() if use_cache else None
+        digest = cache.known_digest(pcap_file) if cache else None
+        results = cache.get(cache.make_key(digest)) if digest else None
+
+        if results is None:
+            sha256 = hashlib.sha256()
+            results = analyze_capture(pcap_file, profiler, logger, workers=workers,
+                                      chunk_seconds=chunk_seconds, digest=sha256)
+            digest = sha256.hexdigest()
+            if cache:
+                cache.remember_digest(pcap_file, digest)
+            if results is None:
+                return
+            if cache:
+                cache.put(cache.make_key(digest), results)
+
+        if store_metrics:
+            with profiler.stage('store'), MetricsStore() as store:
+                if not store.has_capture(digest):
+                    store.record_capture(digest, os.path.basename(pcap_file), results['calls'])
+
+        call_data = results['call_data']
+        qos_report = results['qos_report']
+        traffic_behavior = results['traffic_behavior']
+        anomalies = results['anomalies']
 
         # Step 5: Extract features and predict quality
         logger.info("Extracting features...")
-        features = extract_features([call_data])
+        with profiler.stage('feature_extraction'):
+            features = extract_features([call_data])
 
         # Step 6: Load and use the ML model
         logger.info("Loading the machine learning model...")
-        model = VoIPQualityModel()
-        model.load_model(Config.MODEL_PATH)
-        quality_prediction = model.predict(features)
+        with profiler.stage('model_load'):
+            model = VoIPQualityModel()
+            model.load_model(Config.MODEL_PATH)
+        with profiler.stage('model_predict'):
+            quality_prediction = model.predict(features)
 
         # Output comprehensive analysis results
         logger.info("\n=== VoIP Call Analysis Report ===")
         
         logger.info("\nBasic Call Statistics:")
-        logger.info(f"Duration: {call_data['duration']:.2f} seconds")
-        logger.info(f"Total Packets: {call_data['packet_count']}")
-        logger.info(f"SIP/RTP Ratio: {call_data['sip_count']}/{call_data['rtp_count']}")
+        logger.info("Duration: %.2f seconds", call_data['duration'])
+        logger.info("Total Packets: %s", call_data['packet_count'])
+        logger.info("SIP/RTP Ratio: %s/%s", call_data['sip_count'], call_data['rtp_count'])
+        logger.info("SIP Dialogs: %d", len(results['calls']))
+        duplicates = results['duplicates']
+        if duplicates['duplicates']:
+            logger.info("Duplicate Packets Dropped: %d (%.2f%%)",
+                        duplicates['duplicates'], duplicates['duplicate_rate'] * 100)
+            for tap in duplicates['taps'][:5]:
+                if tap['duplicates']:
+                    logger.info("- %s: %d/%d (%.2f%%)", tap['tap'], tap['duplicates'],
+                                tap['packets'], tap['duplicate_rate'] * 100)
         
+        quality_metrics = qos_report['quality_metrics']
         logger.info("\nQuality Metrics:")
-        logger.info(f"MOS Score: {qos_report['quality_metrics']['mos']:.2f}")
-        logger.info(f"Jitter: {qos_report['quality_metrics']['jitter']:.2f} ms")
-        logger.info(f"Packet Loss Rate: {qos_report['quality_metrics']['packet_loss_rate']*100:.2f}%")
-        logger.info(f"Call Setup Time: {qos_report['quality_metrics']['setup_time']:.3f} seconds")
+        logger.info("MOS Score: %.2f", quality_metrics['mos'])
+        logger.info("Jitter: %.2f ms", quality_metrics['jitter'])
+        logger.info("Packet Loss Rate: %.2f%%", quality_metrics['packet_loss_rate'] * 100)
+        logger.info("Call Setup Time: %.3f seconds", quality_metrics['setup_time'])
+        if quality_metrics['round_trip_time'] is not None:
+            logger.info("Round-Trip Time (RTCP): %.1f ms", quality_metrics['round_trip_time'])
+        if quality_metrics['remote_packet_loss_rate'] is not None:
+            logger.info("Remote Packet Loss (RTCP): %.2f%%", quality_metrics['remote_packet_loss_rate'] * 100)
+            logger.info("Remote Jitter (RTCP): %.2f ms", quality_metrics['remote_jitter'])
         
         if qos_report['anomalies']:
             logger.info("\nDetected Anomalies:")
             for anomaly in qos_report['anomalies']:
-                logger.info(f"- {anomaly}")
+                logger.info("- %s", anomaly)
         
         logger.info("\nTraffic Pattern Analysis:")
         if traffic_behavior['burst_statistics']:
-            logger.info(f"Burst Count: {traffic_behavior['burst_statistics']['count']}")
-            logger.info(f"Average Burst Duration: {traffic_behavior['burst_statistics']['avg_duration']:.3f} seconds")
-        logger.info(f"Protocol Distribution: {traffic_behavior['protocol_distribution']['protocol_counts']}")
+            logger.info("Burst Count: %s", traffic_behavior['burst_statistics']['count'])
+            logger.info("Average Burst Duration: %.3f seconds", traffic_behavior['burst_statistics']['avg_duration'])
+        logger.info("Protocol Distribution: %s", traffic_behavior['protocol_distribution']['protocol_counts'])
         
         logger.info("\nML Model Prediction:")
-        logger.info(f"Predicted Call Quality: {'Good' if quality_prediction[0] == 1 else 'Poor'}")
+        logger.info("Predicted Call Quality: %s", 'Good' if quality_prediction[0] == 1 else 'Poor')
         
         # Detailed anomaly analysis
         if anomalies:
             logger.info("\nDetailed Anomaly Analysis:")
+            # Lazy %-formatting: lines beyond the rate limit are dropped unformatted
             for i, anomaly in enumerate(anomalies, 1):
-                logger.info(f"\nAnomaly {i}:")
-                logger.info(f"Timestamp: {anomaly['timestamp']:.3f}")
-                logger.info(f"Protocol: {anomaly['protocol']}")
-                logger.info(f"Packet Size: {anomaly['packet_size']} bytes")
+                logger.info("\nAnomaly %d:", i, extra={'anomaly': anomaly})
+                logger.info("Timestamp: %.3f", anomaly['timestamp'])
+                logger.info("Protocol: %s", anomaly['protocol'])
+                logger.info("Packet Size: %s bytes", anomaly['packet_size'])
                 if anomaly['inter_arrival']:
-                    logger.info(f"Inter-arrival Time: {anomaly['inter_arrival']*1000:.2f} ms")
+                    logger.info("Inter-arrival Time: %.2f ms", anomaly['inter_arrival'] * 1000)
 
     except Exception as e:
         logger.error(f"An error occurred: {str(e)}")
         raise
 
+    finally:
+        profiler.stop()
+        if profile or profile_dump:
+            profiler.log_report(logger)
+        if profile_dump:
+            for path in profiler.dump(profile_dump):
+                logger.info(f"Profile written to {path}")
+
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python main.py /path/to/yourfile.pcap")
-    else:
-        main(sys.argv[1])
+    parser = argparse.ArgumentParser(description="Analyze VoIP calls in a PCAP file")
+    parser.add_argument("pcap_file", help="path to the PCAP file")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="split the capture into chunks and analyze them with this many processes")
+    parser.add_argument("--chunk-seconds", type=float, default=None,
+                        help="split the capture by capture time instead of by size")
+    parser.add_argument("--profile", action="store_true",
+                        help="report wall/CPU time, packet rate and peak RSS per pipeline stage")
+    parser.add_argument("--profile-dump", metavar="PREFIX", default=None,
+                        help="also write a cProfile trace (PREFIX.prof) and tracemalloc report (PREFIX.tracemalloc.txt)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always reanalyze instead of reusing a cached result for the same capture")
+    parser.add_argument("--no-store", action="store_true",
+                        help="do not record per-call metrics in the metrics store")
+    parser.add_argument("--log-format", choices=['text', 'json'], default=None,
+                        help="log as text or JSON lines (defaults to Config.LOG_FORMAT)")
+    args = parser.parse_args()
+    main(args.pcap_file, workers=args.workers, chunk_seconds=args.chunk_seconds,
+         profile=args.profile, profile_dump=args.profile_dump, use_cache=not args.no_cache,
+         store_metrics=not args.no_store, log_format=args.log_format)
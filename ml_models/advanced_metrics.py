@@ -1,8 +1,60 @@
 import numpy as np
 from scipy import stats
-from collections import defaultdict
+from collections import defaultdict, deque
+from scapy.all import Raw
+from scapy.layers.inet import IP, UDP
+from data_processing.rtcp import RtcpStats
+from data_processing.sdp import sip_call_id, sip_header
+from utils.running_stats import RunningStats
+
+def _raw_load(pkt):
+    """Return the application payload of a packet, or None."""
+    return pkt[Raw].load if Raw in pkt else None
+
+def _endpoints(pkt):
+    """Return ((src ip, src port), (dst ip, dst port)) of a UDP/IP packet, or None."""
+    if IP in pkt and UDP in pkt:
+        return (pkt[IP].src, pkt[UDP].sport), (pkt[IP].dst, pkt[UDP].dport)
+    return None
+
+class RtpStreamStats:
+    """Packet count, first/last time and inter-arrival statistics of one RTP stream."""
+
+    def __init__(self):
+        self.start_time = None
+        self.end_time = None
+        self.packet_count = 0
+        self.gaps = RunningStats()
+
+    @classmethod
+    def from_times(cls, times):
+        stats = cls()
+        if times:
+            stats.start_time, stats.end_time = times[0], times[-1]
+            stats.packet_count = len(times)
+            stats.gaps.update_batch(np.diff(times))
+        return stats
+
+    def merge(self, other):
+        """Append the stats of the same stream over later packets."""
+        if other.packet_count:
+            if self.packet_count:
+                self.gaps.update(other.start_time - self.end_time)
+            else:
+                self.start_time = other.start_time
+            self.gaps.merge(other.gaps)
+            self.end_time = other.end_time
+            self.packet_count += other.packet_count
+        return self
+
+    @property
+    def jitter(self):
+        """Standard deviation of the inter-arrival times in seconds."""
+        return self.gaps.std
 
 class AdvancedVoIPMetrics:
+    LOSS_WINDOW_SIZE = 50  # packets
+
     def __init__(self):
         self.metrics = {}
     
@@ -20,55 +72,79 @@ class AdvancedVoIPMetrics:
         flow_metrics = {
             'setup_time': 0,
             'teardown_time': 0,
+            'sip_invites': {},  # Call-ID -> time of the first INVITE
+            'sip_answers': {},  # Call-ID -> time of the first 2xx response to an INVITE
             'rtp_streams': defaultdict(list),
             'packet_loss_windows': [],
-            'burst_periods': []
+            'packet_loss_times': [],  # capture time of the packet that completed each window
+            'burst_periods': [],
+            'rtcp': RtcpStats()
         }
         
-        # Track SIP transactions
-        sip_transactions = {}
-        current_window_packets = []
-        window_size = 50  # packets
+        # Sequence numbers of the last LOSS_WINDOW_SIZE packets of each RTP stream
+        windows = defaultdict(lambda: deque(maxlen=self.LOSS_WINDOW_SIZE))
         
         for i, (proto, pkt) in enumerate(packets):
+            load = _raw_load(pkt)
             if proto == 'SIP':
-                if hasattr(pkt, 'Raw') and hasattr(pkt.Raw, 'load'):
-                    if b'INVITE' in pkt.Raw.load:
-                        flow_metrics['setup_time'] = float(pkt.time)
-                    elif b'BYE' in pkt.Raw.load:
+                if load is not None:
+                    # Clock rates from SDP convert the jitter of RTCP reports
+                    flow_metrics['rtcp'].learn_clock_rates(load)
+                    if load.startswith(b'INVITE '):
+                        flow_metrics['sip_invites'].setdefault(sip_call_id(load), float(pkt.time))
+                    elif load.startswith(b'SIP/2.0 2') and (sip_header(load, b'cseq') or '').endswith('INVITE'):
+                        flow_metrics['sip_answers'].setdefault(sip_call_id(load), float(pkt.time))
+                    elif b'BYE' in load:
                         flow_metrics['teardown_time'] = float(pkt.time)
             
             elif proto == 'RTP':
-                if hasattr(pkt, 'Raw') and hasattr(pkt.Raw, 'load') and len(pkt.Raw.load) >= 12:
+                if load is not None and len(load) >= 12:
                     # Track RTP streams by SSRC
-                    ssrc = int.from_bytes(pkt.Raw.load[8:12], byteorder='big')
-                    flow_metrics['rtp_streams'][ssrc].append(float(pkt.time))
+                    ssrc = int.from_bytes(load[8:12], byteorder='big')
+                    time = float(pkt.time)
+                    flow_metrics['rtp_streams'][ssrc].append(time)
                     
-                    # Sliding window packet loss analysis
-                    current_window_packets.append(pkt)
-                    if len(current_window_packets) >= window_size:
-                        loss_rate = self._calculate_window_loss(current_window_packets)
-                        flow_metrics['packet_loss_windows'].append(loss_rate)
-                        current_window_packets = current_window_packets[1:]
+                    # Sliding window packet loss analysis per stream
+                    window = windows[ssrc]
+                    window.append(int.from_bytes(load[2:4], byteorder='big'))
+                    if len(window) == self.LOSS_WINDOW_SIZE:
+                        flow_metrics['packet_loss_windows'].append(self._sequence_loss(window))
+                        flow_metrics['packet_loss_times'].append(time)
+
+            elif proto == 'RTCP':
+                if load is not None:
+                    # Round-trip time and remote loss/jitter from SR/RR/XR reports
+                    flow_metrics['rtcp'].add(float(pkt.time), load, _endpoints(pkt))
         
+        flow_metrics['setup_time'] = self.setup_time(flow_metrics['sip_invites'], flow_metrics['sip_answers'])
+        # Summaries that chunked analyses can merge (see parallel_analysis.ChunkState)
+        flow_metrics['rtp_stream_stats'] = {
+            ssrc: RtpStreamStats.from_times(times) for ssrc, times in flow_metrics['rtp_streams'].items()
+        }
+        flow_metrics['packet_loss'] = RunningStats()
+        flow_metrics['packet_loss'].update_batch(flow_metrics['packet_loss_windows'])
+        flow_metrics['packet_loss_max'] = max(flow_metrics['packet_loss_windows'], default=0)
         return flow_metrics
 
-    def _calculate_window_loss(self, window_packets):
-        """Calculate packet loss rate in a window"""
-        try:
-            sequence_numbers = []
-            for p in window_packets:
-                if hasattr(p, 'Raw') and hasattr(p.Raw, 'load') and len(p.Raw.load) >= 4:
-                    seq = int.from_bytes(p.Raw.load[2:4], byteorder='big')
-                    sequence_numbers.append(seq)
-            
-            if sequence_numbers:
-                expected = max(sequence_numbers) - min(sequence_numbers) + 1
-                received = len(sequence_numbers)
-                return (expected - received) / expected if expected > 0 else 0
-            return 0
-        except Exception:
-            return 0
+    @staticmethod
+    def setup_time(invites, answers):
+        """Mean time from INVITE to the 2xx answer over the dialogs where both were seen"""
+        durations = [answers[call_id] - invited for call_id, invited in invites.items()
+                     if call_id in answers and answers[call_id] >= invited]
+        return sum(durations) / len(durations) if durations else 0
+
+    @staticmethod
+    def _sequence_loss(sequence_numbers):
+        """Calculate packet loss rate from the RTP sequence numbers of one stream's window"""
+        if sequence_numbers:
+            # Unwrap the 16-bit sequence numbers around the first one of the window
+            first = sequence_numbers[0]
+            offsets = [(seq - first + 0x8000) % 0x10000 - 0x8000 for seq in sequence_numbers]
+            expected = max(offsets) - min(offsets) + 1
+            received = len(offsets)
+            # Duplicates can make more packets arrive than were sent
+            return max(expected - received, 0) / expected
+        return 0
 
     def detect_anomalies(self, flow_metrics):
         """Detect anomalies in call flow"""
@@ -79,13 +155,12 @@ class AdvancedVoIPMetrics:
             anomalies.append('Long call setup time')
         
         # Analyze RTP stream consistency
-        for ssrc, timestamps in flow_metrics['rtp_streams'].items():
-            intervals = np.diff(timestamps)
-            if len(intervals) > 0 and np.std(intervals) > 0.05:  # High jitter
+        for ssrc, stream in flow_metrics['rtp_stream_stats'].items():
+            if stream.packet_count > 1 and stream.jitter > 0.05:  # High jitter
                 anomalies.append(f'High jitter in RTP stream {ssrc}')
         
         # Check packet loss patterns
-        if any(loss > 0.05 for loss in flow_metrics['packet_loss_windows']):
+        if flow_metrics['packet_loss_max'] > 0.05:
             anomalies.append('Significant packet loss detected')
         
         return anomalies
@@ -101,19 +176,29 @@ class AdvancedVoIPMetrics:
             },
             'quality_metrics': {
                 'jitter': call_data['jitter'],
-                'packet_loss_rate': np.mean(flow_metrics['packet_loss_windows']) if flow_metrics['packet_loss_windows'] else 0,
+                'packet_loss_rate': flow_metrics['packet_loss'].mean,
                 'setup_time': flow_metrics['setup_time'],
-                'rtp_stream_count': len(flow_metrics['rtp_streams'])
+                'rtp_stream_count': len(flow_metrics['rtp_stream_stats'])
             },
             'anomalies': self.detect_anomalies(flow_metrics)
         }
+
+        rtcp = flow_metrics['rtcp'].summary() if flow_metrics.get('rtcp') else {}
+        report['quality_metrics'].update({
+            'round_trip_time': rtcp.get('round_trip_time'),
+            'remote_packet_loss_rate': rtcp.get('remote_packet_loss_rate'),
+            'remote_jitter': rtcp.get('remote_jitter')
+        })
+        report['rtcp'] = rtcp
         
-        # Calculate MOS
-        avg_latency = 0  # Would need to be calculated from RTP timestamps
+        # Calculate MOS, taking one-way delay as half the RTCP round-trip time
+        # and the loss seen by the far end if it exceeds the loss seen here
+        avg_latency = rtcp['round_trip_time'] / 2 if rtcp.get('round_trip_time') is not None else 0
+        packet_loss = max(report['quality_metrics']['packet_loss_rate'], rtcp.get('remote_packet_loss_rate') or 0)
         report['quality_metrics']['mos'] = self.calculate_mos(
             avg_latency,
             report['quality_metrics']['jitter'],
-            report['quality_metrics']['packet_loss_rate']
+            packet_loss
         )
         
         return report
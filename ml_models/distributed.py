@@ -0,0 +1,664 @@
+"""
+Multi-node capture processing with a coordinator and TCP workers.
+
+The coordinator holds the list of captures (DATA_DIR or a manifest) and
+hands them out one at a time, largest first, to workers that connect over
+multiprocessing.connection; any number of worker processes may run on any
+number of machines that see the captures at the same paths. Each worker
+stream-analyzes a capture (dedup, classification, per-call analysis and
+feature extraction) and sends back only compact per-call results: records
+with a predicted quality for batch scoring, or feature vectors with labels
+and start times for training ingest. Both modes share the coordinator,
+worker and analysis code and only differ in what a worker returns and what
+the coordinator does with it.
+
+Workers pull their next capture when done with the last, so fast workers
+take more. When the queue runs dry, an idle worker steals a backup copy of
+the capture that has been running longest, and the first copy to finish
+wins. A capture whose worker fails or disconnects is queued again, up to
+Config.CLUSTER_MAX_ATTEMPTS.
+
+Messages are pickled, and unpickling runs code, so the coordinator and its
+workers share a secret authkey (VOIP_CLUSTER_AUTHKEY or --authkey) and a
+peer must answer an HMAC challenge with it before anything it sends is
+unpickled. There is no default key: without one the coordinator refuses to
+listen on anything but a loopback address, and there uses a random key that
+only the local workers it starts are given. The challenge runs in each
+connection's own thread and gives up on a client silent for
+Config.CLUSTER_HANDSHAKE_TIMEOUT seconds, so a stalled client does not hold
+up other workers. Anyone with the key can run code on the cluster; run it
+on a trusted network only.
+
+    export VOIP_CLUSTER_AUTHKEY=...
+    python -m ml_models.distributed coordinator score --bind 0.0.0.0:7070
+    python -m ml_models.distributed worker --connect coordinator-host:7070 --processes 8
+    python -m ml_models.distributed coordinator train --local-workers 4
+"""
+import argparse
+import ipaddress
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import queue
+import socket
+import threading
+import time
+from collections import deque
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener, answer_challenge, deliver_challenge
+import numpy as np
+from data_processing.pcap_stream import find_capture_files
+from ml_models.feature_extraction import extract_features
+from ml_models.model import VoIPQualityModel
+from ml_models.parallel_analysis import call_records
+from ml_models.streaming_analysis import stream_capture
+from ml_models.train import determine_call_quality
+from ml_models.training_data import TrainingSetBuilder
+from utils.config import Config
+
+logger = logging.getLogger(__name__)
+
+MODES = ('score', 'train')
+
+# Columns of extract_features, for captures without calls
+N_FEATURES = 6
+
+# Seconds between connection attempts while a worker waits for its coordinator
+CONNECT_RETRY_SECONDS = 1
+
+# Fields of a scored call written to the scores file
+SCORE_FIELDS = ('call_id', 'start_time', 'duration', 'caller', 'callee', 'packet_loss_rate', 'jitter', 'mos',
+                'predicted_quality')
+
+# Models loaded by this worker process: path -> (modification time, model)
+_models = {}
+
+
+def cluster_authkey(authkey=None):
+    """Return `authkey`, else Config.CLUSTER_AUTHKEY, as bytes (None if neither is set)."""
+    authkey = authkey or Config.CLUSTER_AUTHKEY
+    if isinstance(authkey, str):
+        authkey = authkey.encode()
+    return authkey or None
+
+def is_loopback(host):
+    """Return True if `host` resolves to a loopback address."""
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+def parse_address(address):
+    """Turn 'host:port' (or just 'host' or ':port') into a (host, port) tuple."""
+    host, separator, port = (address or '').rpartition(':')
+    if not separator:
+        host, port = address, None
+    return host or Config.CLUSTER_HOST, int(port) if port else Config.CLUSTER_PORT
+
+def list_captures(directory=None, manifest=None):
+    """
+    Return the captures to process: the paths listed in a manifest (one per
+    line, '#' comments, relative to the manifest) or the capture files in
+    `directory` (defaults to Config.DATA_DIR).
+    """
+    if manifest is None:
+        return find_capture_files(directory or Config.DATA_DIR)
+    base = os.path.dirname(os.path.abspath(manifest))
+    files = []
+    with open(manifest) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                files.append(os.path.join(base, line))
+    return files
+
+def _load_model(path):
+    """Return the model at `path`, reloading it once it was replaced (e.g. promoted)."""
+    mtime = os.stat(path).st_mtime_ns
+    cached = _models.get(path)
+    if cached is None or cached[0] != mtime:
+        model = VoIPQualityModel()
+        model.load_model(path)
+        cached = _models[path] = (mtime, model)
+    return cached[1]
+
+def process_capture(capture_file, mode, model_path=None):
+    """
+    Analyze one capture and return its compact per-call results.
+
+    One streaming pass yields the per-call records of the metrics store,
+    and both modes extract their features from these records. 'train'
+    returns the feature matrix, quality labels and start times; 'score'
+    returns the records with the quality predicted by the model at
+    `model_path` (defaults to Config.MODEL_PATH).
+    """
+    digest, state = stream_capture(capture_file)
+    result = {'digest': digest, 'name': os.path.basename(capture_file), 'bytes': os.path.getsize(capture_file)}
+    records = call_records(state.calls) if state else []
+    features = extract_features(records) if records else np.empty((0, N_FEATURES))
+    if mode == 'train':
+        result.update(
+            calls=len(records),
+            features=features,
+            labels=np.array([determine_call_quality(record) for record in records], dtype=np.int8),
+            start_times=np.array([record['start_time'] for record in records], dtype=np.float64)
+        )
+    else:
+        if records:
+            predictions = _load_model(model_path or Config.MODEL_PATH).predict(features)
+            for record, quality in zip(records, predictions):
+                record['predicted_quality'] = int(quality)
+        result.update(calls=len(records), records=records)
+    return result
+
+
+class _HandshakeConnection:
+    """
+    The side of a connection seen by the authkey challenge, which gives up
+    once the client has been silent until `timeout` seconds after the start.
+    """
+
+    def __init__(self, conn, timeout):
+        self._conn = conn
+        self._deadline = time.monotonic() + timeout
+
+    def send_bytes(self, data):
+        self._conn.send_bytes(data)
+
+    def recv_bytes(self, maxlength=None):
+        if not self._conn.poll(max(self._deadline - time.monotonic(), 0)):
+            raise TimeoutError("authkey handshake timed out")
+        return self._conn.recv_bytes(maxlength)
+
+
+def _worker_name(hello):
+    """Return the worker name of a hello message; ValueError if it is malformed."""
+    if not (isinstance(hello, dict) and hello.get('type') == 'hello' and isinstance(hello.get('worker'), str)):
+        raise ValueError(f"malformed hello {hello!r:.200}")
+    return hello['worker']
+
+def _checked_reply(reply):
+    """Return a worker's reply to a task; ValueError if it is malformed."""
+    if isinstance(reply, dict):
+        result = reply.get('result')
+        if reply.get('type') == 'result' and isinstance(result, dict) and all(
+                isinstance(result.get(key), int) for key in ('calls', 'bytes')):
+            return reply
+        if reply.get('type') == 'error' and isinstance(reply.get('error'), str):
+            return reply
+    raise ValueError(f"malformed reply {reply!r:.200}")
+
+
+class Coordinator:
+    """
+    Hands captures to connected workers and collects their results.
+
+    Each worker connection is served by its own thread; results are passed
+    to the caller of results() in the order they complete.
+    """
+
+    def __init__(self, files, mode, address=None, authkey=None, steal_after=None, max_attempts=None,
+                 idle_timeout=None, handshake_timeout=None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode {mode!r}, expected one of {', '.join(MODES)}")
+        self.mode = mode
+        self.requested_address = address or (Config.CLUSTER_HOST, Config.CLUSTER_PORT)
+        self.address = None
+        self.authkey = cluster_authkey(authkey)
+        self.steal_after = Config.CLUSTER_STEAL_AFTER if steal_after is None else steal_after
+        self.max_attempts = max_attempts or Config.CLUSTER_MAX_ATTEMPTS
+        self.idle_timeout = Config.CLUSTER_IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+        self.handshake_timeout = Config.CLUSTER_HANDSHAKE_TIMEOUT if handshake_timeout is None else handshake_timeout
+
+        self.tasks = {}
+        for task_id, path in enumerate(files):
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = 0  # only the workers may see the file; they report the error
+            self.tasks[task_id] = {'id': task_id, 'path': path, 'bytes': size, 'attempts': 0, 'errors': []}
+        # Largest first, so the tail of the run is made of small captures
+        self.queue = deque(sorted(self.tasks, key=lambda task_id: -self.tasks[task_id]['bytes']))
+        self.running = {}  # task id -> {worker: monotonic start time}
+        self.finished = set()
+        self.failed = {}  # task id -> last error
+        self.workers = {}  # worker name -> statistics
+        self.connected = 0
+        self.retries = 0
+        self.stolen = 0
+        self.wasted = 0  # backup copies that lost the race
+        self.calls = 0
+        self.bytes = 0
+
+        self._cond = threading.Condition()
+        self._results = queue.Queue()
+        self._listener = None
+        self._closed = False
+        self._started_at = None
+        self._finished_at = None
+        self._idle_since = None
+
+    def start(self):
+        """
+        Start listening; self.address is the bound (host, port). Without an
+        authkey, only a loopback address is accepted and a random key is used.
+        """
+        if self.authkey is None:
+            host = self.requested_address[0]
+            if not is_loopback(host):
+                raise ValueError(f"Refusing to listen on {host or '0.0.0.0'} without a cluster authkey; "
+                                 f"set VOIP_CLUSTER_AUTHKEY or pass --authkey")
+            self.authkey = os.urandom(32)
+        # Connections are authenticated by _serve, each in its own thread
+        self._listener = Listener(self.requested_address, family='AF_INET')
+        self.address = self._listener.address
+        self._started_at = self._idle_since = time.monotonic()
+        threading.Thread(target=self._accept, name='cluster-accept', daemon=True).start()
+        logger.info(f"Coordinating {len(self.tasks)} captures ({self.mode}) on {self.address[0]}:{self.address[1]}")
+        return self
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._listener is not None:
+            self._listener.close()
+
+    def _accept(self):
+        while not self._closed:
+            try:
+                conn = self._listener.accept()
+            except ConnectionError:
+                continue
+            except OSError:
+                break  # listener closed
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _authenticate(self, conn):
+        """Run the authkey challenge both ways; False if the client fails it or stalls."""
+        handshake = _HandshakeConnection(conn, self.handshake_timeout)
+        try:
+            deliver_challenge(handshake, self.authkey)
+            answer_challenge(handshake, self.authkey)
+        except (AuthenticationError, EOFError, OSError) as e:
+            logger.warning(f"Rejected a worker connection: {e!r}")
+            return False
+        return True
+
+    def _serve(self, conn):
+        worker = None
+        task_id = None
+        try:
+            if not self._authenticate(conn):
+                return
+            worker = _worker_name(conn.recv())
+            with self._cond:
+                stats = self.workers.setdefault(worker, {
+                    'files': 0, 'calls': 0, 'bytes': 0, 'errors': 0, 'busy_seconds': 0.0,
+                    'connected_at': time.monotonic(), 'disconnected_at': None
+                })
+                stats['disconnected_at'] = None
+                self.connected += 1
+            logger.info(f"Worker {worker} connected")
+            while True:
+                task = self._next_task(worker)
+                if task is None:
+                    conn.send({'type': 'stop'})
+                    break
+                task_id = task['id']
+                conn.send({'type': 'task', 'mode': self.mode, 'task': {'id': task_id, 'path': task['path']}})
+                self._complete(worker, task_id, _checked_reply(conn.recv()))
+                task_id = None
+        except (EOFError, OSError, ValueError, pickle.UnpicklingError) as e:
+            # A worker sending anything but protocol messages is dropped like a lost one
+            logger.warning(f"Lost worker {worker}: {e!r}")
+            if task_id is not None:
+                self._complete(worker, task_id, {'type': 'error', 'error': f"worker lost: {e!r}"})
+        finally:
+            conn.close()
+            if worker is not None:
+                with self._cond:
+                    self.connected -= 1
+                    self.workers[worker]['disconnected_at'] = time.monotonic()
+                    if not self.connected:
+                        self._idle_since = time.monotonic()
+                    self._cond.notify_all()
+
+    def _done(self):
+        return len(self.finished) + len(self.failed) == len(self.tasks)
+
+    def _next_task(self, worker):
+        """Block until there is a capture for `worker`; None once all are done."""
+        with self._cond:
+            while not self._closed and not self._done():
+                now = time.monotonic()
+                if self.queue:
+                    task = self.tasks[self.queue.popleft()]
+                    task['attempts'] += 1
+                    self.running[task['id']] = {worker: now}
+                    return task
+                # Work stealing: back up the longest-running capture nobody else is copying
+                stragglers = [
+                    (min(copies.values()), task_id) for task_id, copies in self.running.items()
+                    if len(copies) == 1 and now - min(copies.values()) >= self.steal_after
+                ]
+                if stragglers:
+                    _, task_id = min(stragglers)
+                    self.running[task_id][worker] = now
+                    self.stolen += 1
+                    logger.info(f"Worker {worker} takes a backup copy of {self.tasks[task_id]['path']}")
+                    return self.tasks[task_id]
+                self._cond.wait(timeout=1)
+            return None
+
+    def _complete(self, worker, task_id, reply):
+        now = time.monotonic()
+        with self._cond:
+            task = self.tasks[task_id]
+            copies = self.running.get(task_id, {})
+            started = copies.pop(worker, None)
+            stats = self.workers[worker]
+            if started is not None:
+                stats['busy_seconds'] += now - started
+
+            if task_id in self.finished or task_id in self.failed:
+                self.wasted += 1
+            elif reply['type'] == 'result':
+                result = reply['result']
+                self.finished.add(task_id)
+                self.running.pop(task_id, None)
+                stats['files'] += 1
+                stats['calls'] += result['calls']
+                stats['bytes'] += result['bytes']
+                self.calls += result['calls']
+                self.bytes += result['bytes']
+                self._results.put((task, result))
+            else:
+                stats['errors'] += 1
+                task['errors'].append(f"{worker}: {reply['error']}")
+                logger.warning(f"{task['path']} failed on {worker} (attempt {task['attempts']}): {reply['error']}")
+                if copies:
+                    pass  # a backup copy is still running
+                elif task['attempts'] >= self.max_attempts:
+                    self.running.pop(task_id, None)
+                    self.failed[task_id] = reply['error']
+                    logger.error(f"Giving up on {task['path']} after {task['attempts']} attempts")
+                else:
+                    self.running.pop(task_id, None)
+                    self.queue.append(task_id)
+                    self.retries += 1
+
+            if self._done() and self._finished_at is None:
+                self._finished_at = now
+            self._cond.notify_all()
+
+    def results(self):
+        """
+        Yield (task, result) as captures complete, until every capture is
+        done or has failed. Gives up on the remaining captures once no worker
+        has been connected for idle_timeout seconds.
+        """
+        while True:
+            try:
+                yield self._results.get(timeout=1)
+                continue
+            except queue.Empty:
+                pass
+            with self._cond:
+                if self._done() and self._results.empty():
+                    return
+                if not self.connected and time.monotonic() - self._idle_since > self.idle_timeout:
+                    remaining = [task_id for task_id in self.tasks
+                                 if task_id not in self.finished and task_id not in self.failed]
+                    logger.error(f"No workers for {self.idle_timeout} s, giving up on {len(remaining)} captures")
+                    for task_id in remaining:
+                        self.failed[task_id] = 'no workers connected'
+                    self.queue.clear()
+                    self.running.clear()
+                    self._finished_at = time.monotonic()
+                    self._cond.notify_all()
+                    return
+
+    def report(self):
+        """Return the aggregate and per-worker throughput of the run."""
+        end = self._finished_at or time.monotonic()
+        elapsed = end - self._started_at if self._started_at is not None else 0.0
+        workers = []
+        for name, stats in sorted(self.workers.items()):
+            connected = (stats['disconnected_at'] or end) - stats['connected_at']
+            workers.append({
+                'worker': name,
+                'files': stats['files'],
+                'calls': stats['calls'],
+                'bytes': stats['bytes'],
+                'errors': stats['errors'],
+                'busy_seconds': stats['busy_seconds'],
+                'utilization': min(stats['busy_seconds'] / connected, 1.0) if connected > 0 else 0.0,
+                'mb_per_second': stats['bytes'] / 1024 ** 2 / stats['busy_seconds'] if stats['busy_seconds'] else 0.0
+            })
+        return {
+            'mode': self.mode,
+            'files': len(self.tasks),
+            'processed': len(self.finished),
+            'failed': [{'path': self.tasks[task_id]['path'], 'error': error} for task_id, error in self.failed.items()],
+            'retries': self.retries,
+            'stolen': self.stolen,
+            'wasted': self.wasted,
+            'calls': self.calls,
+            'bytes': self.bytes,
+            'elapsed_seconds': elapsed,
+            'files_per_second': len(self.finished) / elapsed if elapsed else 0.0,
+            'calls_per_second': self.calls / elapsed if elapsed else 0.0,
+            'mb_per_second': self.bytes / 1024 ** 2 / elapsed if elapsed else 0.0,
+            'workers': workers
+        }
+
+
+def run_worker(address, authkey=None, model_path=None, connect_timeout=30, name=None):
+    """
+    Connect to the coordinator at `address` and process captures until it
+    says stop or goes away. Returns the number of captures processed.
+    """
+    authkey = cluster_authkey(authkey)
+    if authkey is None:
+        raise ValueError("No cluster authkey; set VOIP_CLUSTER_AUTHKEY or pass --authkey")
+    name = name or f"{socket.gethostname()}:{os.getpid()}"
+    deadline = time.monotonic() + connect_timeout
+    while True:
+        try:
+            conn = Client(tuple(address), family='AF_INET', authkey=authkey)
+            break
+        except ConnectionRefusedError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(CONNECT_RETRY_SECONDS)
+
+    processed = 0
+    with conn:
+        conn.send({'type': 'hello', 'worker': name})
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                logger.warning("Coordinator went away")
+                break
+            if message['type'] == 'stop':
+                break
+            task = message['task']
+            try:
+                reply = {'type': 'result', 'result': process_capture(task['path'], message['mode'], model_path)}
+                processed += 1
+            except Exception as e:
+                logger.exception(f"Error processing {task['path']}")
+                reply = {'type': 'error', 'error': f"{type(e).__name__}: {e}"}
+            conn.send(reply)
+    logger.info(f"Worker {name} processed {processed} captures")
+    return processed
+
+def start_workers(address, processes, **options):
+    """Start `processes` worker processes connecting to `address`."""
+    workers = []
+    for _ in range(processes):
+        process = multiprocessing.Process(target=run_worker, args=(address,), kwargs=options, daemon=True)
+        process.start()
+        workers.append(process)
+    return workers
+
+def run_cluster(files, mode, consume, address=None, local_workers=0, model_path=None, **options):
+    """
+    Process captures on the cluster, calling consume(path, result) in the
+    calling thread for each completed capture.
+
+    Parameters:
+        files (list): Capture paths, as the workers see them.
+        mode (str): 'score' or 'train' (see process_capture).
+        consume (callable): Receives each capture's result.
+        address (tuple): (host, port) to listen on; port 0 picks a free one.
+        local_workers (int): Worker processes to start on this machine.
+        model_path (str): Model file used by the local workers.
+        **options: Passed on to Coordinator.
+
+    Returns:
+        dict: The throughput report (see Coordinator.report).
+    """
+    coordinator = Coordinator(files, mode, address, **options).start()
+    host, port = coordinator.address
+    workers = start_workers(('127.0.0.1' if host in ('0.0.0.0', '') else host, port), local_workers,
+                            authkey=coordinator.authkey, model_path=model_path)
+    try:
+        for task, result in coordinator.results():
+            consume(task['path'], result)
+    finally:
+        coordinator.close()
+        for process in workers:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+    report = coordinator.report()
+    logger.info(f"Processed {report['processed']}/{report['files']} captures, {report['calls']} calls in "
+                f"{report['elapsed_seconds']:.1f} s ({report['mb_per_second']:.1f} MB/s, "
+                f"{report['calls_per_second']:.1f} calls/s), {report['retries']} retries, "
+                f"{report['stolen']} stolen, {len(report['failed'])} failed")
+    return report
+
+def score_captures(files, store=None, scores_path=None, **options):
+    """
+    Score the calls of every capture with the quality model. Scored calls are
+    appended to `scores_path` (defaults to Config.CLUSTER_SCORES_PATH) as JSON
+    lines and, given a MetricsStore, recorded in it.
+    """
+    scores_path = scores_path or Config.CLUSTER_SCORES_PATH
+    os.makedirs(os.path.dirname(os.path.abspath(scores_path)), exist_ok=True)
+    with open(scores_path, 'a') as out:
+        def consume(path, result):
+            if store is not None:
+                store.record_capture(result['digest'], result['name'], result['records'], flush=False)
+            for record in result['records']:
+                score = {field: record.get(field) for field in SCORE_FIELDS}
+                out.write(json.dumps(dict(score, capture=result['name'], digest=result['digest'])) + '\n')
+
+        report = run_cluster(files, 'score', consume, **options)
+    if store is not None:
+        store.flush()
+    return report
+
+def ingest_training_set(files, builder=None, **options):
+    """
+    Feed the calls of every capture into a TrainingSetBuilder. The sample is
+    uniform whatever order captures complete in, but which calls it holds
+    depends on that order.
+
+    Returns:
+        tuple: (builder, throughput report); call builder.split() for the matrices.
+    """
+    builder = builder or TrainingSetBuilder()
+
+    def consume(path, result):
+        if result['calls']:
+            builder.add(result['features'], result['labels'], result['start_times'])
+
+    return builder, run_cluster(files, 'train', consume, **options)
+
+def print_report(report):
+    print(f"{report['processed']}/{report['files']} captures, {report['calls']} calls, "
+          f"{report['bytes'] / 1024 ** 2:.1f} MB in {report['elapsed_seconds']:.1f} s: "
+          f"{report['files_per_second']:.2f} files/s, {report['calls_per_second']:.1f} calls/s, "
+          f"{report['mb_per_second']:.1f} MB/s")
+    print(f"{report['retries']} retries, {report['stolen']} stolen ({report['wasted']} wasted), "
+          f"{len(report['failed'])} failed")
+    print(f"{'worker':<32}{'files':>7}{'calls':>9}{'MB':>9}{'busy s':>9}{'util':>7}{'MB/s':>8}{'errors':>8}")
+    for row in report['workers']:
+        print(f"{row['worker']:<32}{row['files']:>7}{row['calls']:>9}{row['bytes'] / 1024 ** 2:>9.1f}"
+              f"{row['busy_seconds']:>9.1f}{row['utilization']:>7.0%}{row['mb_per_second']:>8.1f}{row['errors']:>8}")
+    for failure in report['failed']:
+        print(f"FAILED {failure['path']}: {failure['error']}")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Process captures on several machines")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    coordinator = commands.add_parser('coordinator', help='hand out captures and collect the results')
+    coordinator.add_argument('mode', choices=MODES, help='batch scoring or training ingest')
+    coordinator.add_argument('--data-dir', default=None, help='captures to process (defaults to Config.DATA_DIR)')
+    coordinator.add_argument('--manifest', default=None, help='file listing one capture path per line')
+    coordinator.add_argument('--bind', default=None, help='host:port to listen on (defaults to Config.CLUSTER_HOST/PORT)')
+    coordinator.add_argument('--authkey', default=None,
+                             help='secret shared with the workers (defaults to $VOIP_CLUSTER_AUTHKEY; '
+                                  'required unless bound to a loopback address)')
+    coordinator.add_argument('--local-workers', type=int, default=0, help='worker processes to start on this machine')
+    coordinator.add_argument('--model', default=None, help='model file for local workers (defaults to Config.MODEL_PATH)')
+    coordinator.add_argument('--steal-after', type=float, default=None, help='seconds before a capture gets a backup copy')
+    coordinator.add_argument('--max-attempts', type=int, default=None)
+    coordinator.add_argument('--scores', default=None, help='scores file (defaults to Config.CLUSTER_SCORES_PATH)')
+    coordinator.add_argument('--no-store', action='store_true', help='do not record scored calls in the metrics store')
+    coordinator.add_argument('--training-dir', default=None, help='training set directory (defaults to Config.TRAINING_DATA_DIR)')
+    coordinator.add_argument('--report', default=None, help='also write the throughput report to this JSON file')
+
+    worker = commands.add_parser('worker', help='process captures handed out by a coordinator')
+    worker.add_argument('--connect', default=None, help='coordinator host:port (defaults to Config.CLUSTER_HOST/PORT)')
+    worker.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    worker.add_argument('--model', default=None, help='model file for scoring (defaults to Config.MODEL_PATH)')
+    worker.add_argument('--connect-timeout', type=float, default=30)
+    worker.add_argument('--authkey', default=None, help='secret shared with the coordinator (defaults to $VOIP_CLUSTER_AUTHKEY)')
+
+    args = parser.parse_args()
+    if args.command == 'worker':
+        address = parse_address(args.connect)
+        options = {'model_path': args.model, 'connect_timeout': args.connect_timeout, 'authkey': args.authkey}
+        if args.processes == 1:
+            run_worker(address, **options)
+        else:
+            for process in start_workers(address, args.processes, **options):
+                process.join()
+        return
+
+    files = list_captures(args.data_dir, args.manifest)
+    options = {
+        'address': parse_address(args.bind), 'local_workers': args.local_workers, 'model_path': args.model,
+        'steal_after': args.steal_after, 'max_attempts': args.max_attempts, 'authkey': args.authkey
+    }
+    if args.mode == 'score':
+        if args.no_store:
+            report = score_captures(files, scores_path=args.scores, **options)
+        else:
+            from utils.metrics_store import MetricsStore
+            with MetricsStore() as store:
+                report = score_captures(files, store, args.scores, **options)
+    else:
+        builder, report = ingest_training_set(files, TrainingSetBuilder(args.training_dir), **options)
+        if builder.total:
+            builder.split()
+        else:
+            logger.error("No training data found!")
+    print_report(report)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
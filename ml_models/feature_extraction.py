@@ -47,13 +47,12 @@ def extract_features(voip_data):
         features.append(feature_vector)
     
     features_array = np.array(features)
-    logger.info(f"Extracted {len(features)} feature vectors with {features_array.shape[1]} features each")
+    logger.info("Extracted %d feature vectors with %d features each", len(features), features_array.shape[1])
     
-    # Log feature statistics for debugging
-    if len(features) > 0:
+    # Log feature statistics for debugging; the statistics are only computed when DEBUG is enabled
+    if len(features) > 0 and logger.isEnabledFor(logging.DEBUG):
         logger.debug("Feature statistics:")
-        logger.debug(f"Duration (s): mean={np.mean(features_array[:, 0]):.2f}, std={np.std(features_array[:, 0]):.2f}")
-        logger.debug(f"Total packets: mean={np.mean(features_array[:, 1]):.2f}, std={np.std(features_array[:, 1]):.2f}")
-        logger.debug(f"Jitter (ms): mean={np.mean(features_array[:, 4]):.2f}, std={np.std(features_array[:, 4]):.2f}")
+        for label, column in (("Duration (s)", 0), ("Total packets", 1), ("Jitter (ms)", 4)):
+            logger.debug("%s: mean=%.2f, std=%.2f", label, np.mean(features_array[:, column]), np.std(features_array[:, column]))
     
     return features_array
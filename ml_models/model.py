@@ -5,8 +5,8 @@ import logging
 logger = logging.getLogger(__name__)
 
 class VoIPQualityModel:
-    def __init__(self):
-        self.model = RandomForestClassifier()
+    def __init__(self, **params):
+        self.model = RandomForestClassifier(**params)
 
     def train(self, X, y):
         self.model.fit(X, y)
@@ -0,0 +1,241 @@
+"""
+Cross-validated hyperparameter search for the call quality model.
+
+The feature matrices written by the training-set builder (see
+ml_models.training_data) are loaded once, so tuning never re-reads the
+captures. Candidates are scored with k-fold or time-series cross-validation
+by a grid, random or successive-halving search whose fits run in a process
+pool. The best candidates are refitted on the whole training set and
+ranked in a leaderboard with held-out accuracy, fit time, model size and
+predict latency. A candidate is promoted to Config.MODEL_PATH by atomically
+replacing the model file.
+
+    python -m ml_models.model_selection search --search halving --cv time --jobs 8
+    python -m ml_models.model_selection promote --rank 1
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import joblib
+import numpy as np
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401 (enables HalvingGridSearchCV)
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import (GridSearchCV, HalvingGridSearchCV, RandomizedSearchCV,
+                                     StratifiedKFold, TimeSeriesSplit)
+from ml_models.model import VoIPQualityModel
+from ml_models.training_data import load_training_set
+from utils.config import Config
+
+logger = logging.getLogger(__name__)
+
+# RandomForestClassifier hyperparameters searched by default
+PARAM_GRID = {
+    'n_estimators': [50, 100, 200],
+    'max_depth': [None, 10, 20],
+    'min_samples_leaf': [1, 5],
+    'max_features': ['sqrt', None],
+    'class_weight': [None, 'balanced']
+}
+
+LATENCY_REPEATS = 20
+
+
+def load_features(training_dir=None, pcap_directory=None):
+    """
+    Return X_train, X_test, y_train, y_test with the training rows in call
+    time order, building the training set from the captures only if no
+    cached one exists.
+    """
+    training_set = load_training_set(training_dir)
+    if training_set is None:
+        from ml_models.train import build_training_set
+        from ml_models.training_data import TrainingSetBuilder
+        logger.info("No cached feature matrices, building them from the captures...")
+        if build_training_set(pcap_directory or Config.DATA_DIR, TrainingSetBuilder(training_dir)) is None:
+            raise ValueError("No training data found")
+        training_set = load_training_set(training_dir)
+
+    X_train, X_test, y_train, y_test, t_train, _ = training_set
+    order = np.argsort(t_train, kind='stable')  # TimeSeriesSplit needs time order
+    return np.asarray(X_train)[order], np.asarray(X_test), np.asarray(y_train)[order], np.asarray(y_test)
+
+def make_search(search='grid', cv='kfold', folds=5, jobs=None, n_iter=20, seed=None, param_grid=None):
+    """Build the scikit-learn search object for a RandomForestClassifier."""
+    seed = Config.TRAINING_SEED if seed is None else seed
+    param_grid = param_grid or PARAM_GRID
+    splitter = TimeSeriesSplit(n_splits=folds) if cv == 'time' else StratifiedKFold(folds, shuffle=True, random_state=seed)
+    # One process per candidate fit; each forest is fitted single-threaded
+    estimator = VoIPQualityModel(random_state=seed, n_jobs=1).model
+    common = {'cv': splitter, 'n_jobs': jobs or os.cpu_count(), 'scoring': 'accuracy', 'refit': False}
+    if search == 'random':
+        return RandomizedSearchCV(estimator, param_grid, n_iter=n_iter, random_state=seed, **common)
+    if search == 'halving':
+        return HalvingGridSearchCV(estimator, param_grid, random_state=seed, **common)
+    return GridSearchCV(estimator, param_grid, **common)
+
+def cv_candidates(search):
+    """Return the searched candidates, best mean CV accuracy first."""
+    results = search.cv_results_
+    if 'iter' in results:
+        # Successive halving: only the last round a candidate reached is comparable
+        last_round = {}
+        for i, params in enumerate(results['params']):
+            last_round[json.dumps(params, sort_keys=True, default=str)] = i
+        indices = list(last_round.values())
+    else:
+        indices = range(len(results['params']))
+    candidates = [{
+        'params': results['params'][i],
+        'cv_accuracy': float(results['mean_test_score'][i]),
+        'cv_accuracy_std': float(results['std_test_score'][i]),
+        'cv_fit_time': float(results['mean_fit_time'][i]),
+        'cv_samples': int(results['n_resources'][i]) if 'n_resources' in results else None
+    } for i in indices]
+    candidates.sort(key=lambda c: (-np.nan_to_num(c['cv_accuracy'], nan=-1), c['cv_fit_time']))
+    return candidates
+
+def evaluate_candidate(params, X_train, y_train, X_test, y_test, path, seed):
+    """Refit one candidate on the whole training set, save it and measure it."""
+    model = VoIPQualityModel(random_state=seed, n_jobs=1, **params).model
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    fit_time = time.perf_counter() - start
+    joblib.dump(model, path)
+
+    single = []
+    for _ in range(LATENCY_REPEATS):
+        start = time.perf_counter()
+        model.predict(X_test[:1] if len(X_test) else X_train[:1])
+        single.append(time.perf_counter() - start)
+    batch = X_test if len(X_test) else X_train
+    start = time.perf_counter()
+    predictions = model.predict(batch)
+    batch_time = time.perf_counter() - start
+    return {
+        'test_accuracy': float(accuracy_score(y_test, predictions)) if len(X_test) else None,
+        'fit_time': fit_time,
+        'model_bytes': os.path.getsize(path),
+        'predict_latency_ms': float(np.median(single)) * 1000,
+        'predict_throughput': len(batch) / batch_time if batch_time else None
+    }
+
+def _evaluate_candidate_args(args):
+    return evaluate_candidate(*args)
+
+def run_search(search='grid', cv='kfold', folds=5, jobs=None, n_iter=20, top=5, output_dir=None,
+               training_dir=None, seed=None):
+    """
+    Search, refit the `top` candidates and write the leaderboard.
+
+    Returns:
+        list: Leaderboard rows, best first; each names its saved model file.
+    """
+    seed = Config.TRAINING_SEED if seed is None else seed
+    output_dir = output_dir or Config.MODEL_SELECTION_DIR
+    os.makedirs(output_dir, exist_ok=True)
+    X_train, X_test, y_train, y_test = load_features(training_dir)
+    logger.info(f"Loaded {len(y_train)} training and {len(y_test)} test samples")
+
+    search_cv = make_search(search, cv, folds, jobs, n_iter, seed)
+    start = time.perf_counter()
+    search_cv.fit(X_train, y_train)
+    logger.info(f"{search} search with {cv} CV took {time.perf_counter() - start:.1f} s")
+
+    leaderboard = cv_candidates(search_cv)[:top]
+    tasks = [
+        (row['params'], X_train, y_train, X_test, y_test, os.path.join(output_dir, f'candidate_{rank}.pkl'), seed)
+        for rank, row in enumerate(leaderboard, 1)
+    ]
+    with ProcessPoolExecutor(max_workers=min(jobs or os.cpu_count() or 1, len(tasks) or 1)) as executor:
+        for rank, (row, measured) in enumerate(zip(leaderboard, executor.map(_evaluate_candidate_args, tasks)), 1):
+            row.update(measured, rank=rank, model_file=f'candidate_{rank}.pkl')
+
+    write_leaderboard(leaderboard, output_dir, {'search': search, 'cv': cv, 'folds': folds, 'seed': seed})
+    return leaderboard
+
+def write_leaderboard(leaderboard, output_dir, settings):
+    with open(os.path.join(output_dir, 'leaderboard.json'), 'w') as f:
+        json.dump({'settings': settings, 'created': time.time(), 'leaderboard': leaderboard}, f, indent=2, default=str)
+    columns = ['rank', 'cv_accuracy', 'cv_accuracy_std', 'test_accuracy', 'fit_time', 'model_bytes',
+               'predict_latency_ms', 'predict_throughput', 'params', 'model_file']
+    with open(os.path.join(output_dir, 'leaderboard.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+        writer.writeheader()
+        for row in leaderboard:
+            writer.writerow(dict(row, params=json.dumps(row['params'], default=str)))
+
+def promote(rank=1, output_dir=None, model_path=None):
+    """
+    Install a leaderboard candidate as the production model.
+
+    The file is copied next to Config.MODEL_PATH and moved over it with
+    os.replace, so readers see either the old or the new model, never a
+    partial file.
+    """
+    output_dir = output_dir or Config.MODEL_SELECTION_DIR
+    model_path = model_path or Config.MODEL_PATH
+    with open(os.path.join(output_dir, 'leaderboard.json')) as f:
+        leaderboard = json.load(f)['leaderboard']
+    row = next((row for row in leaderboard if row['rank'] == rank), None)
+    if row is None:
+        raise ValueError(f"No candidate with rank {rank} in the leaderboard")
+
+    os.makedirs(os.path.dirname(model_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(model_path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as target, open(os.path.join(output_dir, row['model_file']), 'rb') as source:
+            shutil.copyfileobj(source, target)
+            target.flush()
+            os.fsync(target.fileno())
+        os.replace(tmp_path, model_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    logger.info(f"Promoted candidate {rank} ({row['params']}) to {model_path}")
+    return row
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Select hyperparameters for the call quality model")
+    parser.add_argument('--output-dir', default=None, help='leaderboard directory (defaults to Config.MODEL_SELECTION_DIR)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    search = commands.add_parser('search', help='cross-validate candidates and write the leaderboard')
+    search.add_argument('--search', choices=['grid', 'random', 'halving'], default='grid')
+    search.add_argument('--cv', choices=['kfold', 'time'], default='kfold',
+                        help='stratified k-fold, or folds that always test on later calls')
+    search.add_argument('--folds', type=int, default=5)
+    search.add_argument('--iterations', type=int, default=20, help='candidates sampled by the random search')
+    search.add_argument('--jobs', type=int, default=None, help='parallel fits (defaults to the CPU count)')
+    search.add_argument('--top', type=int, default=5, help='candidates refitted and measured for the leaderboard')
+    search.add_argument('--training-dir', default=None, help='cached feature matrices (defaults to Config.TRAINING_DATA_DIR)')
+    search.add_argument('--promote', action='store_true', help='promote the best candidate afterwards')
+
+    promote_parser = commands.add_parser('promote', help='install a leaderboard candidate as Config.MODEL_PATH')
+    promote_parser.add_argument('--rank', type=int, default=1)
+
+    args = parser.parse_args()
+    if args.command == 'search':
+        leaderboard = run_search(args.search, args.cv, args.folds, args.jobs, args.iterations, args.top,
+                                 args.output_dir, args.training_dir)
+        print(f"{'rank':<6}{'cv acc':>8}{'test acc':>10}{'fit s':>9}{'size KB':>10}{'predict ms':>12}  params")
+        for row in leaderboard:
+            test_accuracy = f"{row['test_accuracy']:.3f}" if row['test_accuracy'] is not None else '-'
+            print(f"{row['rank']:<6}{row['cv_accuracy']:>8.3f}{test_accuracy:>10}{row['fit_time']:>9.2f}"
+                  f"{row['model_bytes'] / 1024:>10.0f}{row['predict_latency_ms']:>12.2f}  {row['params']}")
+        if args.promote and leaderboard:
+            promote(1, args.output_dir)
+    else:
+        promote(args.rank, args.output_dir)
+
+
+if __name__ == '__main__':
+    main()
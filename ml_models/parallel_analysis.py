@@ -0,0 +1,523 @@
+"""
+Chunked parallel analysis of a single capture.
+
+The capture is split into contiguous record ranges (see
+data_processing.pcap_index), each range is analyzed in a worker process into
+a ChunkState, and the states are merged in capture order. Every piece of
+per-stream state is kept in a form that can be stitched across chunk edges,
+so the merged result matches a single pass over the same file.
+
+Like the single-pass pipeline, this assumes the capture is written in time
+order (as tcpdump/dumpcap do), so sorting within a chunk equals sorting the
+whole capture.
+
+State that a single pass carries from packet to packet is rebuilt at every
+chunk start. A quick pre-scan collects the records that may hold SIP, and
+replaying them in capture order gives the media endpoints learned from SDP
+up to each chunk, so media on negotiated ports is classified, and attributed
+to its call, as in a single pass. Each worker also replays the records of the two dedup windows before
+its chunk, so tap copies straddling a chunk edge are dropped once.
+"""
+import copy
+import logging
+import os
+import numpy as np
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from scapy.all import Raw
+from data_processing.pcap_index import iter_chunk_packets, iter_chunk_records, plan_chunks, read_global_header
+from data_processing.pcap_processor import (SIP_MARKERS, VoIPPacketClassifier, extract_call_id,
+                                            filter_voip_packets, udp_layers)
+from data_processing.pcap_stream import build_packet, link_layer_class
+from data_processing.dedup import DuplicateStats, PacketDeduplicator, deduplicate_packets
+from data_processing.sdp import MediaFlowTable, sip_call_id
+from ml_models.advanced_metrics import AdvancedVoIPMetrics, RtpStreamStats, _raw_load
+from ml_models.traffic_analyzer import TrafficSummary, packet_arrays
+from data_processing.rtcp import RtcpStats
+from utils.config import Config
+from utils.running_stats import RunningStats
+
+logger = logging.getLogger(__name__)
+
+
+class CallFragment:
+    """Packet counts and inter-arrival statistics for a time-ordered run of packets."""
+
+    def __init__(self, start_time=None):
+        self.start_time = start_time
+        self.end_time = None
+        self.first_time = None
+        self.last_time = None
+        self.packet_count = 0
+        self.sip_count = 0
+        self.rtp_count = 0
+        self.gaps = RunningStats()
+
+    def add(self, time, protocol):
+        if self.last_time is not None:
+            self.gaps.update(time - self.last_time)
+        else:
+            self.first_time = time
+        self.last_time = time
+        self.packet_count += 1
+        if protocol == 'SIP':
+            self.sip_count += 1
+        elif protocol == 'RTP':
+            self.rtp_count += 1
+
+    def merge(self, other):
+        """Append a fragment that follows this one in time."""
+        if other.packet_count:
+            if self.packet_count:
+                self.gaps.update(other.first_time - self.last_time)
+            else:
+                self.first_time = other.first_time
+            self.gaps.merge(other.gaps)
+            self.last_time = other.last_time
+            self.packet_count += other.packet_count
+            self.sip_count += other.sip_count
+            self.rtp_count += other.rtp_count
+        if self.start_time is None:
+            self.start_time = other.start_time
+        if other.end_time is not None:
+            self.end_time = other.end_time
+        return self
+
+    @property
+    def jitter(self):
+        return self.gaps.std if self.packet_count > 1 else 0
+
+
+class DialogState:
+    """
+    SIP dialog grouping (train.process_voip_calls) for one chunk.
+
+    Packets seen before the chunk's first INVITE belong to whatever call was
+    current at the end of the previous chunk; they are kept in `leading` and
+    attached to that call on merge.
+    """
+
+    def __init__(self):
+        self.leading = CallFragment()
+        self.calls = {}
+        self.current_call = None
+        self.started = False
+
+    def add(self, time, protocol, packet):
+        if protocol == 'SIP' and Raw in packet:
+            load = packet[Raw].load
+            if b'INVITE' in load:
+                call_id = extract_call_id(packet)
+                if call_id not in self.calls:
+                    self.calls[call_id] = CallFragment(start_time=time)
+                self.current_call = call_id
+                self.started = True
+            elif b'BYE' in load:
+                if self.current_call:
+                    self.calls[self.current_call].end_time = time
+                elif not self.started:
+                    self.leading.end_time = time
+
+        if self.current_call:
+            self.calls[self.current_call].add(time, protocol)
+        elif not self.started:
+            self.leading.add(time, protocol)
+
+    def merge(self, other):
+        if self.started:
+            if self.current_call:
+                self.calls[self.current_call].merge(other.leading)
+        else:
+            self.leading.merge(other.leading)
+
+        for call_id, fragment in other.calls.items():
+            if call_id in self.calls:
+                self.calls[call_id].merge(fragment)
+            else:
+                self.calls[call_id] = fragment
+
+        if other.started:
+            self.current_call = other.current_call
+            self.started = True
+        return self
+
+    def completed_calls(self):
+        """Return call metrics in the same form as train.process_voip_calls."""
+        return [
+            {
+                'start_time': fragment.start_time,
+                'end_time': fragment.end_time,
+                'duration': fragment.end_time - fragment.start_time,
+                'packet_count': fragment.packet_count,
+                'sip_count': fragment.sip_count,
+                'rtp_count': fragment.rtp_count,
+                'jitter': fragment.jitter
+            }
+            for fragment in self.calls.values() if fragment.end_time is not None
+        ]
+
+
+def split_by_call(voip_packets, flow_table=None):
+    """
+    Group (protocol, packet) tuples by SIP Call-ID, keeping their order.
+
+    Media packets are attributed to a call through the endpoints negotiated
+    in its SDP; `flow_table` carries those across batches of one stream.
+    Packets that cannot be attributed are left out.
+    """
+    flow_table = flow_table if flow_table is not None else MediaFlowTable()
+    calls = defaultdict(list)
+    for protocol, packet in voip_packets:
+        layers = udp_layers(packet)
+        if layers is None or layers[2] is None:
+            continue
+        ip, udp, payload = layers
+        if protocol == 'SIP':
+            flow_table.learn(payload, float(packet.time))
+            call_id = sip_call_id(payload)
+        else:
+            endpoint = flow_table.lookup(ip.src, udp.sport, ip.dst, udp.dport)
+            call_id = endpoint['call_id'] if endpoint else None
+        if call_id:
+            calls[call_id].append((protocol, packet))
+    return calls
+
+def call_states(voip_packets, quality_metrics=None, flow_table=None):
+    """Return a ChunkState per call (Call-ID -> state) for the given packets."""
+    return {
+        call_id: ChunkState.from_packets(packets, quality_metrics, per_call=False, traffic=False)
+        for call_id, packets in split_by_call(voip_packets, flow_table).items()
+    }
+
+def call_records(states, quality_metrics=None):
+    """
+    Return per-call metrics with their RTP streams, as stored by
+    utils.metrics_store, for a Call-ID -> ChunkState mapping.
+    """
+    quality_metrics = quality_metrics or AdvancedVoIPMetrics()
+    records = []
+    for call_id, state in states.items():
+        call_data = state.call_data()
+        if not call_data:
+            continue
+        flow_metrics = state.flow_metrics()
+        qos_report = quality_metrics.generate_qos_report(call_data, flow_metrics)
+        caller, callee = state.endpoints or (None, None)
+
+        streams = []
+        for ssrc, stream in flow_metrics['rtp_stream_stats'].items():
+            remote = state.rtcp.remote.get(ssrc, {})
+            streams.append({
+                'ssrc': ssrc,
+                'start_time': stream.start_time,
+                'end_time': stream.end_time,
+                'packet_count': stream.packet_count,
+                'jitter': stream.jitter * 1000,
+                'remote_packet_loss_rate': remote.get('fraction_lost'),
+                'remote_jitter': state.rtcp.remote_jitter(remote) if remote else None
+            })
+
+        metrics = qos_report['quality_metrics']
+        records.append({
+            'call_id': call_id,
+            'start_time': call_data['start_time'],
+            'end_time': call_data['end_time'],
+            'duration': call_data['duration'],
+            'caller': caller,
+            'callee': callee,
+            'packet_count': call_data['packet_count'],
+            'sip_count': call_data['sip_count'],
+            'rtp_count': call_data['rtp_count'],
+            'jitter': call_data['jitter'],
+            'packet_loss_rate': metrics['packet_loss_rate'],
+            'round_trip_time': metrics['round_trip_time'],
+            'remote_packet_loss_rate': metrics['remote_packet_loss_rate'],
+            'mos': metrics['mos'],
+            'streams': streams
+        })
+    return records
+
+
+class ChunkState:
+    """
+    Mergeable analysis state for one contiguous chunk of a capture.
+
+    Only summaries are kept: RTP streams and sliding-window loss as running
+    statistics, traffic patterns as a sketch-only TrafficSummary whose
+    timeline also holds the loss windows. The state does not grow with the
+    packet count; `traffic=False` leaves the traffic patterns out altogether
+    (per-call states).
+    """
+
+    def __init__(self, traffic=True):
+        self.call = CallFragment()
+        self.dialogs = DialogState()
+        self.calls = {}  # Call-ID -> ChunkState of that call's packets
+        self.endpoints = None  # (caller, callee) addresses of the first INVITE
+        self.duplicates = DuplicateStats()  # tap duplicates dropped before classification
+
+        # analyze_call_flow state
+        self.sip_invites = {}
+        self.sip_answers = {}
+        self.teardown_time = 0
+        self.rtp_streams = {}  # SSRC -> RtpStreamStats
+        self.packet_loss = RunningStats()
+        self.packet_loss_max = 0
+        # Per SSRC, the sequence numbers needed to close loss windows spanning
+        # chunk edges: (sequence number, time) of the first packets, and the
+        # sequence numbers of the last packets
+        self.rtp_head = defaultdict(list)
+        self.rtp_tail = defaultdict(list)
+        self.rtcp = RtcpStats()
+
+        # extract_traffic_patterns state
+        self.traffic = TrafficSummary() if traffic else None
+
+    @classmethod
+    def from_packets(cls, voip_packets, quality_metrics=None, flow_table=None, per_call=True, traffic=True):
+        """
+        Build the state for the (protocol, packet) tuples of one chunk.
+
+        With `per_call`, a state per SIP dialog is kept in `calls` as well;
+        `flow_table` continues the SDP endpoints learned from earlier batches.
+        """
+        quality_metrics = quality_metrics or AdvancedVoIPMetrics()
+        state = cls(traffic)
+
+        for protocol, packet in sorted(voip_packets, key=lambda p: float(p[1].time)):
+            time = float(packet.time)
+            state.call.add(time, protocol)
+            state.dialogs.add(time, protocol, packet)
+            if state.endpoints is None and protocol == 'SIP':
+                layers = udp_layers(packet)
+                if layers and layers[2] is not None and layers[2].startswith(b'INVITE'):
+                    state.endpoints = (layers[0].src, layers[0].dst)
+
+        if per_call:
+            state.calls = call_states(voip_packets, quality_metrics, flow_table)
+
+        flow_metrics = quality_metrics.analyze_call_flow(voip_packets)
+        state.sip_invites = flow_metrics['sip_invites']
+        state.sip_answers = flow_metrics['sip_answers']
+        state.teardown_time = flow_metrics['teardown_time']
+        state.rtp_streams = flow_metrics['rtp_stream_stats']
+        state._add_loss_windows(flow_metrics['packet_loss_times'], flow_metrics['packet_loss_windows'])
+        state.rtcp = flow_metrics['rtcp']
+
+        edge = quality_metrics.LOSS_WINDOW_SIZE - 1
+        tails = defaultdict(lambda: deque(maxlen=edge))
+        for protocol, packet in voip_packets:
+            load = _raw_load(packet)
+            if protocol == 'RTP' and load is not None and len(load) >= 12:
+                ssrc = int.from_bytes(load[8:12], byteorder='big')
+                seq = int.from_bytes(load[2:4], byteorder='big')
+                head = state.rtp_head[ssrc]
+                if len(head) < edge:
+                    head.append((seq, float(packet.time)))
+                tails[ssrc].append(seq)
+        for ssrc, tail in tails.items():
+            state.rtp_tail[ssrc] = list(tail)
+
+        if state.traffic is not None:
+            state.traffic.update_batch(*packet_arrays(voip_packets))
+        return state
+
+    def _add_loss_windows(self, times, windows):
+        self.packet_loss.update_batch(windows)
+        self.packet_loss_max = max(self.packet_loss_max, max(windows, default=0))
+        if self.traffic is not None and windows:
+            # Each loss window is placed at the packet that completed it
+            self.traffic.timeline.add_series('packet_loss', times, np.asarray(windows) * 100)
+
+    def merge(self, other, quality_metrics=None):
+        """Merge the state of the chunk that immediately follows this one."""
+        quality_metrics = quality_metrics or AdvancedVoIPMetrics()
+        window_size = quality_metrics.LOSS_WINDOW_SIZE
+        edge = window_size - 1
+
+        self.call.merge(other.call)
+        self.dialogs.merge(other.dialogs)
+        self.endpoints = self.endpoints or other.endpoints
+        self.duplicates.merge(other.duplicates)
+        for call_id, call_state in other.calls.items():
+            if call_id in self.calls:
+                self.calls[call_id].merge(call_state, quality_metrics)
+            else:
+                self.calls[call_id] = call_state
+
+        # The first INVITE and answer of a dialog may fall in different chunks
+        for call_id, time in other.sip_invites.items():
+            self.sip_invites.setdefault(call_id, time)
+        for call_id, time in other.sip_answers.items():
+            self.sip_answers.setdefault(call_id, time)
+        self.teardown_time = other.teardown_time or self.teardown_time
+        for ssrc, stream in other.rtp_streams.items():
+            if ssrc in self.rtp_streams:
+                self.rtp_streams[ssrc].merge(stream)
+            else:
+                self.rtp_streams[ssrc] = stream
+
+        # Neither side holds a full window of a stream at the edge, so every
+        # window over its joined edge sequences spans the boundary and ends
+        # at a packet of the following chunk
+        for ssrc, head in other.rtp_head.items():
+            tail = self.rtp_tail.get(ssrc, [])
+            edge_sequence = tail + [seq for seq, _ in head]
+            ends = range(window_size, len(edge_sequence) + 1)
+            self._add_loss_windows(
+                [head[end - 1 - len(tail)][1] for end in ends],
+                [quality_metrics._sequence_loss(edge_sequence[end - window_size:end]) for end in ends])
+            self.rtp_head[ssrc] = (self.rtp_head.get(ssrc, []) + head)[:edge]
+        self.packet_loss.merge(other.packet_loss)
+        self.packet_loss_max = max(self.packet_loss_max, other.packet_loss_max)
+        for ssrc, tail in other.rtp_tail.items():
+            self.rtp_tail[ssrc] = (self.rtp_tail.get(ssrc, []) + tail)[-edge:] if edge else []
+        self.rtcp.merge(other.rtcp)
+
+        if self.traffic is not None and other.traffic is not None:
+            self.traffic.merge(other.traffic)
+        return self
+
+    def call_data(self):
+        """Return call metrics in the same form as main.process_voip_call."""
+        if not self.call.packet_count:
+            return None
+        return {
+            'start_time': self.call.first_time,
+            'end_time': self.call.last_time,
+            'duration': self.call.last_time - self.call.first_time,
+            'packet_count': self.call.packet_count,
+            'sip_count': self.call.sip_count,
+            'rtp_count': self.call.rtp_count,
+            'jitter': self.call.jitter
+        }
+
+    def flow_metrics(self):
+        """
+        Return flow metrics in the form of AdvancedVoIPMetrics.analyze_call_flow,
+        with only the summaries and without the per-packet lists.
+        """
+        return {
+            'setup_time': AdvancedVoIPMetrics.setup_time(self.sip_invites, self.sip_answers),
+            'teardown_time': self.teardown_time,
+            'sip_invites': self.sip_invites,
+            'sip_answers': self.sip_answers,
+            'rtp_stream_stats': self.rtp_streams,
+            'packet_loss': self.packet_loss,
+            'packet_loss_max': self.packet_loss_max,
+            'burst_periods': [],
+            'rtcp': self.rtcp
+        }
+
+    def traffic_patterns(self):
+        """Return sketch-only patterns, as VoIPTrafficAnalyzer.extract_traffic_patterns(sketch_only=True)."""
+        return self.traffic.patterns()
+
+
+def scan_chunk_sip(pcap_file, chunk):
+    """
+    Worker entry point: return the (timestamp, frame) records of one chunk
+    that may hold SIP. Frames are only searched for the SIP markers, not
+    dissected, so the scan costs a small fraction of the analysis.
+    """
+    return [(timestamp, data) for timestamp, data in iter_chunk_records(pcap_file, chunk)
+            if any(marker in data for marker in SIP_MARKERS)]
+
+def _scan_chunk_sip_args(args):
+    return scan_chunk_sip(*args)
+
+
+class SipReplay:
+    """
+    Replays the SIP candidates of a capture in order through the same
+    deduplication and classification as a single pass, to give the media
+    endpoints learned from SDP as they stand at each chunk start.
+
+    Only SIP messages change the classifier's MediaFlowTable, and a copy of
+    a SIP message is itself a SIP candidate, so the candidates alone
+    reproduce the table of a pass over every packet.
+    """
+
+    def __init__(self, pcap_file):
+        with open(pcap_file, 'rb') as f:
+            self.link_layer = link_layer_class(read_global_header(f)[2])
+        self.deduplicator = PacketDeduplicator()
+        self.classifier = VoIPPacketClassifier()
+
+    def feed(self, records):
+        for timestamp, data in records:
+            packet = build_packet(self.link_layer, data, timestamp)
+            if not self.deduplicator.is_duplicate(packet):
+                self.classifier.classify(packet)
+
+    def flow_table(self):
+        """Return a copy of the media endpoints learned so far."""
+        return copy.deepcopy(self.classifier.flow_table)
+
+
+def analyze_chunk(pcap_file, chunk, flow_table=None):
+    """
+    Worker entry point: parse, deduplicate, filter and analyze one chunk.
+
+    `flow_table` holds the media endpoints negotiated before the chunk (see
+    SipReplay); the classifier and the per-call grouping each continue from
+    a copy of it. The chunk's lead records (plan_chunks `lead_seconds`) are
+    only fed to the deduplicator, to catch copies of packets before the chunk.
+    """
+    deduplicator = PacketDeduplicator(tap=os.path.basename(pcap_file))
+    lead = {'offset': chunk.get('lead_offset', chunk['offset']), 'count': chunk.get('lead_count', 0)}
+    for packet in iter_chunk_packets(pcap_file, lead):
+        deduplicator.is_duplicate(packet)
+    deduplicator.stats = DuplicateStats()
+
+    classifier = VoIPPacketClassifier()
+    call_flows = None
+    if flow_table is not None:
+        classifier.flow_table = flow_table
+        call_flows = copy.deepcopy(flow_table)
+    voip_packets = filter_voip_packets(deduplicate_packets(iter_chunk_packets(pcap_file, chunk), deduplicator),
+                                       classifier)
+    state = ChunkState.from_packets(voip_packets, flow_table=call_flows)
+    state.duplicates = deduplicator.stats
+    return state
+
+def analyze_capture_parallel(pcap_file, workers=None, chunk_seconds=None, chunks_per_worker=4):
+    """
+    Analyze one capture with a process pool.
+
+    Parameters:
+        pcap_file (str): Path to an uncompressed classic pcap file.
+        workers (int): Number of worker processes (defaults to the CPU count).
+        chunk_seconds (float): Split by capture time instead of by size.
+        chunks_per_worker (int): Size-based chunks planned per worker, so a
+            slow chunk does not leave the other workers idle.
+
+    Returns:
+        ChunkState: The merged state for the whole capture, or None if the
+        capture holds no packets.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = plan_chunks(
+        pcap_file,
+        num_chunks=workers * chunks_per_worker,
+        chunk_seconds=chunk_seconds,
+        lead_seconds=2 * Config.DEDUP_WINDOW_SECONDS
+    )
+    if not chunks:
+        return None
+
+    logger.info(f"Analyzing {len(chunks)} chunks with {workers} workers")
+    quality_metrics = AdvancedVoIPMetrics()
+    replay = SipReplay(pcap_file)
+    merged = None
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # A chunk is handed out as soon as the SIP before it has been replayed
+        futures = []
+        candidates = executor.map(_scan_chunk_sip_args, [(pcap_file, chunk) for chunk in chunks])
+        for chunk, records in zip(chunks, candidates):
+            futures.append(executor.submit(analyze_chunk, pcap_file, chunk, replay.flow_table()))
+            replay.feed(records)
+        for future in futures:
+            state = future.result()
+            merged = state if merged is None else merged.merge(state, quality_metrics)
+    return merged
@@ -0,0 +1,89 @@
+import hashlib
+import logging
+import os
+from data_processing.dedup import PacketDeduplicator
+from data_processing.pcap_processor import VoIPPacketClassifier
+from data_processing.pcap_stream import CaptureStreamParser
+from data_processing.sdp import MediaFlowTable
+from ml_models.advanced_metrics import AdvancedVoIPMetrics
+from ml_models.parallel_analysis import ChunkState, call_records
+from utils.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class StreamingCaptureAnalysis:
+    """
+    Analyze a capture while its bytes are still arriving.
+
+    Bytes (pcap or pcapng, optionally compressed) are parsed incrementally,
+    tap duplicates and non-VoIP packets are dropped straight away and VoIP packets are folded
+    into a ChunkState every `batch_size` packets, so no Scapy packets are
+    retained between batches. The result is the same ChunkState a chunked
+    parallel run over the finished file gives. `tap` labels the duplicate
+    counts of packets without a capture interface (classic pcap).
+    """
+
+    def __init__(self, batch_size=2048, tap='capture'):
+        self.batch_size = batch_size
+        self.parser = CaptureStreamParser()
+        self.deduplicator = PacketDeduplicator(tap=tap)
+        self.classifier = VoIPPacketClassifier()
+        self.call_flows = MediaFlowTable()  # attributes media to calls across batches
+        self.quality_metrics = AdvancedVoIPMetrics()
+        self.state = None
+        self.bytes_received = 0
+        self._pending = []
+
+    @property
+    def packet_count(self):
+        return self.parser.packet_count
+
+    def feed(self, data):
+        """Add the next piece of the capture."""
+        self.bytes_received += len(data)
+        for packet in self.parser.feed(data):
+            self._add(packet)
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+
+    def _add(self, packet):
+        if self.deduplicator.is_duplicate(packet):
+            return
+        protocol = self.classifier.classify(packet)
+        if protocol:
+            self._pending.append((protocol, packet))
+
+    def _flush(self):
+        if not self._pending:
+            return
+        batch = ChunkState.from_packets(self._pending, self.quality_metrics, flow_table=self.call_flows)
+        self.state = batch if self.state is None else self.state.merge(batch, self.quality_metrics)
+        self._pending = []
+
+    def finish(self):
+        """Complete the analysis and return the merged ChunkState (None if no VoIP packets)."""
+        for packet in self.parser.close():
+            self._add(packet)
+        self._flush()
+        if self.state is not None:
+            self.state.duplicates = self.deduplicator.stats
+        logger.info(f"Streamed {self.bytes_received} bytes, {self.packet_count} packets, "
+                    f"{self.deduplicator.stats.duplicates} duplicates dropped")
+        return self.state
+
+
+def stream_capture(capture_file):
+    """Stream-analyze one capture file and return (digest, ChunkState or None)."""
+    digest = hashlib.sha256()
+    analysis = StreamingCaptureAnalysis(tap=os.path.basename(capture_file))
+    with open(capture_file, 'rb') as f:
+        for block in iter(lambda: f.read(Config.UPLOAD_BLOCK_BYTES), b''):
+            digest.update(block)
+            analysis.feed(block)
+    return digest.hexdigest(), analysis.finish()
+
+def capture_calls(capture_file):
+    """Worker entry point: stream-analyze one capture and return (digest, call records)."""
+    digest, state = stream_capture(capture_file)
+    return digest, call_records(state.calls) if state else []
@@ -0,0 +1,172 @@
+import math
+import numpy as np
+from utils.running_stats import RunningStats
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch with a relative error guarantee (DDSketch style).
+
+    Values are counted in logarithmic buckets, so every quantile estimate is
+    within `relative_accuracy` of the exact value. Memory is bounded by
+    `max_bins`; when it is exceeded the lowest buckets are collapsed, which
+    only affects the accuracy of the smallest values. Sketches with the same
+    accuracy merge exactly by adding bucket counts.
+    """
+
+    def __init__(self, relative_accuracy=0.01, max_bins=2048):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be between 0 and 1")
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._positive = {}
+        self._negative = {}
+        self.zero_count = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _index(self, value):
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _value(self, index):
+        return 2 * self._gamma ** index / (self._gamma + 1)
+
+    def update(self, value):
+        """Add a single value."""
+        if value > 0:
+            index = self._index(value)
+            self._positive[index] = self._positive.get(index, 0) + 1
+        elif value < 0:
+            index = self._index(-value)
+            self._negative[index] = self._negative.get(index, 0) + 1
+        else:
+            self.zero_count += 1
+        self.count += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self._collapse()
+
+    def update_batch(self, values):
+        """Add a batch of values."""
+        values = np.asarray(values, dtype=float)
+        if values.size == 0:
+            return
+        for bins, selected in ((self._positive, values[values > 0]), (self._negative, -values[values < 0])):
+            if selected.size:
+                indexes, counts = np.unique(
+                    np.ceil(np.log(selected) / self._log_gamma).astype(np.int64),
+                    return_counts=True
+                )
+                for index, count in zip(indexes.tolist(), counts.tolist()):
+                    bins[index] = bins.get(index, 0) + count
+        self.zero_count += int(np.count_nonzero(values == 0))
+        self.count += int(values.size)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self._collapse()
+
+    def merge(self, other):
+        """Merge another sketch with the same accuracy into this one."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        for bins, other_bins in ((self._positive, other._positive), (self._negative, other._negative)):
+            for index, count in other_bins.items():
+                bins[index] = bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._collapse()
+        return self
+
+    def _collapse(self):
+        # Fold the buckets closest to zero together; they matter least for
+        # relative error. Negative buckets are ordered by magnitude too.
+        for bins in (self._positive, self._negative):
+            if len(bins) > self.max_bins:
+                indexes = sorted(bins)
+                excess = len(indexes) - self.max_bins
+                folded = sum(bins.pop(index) for index in indexes[:excess])
+                bins[indexes[excess]] += folded
+
+    def _value_at_rank(self, rank):
+        """Estimate the value of the item at a 0-based rank."""
+        seen = 0
+        for index in sorted(self._negative, reverse=True):
+            seen += self._negative[index]
+            if seen > rank:
+                return -self._value(index)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for index in sorted(self._positive):
+            seen += self._positive[index]
+            if seen > rank:
+                return self._value(index)
+        return self.max
+
+    def quantile(self, q):
+        """
+        Estimate the q-quantile (0 <= q <= 1) with linear interpolation
+        between ranks, like np.percentile(values, q * 100).
+        """
+        if self.count == 0:
+            return None
+        # The extremes are tracked exactly
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        rank = q * (self.count - 1)
+        lower = math.floor(rank)
+        low_value = min(max(self._value_at_rank(lower), self.min), self.max)
+        if rank == lower:
+            return low_value
+        high_value = min(max(self._value_at_rank(lower + 1), self.min), self.max)
+        return low_value + (high_value - low_value) * (rank - lower)
+
+
+class StreamSummary:
+    """Mean, standard deviation and quantiles of a stream in constant memory."""
+
+    def __init__(self, relative_accuracy=0.01):
+        self.stats = RunningStats()
+        self.sketch = QuantileSketch(relative_accuracy)
+
+    @classmethod
+    def from_values(cls, values, relative_accuracy=0.01):
+        summary = cls(relative_accuracy)
+        summary.update_batch(values)
+        return summary
+
+    def update(self, value):
+        self.stats.update(value)
+        self.sketch.update(value)
+
+    def update_batch(self, values):
+        self.stats.update_batch(values)
+        self.sketch.update_batch(values)
+
+    def merge(self, other):
+        self.stats.merge(other.stats)
+        self.sketch.merge(other.sketch)
+        return self
+
+    @property
+    def count(self):
+        return self.stats.count
+
+    @property
+    def mean(self):
+        return self.stats.mean
+
+    @property
+    def std(self):
+        return self.stats.std
+
+    def percentile(self, p):
+        """Estimate a percentile (0-100), the streaming counterpart of np.percentile."""
+        return self.sketch.quantile(p / 100)
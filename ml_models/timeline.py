@@ -0,0 +1,285 @@
+"""
+Multi-resolution timelines for the results page.
+
+Per-packet series (packet rate, size, inter-arrival time, windowed loss) are
+reduced to fixed-width buckets holding count, sum, min and max, first per
+second and then coarsened into wider buckets. A query for a time range picks
+the finest resolution that is not far above the requested point count and
+thins it with Largest-Triangle-Three-Buckets, keeping the min/max envelope of
+the buckets each returned point stands for. Long calls therefore never send
+more than a few hundred points to the browser, and zooming in refetches the
+range at a finer resolution.
+"""
+import logging
+import numpy as np
+from utils.config import Config
+
+logger = logging.getLogger(__name__)
+
+# A level is used for a query while it has at most this many times the
+# requested number of points in range; LTTB thins it from there
+LEVEL_OVERSAMPLE = 8
+
+
+def _bucket(offsets, values, resolution):
+    """Aggregate samples at `offsets` seconds into buckets of `resolution` seconds."""
+    index = np.floor(offsets / resolution).astype(np.int64)
+    order = np.argsort(index, kind='stable')
+    index, values = index[order], values[order]
+    starts = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+    return {
+        'index': index[starts],
+        'count': np.diff(np.r_[starts, len(index)]),
+        'sum': np.add.reduceat(values, starts),
+        'min': np.minimum.reduceat(values, starts),
+        'max': np.maximum.reduceat(values, starts)
+    }
+
+def _merge_buckets(parts):
+    """Combine bucket sets of the same resolution, adding up buckets with the same index."""
+    parts = [part for part in parts if part is not None and len(part['index'])]
+    if len(parts) == 1:
+        return parts[0]
+    if not parts:
+        return None
+    index = np.concatenate([part['index'] for part in parts])
+    order = np.argsort(index, kind='stable')
+    index = index[order]
+    starts = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+    merged = {'index': index[starts]}
+    for field, reduce in (('count', np.add), ('sum', np.add), ('min', np.minimum), ('max', np.maximum)):
+        merged[field] = reduce.reduceat(np.concatenate([part[field] for part in parts])[order], starts)
+    return merged
+
+def _coarsen(buckets, factor):
+    """Combine every `factor` consecutive buckets into one."""
+    index = buckets['index'] // factor
+    starts = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+    return {
+        'index': index[starts],
+        'count': np.add.reduceat(buckets['count'], starts),
+        'sum': np.add.reduceat(buckets['sum'], starts),
+        'min': np.minimum.reduceat(buckets['min'], starts),
+        'max': np.maximum.reduceat(buckets['max'], starts)
+    }
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+
+    Returns:
+        tuple: (indices of the `threshold` selected points, start index of
+        the group of input points each selected point represents).
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        indices = np.arange(n)
+        return indices, indices
+    # The first and last points are kept; the rest is split into threshold - 2 groups
+    bounds = np.r_[np.linspace(1, n - 1, threshold - 1).astype(np.int64), n]
+    selected = [0]
+    for i in range(threshold - 2):
+        lo, hi = bounds[i], bounds[i + 1]
+        next_x = x[bounds[i + 1]:bounds[i + 2]].mean()
+        next_y = y[bounds[i + 1]:bounds[i + 2]].mean()
+        ax, ay = x[selected[-1]], y[selected[-1]]
+        area = np.abs((ax - next_x) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (next_y - ay))
+        selected.append(lo + int(np.argmax(area)))
+    selected.append(n - 1)
+    return np.array(selected), np.r_[0, bounds[:-1]]
+
+
+class Timeline:
+    """
+    Bucketed series of one capture at every resolution in
+    Config.TIMELINE_RESOLUTIONS. Times are seconds since the capture start.
+    """
+
+    def __init__(self, start_time, end_time, resolutions=None):
+        self.start_time = start_time
+        self.end_time = end_time
+        self.resolutions = tuple(resolutions or Config.TIMELINE_RESOLUTIONS)
+        self.series = {}  # name -> {resolution: buckets}
+
+    def add_series(self, name, times, values):
+        """Bucket the samples of one series, given by absolute capture times."""
+        times = np.asarray(times, dtype=float)
+        values = np.asarray(values, dtype=float)
+        if not times.size:
+            return
+        self.add_buckets(name, _bucket(times - self.start_time, values, self.resolutions[0]))
+
+    def add_buckets(self, name, buckets):
+        """Add a series already bucketed at the finest resolution (indexes since the capture start)."""
+        levels = {self.resolutions[0]: buckets}
+        for previous, resolution in zip(self.resolutions, self.resolutions[1:]):
+            buckets = _coarsen(buckets, int(round(resolution / previous)))
+            levels[resolution] = buckets
+        self.series[name] = levels
+
+    def add_counts(self, name, times):
+        """Add a series of events per second, e.g. packet rate."""
+        times = np.asarray(times, dtype=float)
+        if not times.size:
+            return
+        resolution = self.resolutions[0]
+        per_bucket = _bucket(times - self.start_time, np.ones(times.size), resolution)
+        self.add_series(name, self.start_time + per_bucket['index'] * resolution,
+                        per_bucket['count'] / resolution)
+
+    def describe(self):
+        return {
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'duration': self.end_time - self.start_time,
+            'resolutions': list(self.resolutions),
+            'series': sorted(self.series)
+        }
+
+    def query(self, name, start=None, end=None, points=None):
+        """
+        Return the buckets of a series between `start` and `end` seconds
+        (since the capture start), downsampled to at most `points` points.
+        """
+        if name not in self.series:
+            raise KeyError(name)
+        points = max(int(points or Config.TIMELINE_POINTS), 3)
+        start = 0.0 if start is None else float(start)
+        end = self.end_time - self.start_time if end is None else float(end)
+
+        for resolution in self.resolutions:
+            buckets = self.series[name][resolution]
+            lo = np.searchsorted(buckets['index'], np.floor(start / resolution), side='left')
+            hi = np.searchsorted(buckets['index'], end / resolution, side='right')
+            if hi - lo <= points * LEVEL_OVERSAMPLE:
+                break
+
+        t = buckets['index'][lo:hi] * resolution
+        mean = buckets['sum'][lo:hi] / buckets['count'][lo:hi]
+        selected, groups = lttb(t, mean, points)
+        if len(groups):
+            minimum = np.minimum.reduceat(buckets['min'][lo:hi], groups)
+            maximum = np.maximum.reduceat(buckets['max'][lo:hi], groups)
+            count = np.add.reduceat(buckets['count'][lo:hi], groups)
+        else:
+            minimum = maximum = count = np.array([])
+        return {
+            'series': name,
+            'resolution': resolution,
+            'start': start,
+            'end': end,
+            'buckets': int(hi - lo),
+            't': t[selected].tolist(),
+            'mean': mean[selected].tolist(),
+            'min': minimum.tolist(),
+            'max': maximum.tolist(),
+            'count': count.tolist()
+        }
+
+
+class TimelineBuilder:
+    """
+    Mergeable finest-resolution buckets of the timeline series, filled one
+    batch of samples at a time.
+
+    Buckets are aligned to absolute capture time, so builders of consecutive
+    chunks merge by adding up the buckets they share. Memory grows with the
+    capture duration, not with the packet count. Batches are kept apart and
+    combined every `consolidate_every` additions.
+    """
+
+    def __init__(self, resolution=None, consolidate_every=64):
+        self.resolution = resolution or Config.TIMELINE_RESOLUTIONS[0]
+        self.consolidate_every = consolidate_every
+        self.start_time = None
+        self.end_time = None
+        self._parts = {}  # series name -> list of bucket sets
+
+    def add_series(self, name, times, values):
+        """Add samples of one series, given by absolute capture times."""
+        times = np.asarray(times, dtype=float)
+        if not times.size:
+            return
+        self._add(name, _bucket(times, np.asarray(values, dtype=float), self.resolution))
+
+    def add_packets(self, times, sizes):
+        """Add the packet size and inter-arrival series of a time-ordered batch of packets."""
+        times = np.asarray(times, dtype=float)
+        if not times.size:
+            return
+        if self.end_time is not None:
+            self.add_series('inter_arrival', times[:1], [(times[0] - self.end_time) * 1000])
+        self.add_series('packet_size', times, sizes)
+        self.add_series('inter_arrival', times[1:], np.diff(times) * 1000)
+        self.start_time = times[0] if self.start_time is None else self.start_time
+        self.end_time = times[-1]
+
+    def _add(self, name, buckets):
+        parts = self._parts.setdefault(name, [])
+        parts.append(buckets)
+        if len(parts) > self.consolidate_every:
+            self._parts[name] = [_merge_buckets(parts)]
+
+    def merge(self, other):
+        """Append the builder of the chunk that follows this one in time."""
+        if self.end_time is not None and other.start_time is not None:
+            self.add_series('inter_arrival', [other.start_time], [(other.start_time - self.end_time) * 1000])
+        for name, parts in other._parts.items():
+            for buckets in parts:
+                self._add(name, buckets)
+        if other.start_time is not None:
+            self.start_time = other.start_time if self.start_time is None else self.start_time
+            self.end_time = other.end_time
+        return self
+
+    def build(self, resolutions=None):
+        """Return the Timeline of everything added, or None if no packets were added."""
+        if self.start_time is None:
+            return None
+        # The timeline starts at the boundary of the first bucket
+        base = int(np.floor(self.start_time / self.resolution))
+        timeline = Timeline(base * self.resolution, self.end_time, resolutions)
+        for name, parts in sorted(self._parts.items()):
+            buckets = _merge_buckets(parts)
+            if buckets is None:
+                continue
+            buckets = dict(buckets, index=buckets['index'] - base)
+            timeline.add_buckets(name, buckets)
+            if name == 'packet_size':
+                rate = buckets['count'] / self.resolution
+                timeline.add_buckets('packet_rate', {
+                    'index': buckets['index'], 'count': np.ones(len(rate), dtype=np.int64),
+                    'sum': rate, 'min': rate, 'max': rate
+                })
+        return timeline
+
+
+def build_timeline(patterns, flow_metrics):
+    """
+    Build the timeline of a capture from its traffic patterns and flow
+    metrics (see VoIPTrafficAnalyzer.extract_traffic_patterns and
+    AdvancedVoIPMetrics.analyze_call_flow). Sketch-only patterns carry a
+    TimelineBuilder instead of per-packet lists. Returns None for an empty
+    capture.
+    """
+    if patterns.get('timeline') is not None:
+        timeline = patterns['timeline'].build()
+        if timeline is not None and flow_metrics.get('packet_loss_times'):
+            timeline.add_series('packet_loss', flow_metrics['packet_loss_times'],
+                                np.asarray(flow_metrics['packet_loss_windows']) * 100)
+        return timeline
+
+    times = patterns['time_series']
+    if not times:
+        return None
+    # Start at a bucket boundary, like TimelineBuilder.build
+    resolution = Config.TIMELINE_RESOLUTIONS[0]
+    timeline = Timeline(np.floor(min(times) / resolution) * resolution, max(times))
+    timeline.add_counts('packet_rate', times)
+    timeline.add_series('packet_size', times, patterns['packet_sizes'])
+    timeline.add_series('inter_arrival', times[1:], np.asarray(patterns['inter_arrival_times']) * 1000)
+
+    # Each loss window is placed at the packet that completed it
+    timeline.add_series('packet_loss', flow_metrics['packet_loss_times'],
+                        np.asarray(flow_metrics['packet_loss_windows']) * 100)
+    return timeline
@@ -1,65 +1,297 @@
 import numpy as np
 from sklearn.ensemble import IsolationForest
-from collections import defaultdict
+from collections import Counter, defaultdict
+from ml_models.streaming_stats import StreamSummary
+from ml_models.timeline import TimelineBuilder
+from utils.config import Config
+
+PROTOCOLS = ('SIP', 'RTP', 'RTCP')
+
+def packet_arrays(packets):
+    """Return the capture times, sizes and protocols of (protocol, packet) tuples as arrays and a list."""
+    times = np.fromiter((float(pkt.time) for _, pkt in packets), dtype=np.float64, count=len(packets))
+    sizes = np.fromiter((len(pkt) for _, pkt in packets), dtype=np.int64, count=len(packets))
+    return times, sizes, [proto for proto, _ in packets]
+
+def _priorities(times, sizes):
+    # SplitMix64 of the packet's time and size: a packet gets the same
+    # sampling priority however the capture is split into chunks
+    x = times.view(np.uint64) ^ (sizes.astype(np.uint64) << np.uint64(40))
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+class PacketSample:
+    """
+    Uniform sample of at most `capacity` packets (time, size, preceding
+    inter-arrival time, protocol), mergeable across chunks.
+
+    Every packet gets a pseudo-random priority and the sample holds the
+    packets with the lowest ones (bottom-k sampling), so merging samples of
+    consecutive chunks gives the sample of the whole capture.
+    """
+
+    FIELDS = ('time', 'size', 'inter_arrival', 'protocol', 'priority')
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity or Config.ANOMALY_SAMPLE_SIZE
+        self.columns = {
+            'time': np.empty(0), 'size': np.empty(0, dtype=np.int64), 'inter_arrival': np.empty(0),
+            'protocol': np.empty(0, dtype=np.int8), 'priority': np.empty(0, dtype=np.uint64)
+        }
+
+    def __len__(self):
+        return len(self.columns['time'])
+
+    def add(self, times, sizes, inter_arrivals, protocols):
+        """Offer a batch of packets; `protocols` are indexes into PROTOCOLS."""
+        self._combine({
+            'time': times, 'size': sizes, 'inter_arrival': inter_arrivals,
+            'protocol': np.asarray(protocols, dtype=np.int8), 'priority': _priorities(times, sizes)
+        })
+
+    def merge(self, other):
+        self._combine(other.columns)
+        return self
+
+    def _combine(self, columns):
+        merged = {field: np.concatenate([self.columns[field], columns[field]]) for field in self.FIELDS}
+        if len(merged['time']) > self.capacity:
+            keep = np.argpartition(merged['priority'], self.capacity - 1)[:self.capacity]
+            merged = {field: values[keep] for field, values in merged.items()}
+        order = np.argsort(merged['time'], kind='stable')
+        self.columns = {field: values[order] for field, values in merged.items()}
+
+
+class TrafficSummary:
+    """
+    Sketch-only traffic patterns of a time-ordered packet stream.
+
+    Holds the size and inter-arrival summaries, protocol counts and
+    transitions, burst totals, a PacketSample for anomaly detection and the
+    timeline buckets, all in memory independent of the packet count.
+    Summaries of consecutive chunks are combined with merge().
+    """
+
+    def __init__(self, accuracy=None, sample_size=None):
+        self.accuracy = accuracy or Config.SKETCH_RELATIVE_ACCURACY
+        self.count = 0
+        self.first_time = self.last_time = None
+        self.first_protocol = self.last_protocol = None
+        self.size_summary = StreamSummary(self.accuracy)
+        self.inter_arrival_summary = StreamSummary(self.accuracy)
+        self.protocol_counts = Counter()
+        self.protocol_transitions = Counter()
+        # Burst runs still open at either end, as [first time, second time,
+        # last time, packets, bytes, size of the first packet], and the totals
+        # (count, duration, packets, bytes) of the closed bursts
+        self.runs = []
+        self.burst_totals = [0, 0.0, 0, 0]
+        self.sample = PacketSample(sample_size)
+        self.timeline = TimelineBuilder()
+
+    def update_batch(self, times, sizes, protocols):
+        """Add a time-ordered batch of packets that follows everything added so far."""
+        if len(times):
+            batch = TrafficSummary(self.accuracy, self.sample.capacity)
+            batch._fill(np.asarray(times, dtype=np.float64), np.asarray(sizes, dtype=np.int64), list(protocols))
+            self.merge(batch)
+        return self
+
+    def _fill(self, times, sizes, protocols):
+        gaps = np.diff(times)
+        self.count = len(times)
+        self.first_time, self.last_time = float(times[0]), float(times[-1])
+        self.first_protocol, self.last_protocol = protocols[0], protocols[-1]
+        self.size_summary.update_batch(sizes)
+        self.inter_arrival_summary.update_batch(gaps)
+        self.protocol_counts.update(protocols)
+        self.protocol_transitions.update(f"{a}->{b}" for a, b in zip(protocols, protocols[1:]))
+
+        # Runs of packets separated by at most the burst threshold
+        starts = np.flatnonzero(np.r_[True, gaps > VoIPTrafficAnalyzer.BURST_THRESHOLD])
+        ends = np.r_[starts[1:], len(times)]
+        packets = ends - starts
+        run_bytes = np.add.reduceat(sizes, starts)
+        runs = np.column_stack([times[starts], times[np.minimum(starts + 1, len(times) - 1)], times[ends - 1],
+                                packets, run_bytes, sizes[starts]])
+        closed = runs[1:-1][packets[1:-1] > VoIPTrafficAnalyzer.MIN_BURST_SIZE]
+        self.burst_totals = [len(closed), float(np.sum(closed[:, 2] - closed[:, 0])),
+                             int(np.sum(closed[:, 3])), int(np.sum(closed[:, 4]))]
+        self.runs = [runs[0].tolist()] + ([runs[-1].tolist()] if len(runs) > 1 else [])
+
+        codes = np.array([PROTOCOLS.index(p) if p in PROTOCOLS else -1 for p in protocols], dtype=np.int8)
+        self.sample.add(times, sizes, np.r_[np.nan, gaps], codes)
+        self.timeline.add_packets(times, sizes)
+
+    def _close_run(self, run):
+        if run[3] > VoIPTrafficAnalyzer.MIN_BURST_SIZE:
+            totals = self.burst_totals
+            totals[0] += 1
+            totals[1] += run[2] - run[0]
+            totals[2] += int(run[3])
+            totals[3] += int(run[4])
+
+    def merge(self, other):
+        """Merge the summary of the chunk that immediately follows this one."""
+        if not other.count:
+            return self
+        if not self.count:
+            # Keep series added to the timeline without packets (e.g. loss windows)
+            timeline = self.timeline
+            self.__dict__.update(other.__dict__)
+            self.timeline = timeline.merge(other.timeline)
+            return self
+
+        edge_gap = other.first_time - self.last_time
+        self.inter_arrival_summary.update(edge_gap)
+        self.inter_arrival_summary.merge(other.inter_arrival_summary)
+        self.size_summary.merge(other.size_summary)
+        self.protocol_counts.update(other.protocol_counts)
+        self.protocol_transitions.update(other.protocol_transitions)
+        self.protocol_transitions[f"{self.last_protocol}->{other.first_protocol}"] += 1
+
+        runs = [list(run) for run in self.runs]
+        other_runs = [list(run) for run in other.runs]
+        if edge_gap <= VoIPTrafficAnalyzer.BURST_THRESHOLD:
+            left, right = runs[-1], other_runs.pop(0)
+            runs[-1] = [left[0], left[1] if left[3] > 1 else right[0], right[2],
+                        left[3] + right[3], left[4] + right[4], left[5]]
+        runs.extend(other_runs)
+        # Only the first and last runs can still be extended
+        for run in runs[1:-1]:
+            self._close_run(run)
+        self.runs = [runs[0], runs[-1]] if len(runs) > 1 else runs
+        for i, total in enumerate(other.burst_totals):
+            self.burst_totals[i] += total
+
+        # The first packet of the following chunk now has a preceding packet
+        columns = other.sample.columns
+        first = (columns['time'] == other.first_time) & np.isnan(columns['inter_arrival'])
+        columns['inter_arrival'][first] = edge_gap
+        self.sample.merge(other.sample)
+        self.timeline.merge(other.timeline)
+
+        self.count += other.count
+        self.last_time, self.last_protocol = other.last_time, other.last_protocol
+        return self
+
+    def burst_statistics(self):
+        """Return the burst statistics of VoIPTrafficAnalyzer._analyze_bursts for the whole capture."""
+        count, duration, packets, total_bytes = self.burst_totals
+        runs = [list(run) for run in self.runs]
+        if runs:
+            # The very first packet of a capture never opens a burst
+            first = runs[0]
+            runs[0] = [first[1], first[1], first[2], first[3] - 1, first[4] - first[5], 0]
+        for run in runs:
+            if run[3] > VoIPTrafficAnalyzer.MIN_BURST_SIZE:
+                count += 1
+                duration += run[2] - run[0]
+                packets += int(run[3])
+                total_bytes += int(run[4])
+        if not count:
+            return None
+        return {
+            'count': count,
+            'avg_duration': duration / count,
+            'avg_size': packets / count,
+            'avg_packet_size': total_bytes / packets
+        }
+
+    def patterns(self):
+        """Return sketch-only traffic patterns (see VoIPTrafficAnalyzer.extract_traffic_patterns)."""
+        return {
+            'packet_count': self.count,
+            'size_summary': self.size_summary,
+            'inter_arrival_summary': self.inter_arrival_summary,
+            'protocol_counts': dict(self.protocol_counts),
+            'protocol_transitions': dict(self.protocol_transitions),
+            'burst_statistics': self.burst_statistics(),
+            'packet_sample': self.sample.columns,
+            'timeline': self.timeline
+        }
+
 
 class VoIPTrafficAnalyzer:
-    def __init__(self):
+    BURST_THRESHOLD = 0.05  # 50ms
+    MIN_BURST_SIZE = 5  # packets
+
+    def __init__(self, sketch_accuracy=None):
         self.anomaly_detector = IsolationForest(
             contamination=0.1,
             random_state=42
         )
+        self.sketch_accuracy = sketch_accuracy or Config.SKETCH_RELATIVE_ACCURACY
     
-    def extract_traffic_patterns(self, packets):
-        """Extract traffic patterns from packet sequence"""
-        patterns = {
-            'time_series': [],
-            'packet_sizes': [],
-            'inter_arrival_times': [],
-            'protocol_sequence': [],
-            'burst_patterns': []
+    def extract_traffic_patterns(self, packets, sketch_only=False):
+        """
+        Extract traffic patterns from packet sequence.
+
+        With sketch_only, no per-packet lists are built: the patterns hold the
+        summaries of a TrafficSummary (see TrafficSummary.patterns), which the
+        streaming and chunked analyses merge across batches.
+        """
+        times, sizes, protocols = packet_arrays(packets)
+        if sketch_only:
+            return TrafficSummary(self.sketch_accuracy).update_batch(times, sizes, protocols).patterns()
+
+        inter_arrivals = np.diff(times)
+        size_summary = StreamSummary(self.sketch_accuracy)
+        size_summary.update_batch(sizes)
+        inter_arrival_summary = StreamSummary(self.sketch_accuracy)
+        inter_arrival_summary.update_batch(inter_arrivals)
+
+        # Burst detection: runs of packets at most BURST_THRESHOLD apart; the
+        # very first packet never opens a burst
+        burst_patterns = []
+        if len(times) > 1:
+            starts = np.r_[1, np.flatnonzero(inter_arrivals[1:] > self.BURST_THRESHOLD) + 2]
+            ends = np.r_[starts[1:], len(times)]
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                if end - start > self.MIN_BURST_SIZE:
+                    burst_patterns.append(list(zip(times[start:end].tolist(), sizes[start:end].tolist())))
+
+        return {
+            'packet_count': len(times),
+            'time_series': times.tolist(),
+            'packet_sizes': sizes.tolist(),
+            'inter_arrival_times': inter_arrivals.tolist(),
+            'protocol_sequence': protocols,
+            'burst_patterns': burst_patterns,
+            'size_summary': size_summary,
+            'inter_arrival_summary': inter_arrival_summary
         }
-        
-        last_time = None
-        current_burst = []
-        burst_threshold = 0.05  # 50ms
-        
-        for proto, pkt in packets:
-            current_time = float(pkt.time)
-            packet_size = len(pkt)
-            
-            patterns['time_series'].append(current_time)
-            patterns['packet_sizes'].append(packet_size)
-            patterns['protocol_sequence'].append(proto)
-            
-            if last_time is not None:
-                inter_arrival = current_time - last_time
-                patterns['inter_arrival_times'].append(inter_arrival)
-                
-                # Burst detection
-                if inter_arrival <= burst_threshold:
-                    current_burst.append((current_time, packet_size))
-                else:
-                    if len(current_burst) > 5:  # Minimum burst size
-                        patterns['burst_patterns'].append(current_burst)
-                    current_burst = [(current_time, packet_size)]
-            
-            last_time = current_time
-            
-        # Handle last burst
-        if len(current_burst) > 5:
-            patterns['burst_patterns'].append(current_burst)
-            
-        return patterns
     
     def analyze_traffic_behavior(self, patterns):
         """Analyze traffic behavior and identify patterns"""
+        if 'protocol_sequence' in patterns:
+            protocol_distribution = self._analyze_protocol_distribution(patterns['protocol_sequence'])
+            burst_statistics = self._analyze_bursts(patterns['burst_patterns'])
+        else:
+            # Sketch-only patterns carry the counts and burst statistics
+            protocol_distribution = {
+                'protocol_counts': patterns['protocol_counts'],
+                'protocol_transitions': patterns['protocol_transitions']
+            }
+            burst_statistics = patterns['burst_statistics']
         behavior = {
-            'burst_statistics': self._analyze_bursts(patterns['burst_patterns']),
-            'protocol_distribution': self._analyze_protocol_distribution(patterns['protocol_sequence']),
-            'size_distribution': self._analyze_size_distribution(patterns['packet_sizes']),
-            'timing_analysis': self._analyze_timing(patterns['inter_arrival_times'])
+            'burst_statistics': burst_statistics,
+            'protocol_distribution': protocol_distribution,
+            'size_distribution': self._analyze_size_distribution(
+                patterns.get('size_summary') or patterns['packet_sizes']),
+            'timing_analysis': self._analyze_timing(
+                patterns.get('inter_arrival_summary') or patterns['inter_arrival_times'])
         }
         return behavior
+
+    def _summarize(self, values):
+        """Return a StreamSummary for a list of values or an existing summary"""
+        if isinstance(values, StreamSummary):
+            return values
+        return StreamSummary.from_values(values, self.sketch_accuracy)
     
     def _analyze_bursts(self, bursts):
         """Analyze burst patterns"""
@@ -91,71 +323,88 @@ class VoIPTrafficAnalyzer:
         }
     
     def _analyze_size_distribution(self, packet_sizes):
-        """Analyze packet size distribution"""
-        if not packet_sizes:
+        """Analyze packet size distribution from a list or StreamSummary"""
+        summary = self._summarize(packet_sizes)
+        if not summary.count:
             return None
             
         return {
-            'mean': np.mean(packet_sizes),
-            'std': np.std(packet_sizes),
+            'mean': summary.mean,
+            'std': summary.std,
             'percentiles': {
-                '25': np.percentile(packet_sizes, 25),
-                '50': np.percentile(packet_sizes, 50),
-                '75': np.percentile(packet_sizes, 75)
+                '25': summary.percentile(25),
+                '50': summary.percentile(50),
+                '75': summary.percentile(75)
             }
         }
     
     def _analyze_timing(self, inter_arrival_times):
-        """Analyze packet timing patterns"""
-        if not inter_arrival_times:
+        """Analyze packet timing patterns from a list or StreamSummary"""
+        summary = self._summarize(inter_arrival_times)
+        if not summary.count:
             return None
             
         return {
-            'mean_inter_arrival': np.mean(inter_arrival_times),
-            'jitter': np.std(inter_arrival_times),
+            'mean_inter_arrival': summary.mean,
+            'jitter': summary.std,
             'timing_percentiles': {
-                '25': np.percentile(inter_arrival_times, 25),
-                '50': np.percentile(inter_arrival_times, 50),
-                '75': np.percentile(inter_arrival_times, 75)
+                '25': summary.percentile(25),
+                '50': summary.percentile(50),
+                '75': summary.percentile(75)
             }
         }
     
-    def detect_anomalies(self, patterns):
-        """Detect anomalies in traffic patterns"""
+    def detect_anomalies(self, patterns, limit=None):
+        """
+        Detect anomalies in traffic patterns. Sketch-only patterns are
+        checked on their packet sample. At most `limit` (default
+        Config.ANOMALY_REPORT_LIMIT) of the most anomalous packets are
+        returned, in capture order.
+        """
+        limit = Config.ANOMALY_REPORT_LIMIT if limit is None else limit
+        sample = patterns.get('packet_sample')
+        if sample is not None:
+            known = ~np.isnan(sample['inter_arrival'])
+            times = sample['time'][known]
+            sizes = sample['size'][known]
+            inter_arrivals = sample['inter_arrival'][known]
+            protocols = [PROTOCOLS[code] if code >= 0 else None for code in sample['protocol'][known].tolist()]
+        else:
+            times = patterns['time_series']
+            sizes = patterns['packet_sizes']
+            inter_arrivals = patterns['inter_arrival_times']
+            protocols = patterns['protocol_sequence']
+
         # Check if we have enough data
-        if (len(patterns['packet_sizes']) < 2 or 
-            len(patterns['inter_arrival_times']) < 1 or 
-            len(patterns['protocol_sequence']) < 2):
+        if len(sizes) < 2 or len(inter_arrivals) < 1 or len(protocols) < 2:
             return []
 
         # Get the minimum length to ensure all arrays match
-        min_length = min(
-            len(patterns['packet_sizes']),
-            len(patterns['inter_arrival_times']),
-            len(patterns['protocol_sequence'])
-        )
+        min_length = min(len(sizes), len(inter_arrivals), len(protocols))
 
         # Prepare features for anomaly detection with matching lengths
         features = np.column_stack([
-            patterns['packet_sizes'][:min_length],
-            patterns['inter_arrival_times'][:min_length],
-            [int(p == 'RTP') for p in patterns['protocol_sequence'][:min_length]]
+            np.asarray(sizes[:min_length]),
+            np.asarray(inter_arrivals[:min_length]),
+            [int(p == 'RTP') for p in protocols[:min_length]]
         ])
         
         # Fit and predict anomalies
         predictions = self.anomaly_detector.fit_predict(features)
         anomaly_indices = np.where(predictions == -1)[0]
+        if len(anomaly_indices) > limit:
+            # Lower scores are more anomalous
+            scores = self.anomaly_detector.score_samples(features[anomaly_indices])
+            anomaly_indices = np.sort(anomaly_indices[np.argsort(scores, kind='stable')[:limit]])
         
         # Analyze anomalies
         anomalies = []
         for idx in anomaly_indices:
-            if idx < min_length:  # Ensure we don't exceed array bounds
-                anomaly = {
-                    'timestamp': patterns['time_series'][idx],
-                    'packet_size': patterns['packet_sizes'][idx],
-                    'protocol': patterns['protocol_sequence'][idx],
-                    'inter_arrival': patterns['inter_arrival_times'][idx] if idx < len(patterns['inter_arrival_times']) else None
-                }
-                anomalies.append(anomaly)
+            anomalies.append({
+                'timestamp': float(times[idx]),
+                'packet_size': int(sizes[idx]),
+                'protocol': protocols[idx],
+                'inter_arrival': float(inter_arrivals[idx])
+            })
         
         return anomalies
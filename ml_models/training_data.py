@@ -0,0 +1,155 @@
+"""
+Bounded-memory training sets for corpora too large to load at once.
+
+Calls are fed in batches (one capture at a time) into a stratified
+reservoir sample: every label keeps a uniform random sample of at most
+`samples_per_class` calls, so rare labels are not drowned out and memory
+does not grow with the corpus. Reservoirs and the resulting train/test
+matrices live in memory-mapped .npy files. The split is by time: the most
+recent calls of the sample form the test set, so the model is evaluated on
+calls later than those it was trained on.
+"""
+import logging
+import os
+import numpy as np
+from numpy.lib.format import open_memmap
+from utils.config import Config
+
+logger = logging.getLogger(__name__)
+
+# Rows copied at a time when writing the split matrices
+COPY_BLOCK_ROWS = 65536
+
+
+class TrainingSetBuilder:
+    """
+    Stratified reservoir sample of call feature vectors (Algorithm R per
+    label), backed by memory-mapped .npy files in `output_dir`.
+    """
+
+    def __init__(self, output_dir=None, samples_per_class=None, seed=None):
+        self.output_dir = output_dir or Config.TRAINING_DATA_DIR
+        self.samples_per_class = samples_per_class or Config.TRAINING_SAMPLES_PER_CLASS
+        self.seen = {}  # label -> calls offered
+        self._features = {}  # label -> memmap (samples_per_class, n_features)
+        self._times = {}  # label -> memmap (samples_per_class,) of call start times
+        self._rng = np.random.default_rng(Config.TRAINING_SEED if seed is None else seed)
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    @property
+    def total(self):
+        return sum(self.seen.values())
+
+    def sampled(self, label):
+        return min(self.seen.get(label, 0), self.samples_per_class)
+
+    def _path(self, name):
+        return os.path.join(self.output_dir, f'{name}.npy')
+
+    def _reservoir(self, label, n_features):
+        if label not in self._features:
+            shape = (self.samples_per_class, n_features)
+            self._features[label] = open_memmap(self._path(f'reservoir_{label}_features'), mode='w+',
+                                                dtype=np.float64, shape=shape)
+            self._times[label] = open_memmap(self._path(f'reservoir_{label}_times'), mode='w+',
+                                             dtype=np.float64, shape=(self.samples_per_class,))
+        return self._features[label], self._times[label]
+
+    def add(self, features, labels, start_times):
+        """Offer a batch of feature vectors with their labels and call start times."""
+        features = np.asarray(features, dtype=np.float64)
+        labels = np.asarray(labels)
+        start_times = np.asarray(start_times, dtype=np.float64)
+        capacity = self.samples_per_class
+
+        for label in np.unique(labels):
+            label = label.item()
+            mask = labels == label
+            rows, times = features[mask], start_times[mask]
+            reservoir, reservoir_times = self._reservoir(label, features.shape[1])
+            seen = self.seen.get(label, 0)
+
+            # Fill the reservoir, then replace a random slot with probability capacity / (position + 1)
+            fill = max(min(capacity - seen, len(rows)), 0)
+            reservoir[seen:seen + fill] = rows[:fill]
+            reservoir_times[seen:seen + fill] = times[:fill]
+            if len(rows) > fill:
+                positions = seen + fill + np.arange(len(rows) - fill)
+                slots = self._rng.integers(0, positions + 1)
+                keep = slots < capacity
+                # Repeated slots keep the last row, as sequential replacement would
+                reservoir[slots[keep]] = rows[fill:][keep]
+                reservoir_times[slots[keep]] = times[fill:][keep]
+            self.seen[label] = seen + len(rows)
+
+    def split(self, test_fraction=None, test_after=None):
+        """
+        Write the sample as train and test matrices split by call start time.
+
+        X_<split>.npy, y_<split>.npy and the call start times t_<split>.npy
+        are left in `output_dir` for later runs (see load_training_set).
+
+        Parameters:
+            test_fraction (float): Share of the sample, the most recent calls,
+                used for testing (defaults to Config.TRAINING_TEST_FRACTION).
+            test_after (float): Unix time from which calls go to the test
+                set instead; takes precedence over test_fraction.
+
+        Returns:
+            tuple: X_train, X_test, y_train, y_test as read-only memmaps.
+        """
+        labels = sorted(self._features)
+        if not labels:
+            raise ValueError("No calls were added to the training set")
+        if test_after is None:
+            test_fraction = Config.TRAINING_TEST_FRACTION if test_fraction is None else test_fraction
+            times = np.concatenate([self._times[label][:self.sampled(label)] for label in labels])
+            test_after = np.quantile(times, 1 - test_fraction) if test_fraction > 0 else np.inf
+
+        n_features = self._features[labels[0]].shape[1]
+        for reservoir in self._features.values():
+            reservoir.flush()
+        arrays = {}
+        for name, in_test in (('train', False), ('test', True)):
+            masks = {label: (self._times[label][:self.sampled(label)] >= test_after) == in_test for label in labels}
+            total = sum(int(np.count_nonzero(mask)) for mask in masks.values())
+            X = open_memmap(self._path(f'X_{name}'), mode='w+', dtype=np.float64, shape=(total, n_features))
+            y = open_memmap(self._path(f'y_{name}'), mode='w+', dtype=np.int64, shape=(total,))
+            t = open_memmap(self._path(f't_{name}'), mode='w+', dtype=np.float64, shape=(total,))
+            offset = 0
+            for label in labels:
+                sampled = self.sampled(label)
+                for start in range(0, sampled, COPY_BLOCK_ROWS):
+                    end = min(start + COPY_BLOCK_ROWS, sampled)
+                    block_mask = masks[label][start:end]
+                    rows = self._features[label][start:end][block_mask]
+                    X[offset:offset + len(rows)] = rows
+                    y[offset:offset + len(rows)] = label
+                    t[offset:offset + len(rows)] = self._times[label][start:end][block_mask]
+                    offset += len(rows)
+            X.flush()
+            y.flush()
+            t.flush()
+            del X, y, t
+            arrays[name] = (np.load(self._path(f'X_{name}'), mmap_mode='r'),
+                            np.load(self._path(f'y_{name}'), mmap_mode='r'))
+
+        for label in labels:
+            logger.info(f"Label {label}: {self.seen[label]} calls seen, {self.sampled(label)} sampled")
+        logger.info(f"Time-based split at {test_after:.3f}: {len(arrays['train'][1])} training, "
+                    f"{len(arrays['test'][1])} test samples")
+        return arrays['train'][0], arrays['test'][0], arrays['train'][1], arrays['test'][1]
+
+
+def load_training_set(output_dir=None):
+    """
+    Load the matrices written by TrainingSetBuilder.split as read-only
+    memmaps: X_train, X_test, y_train, y_test, t_train, t_test. Returns None
+    if no training set was written yet.
+    """
+    output_dir = output_dir or Config.TRAINING_DATA_DIR
+    names = ('X_train', 'X_test', 'y_train', 'y_test', 't_train', 't_test')
+    paths = [os.path.join(output_dir, f'{name}.npy') for name in names]
+    if not all(os.path.exists(path) for path in paths):
+        return None
+    return tuple(np.load(path, mmap_mode='r') for path in paths)
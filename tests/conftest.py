@@ -0,0 +1,31 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic_capture import generate_capture
+from data_processing.pcap_stream import iter_capture_packets
+from data_processing.pcap_processor import filter_voip_packets
+
+
+@pytest.fixture(scope='session')
+def make_capture(tmp_path_factory):
+    """Return a function that writes a synthetic capture (once per argument set) and returns its path."""
+    captures = {}
+
+    def make(fmt='pcap', **kwargs):
+        key = (fmt, tuple(sorted(kwargs.items())))
+        if key not in captures:
+            path = tmp_path_factory.mktemp('captures') / f'synthetic.{fmt}'
+            generate_capture(str(path), fmt=fmt, **kwargs)
+            captures[key] = str(path)
+        return captures[key]
+    return make
+
+@pytest.fixture(scope='session')
+def voip_packets(make_capture):
+    """Return a function giving the classified (protocol, packet) tuples of a synthetic capture."""
+    def classify(**kwargs):
+        return filter_voip_packets(iter_capture_packets(make_capture(**kwargs)))
+    return classify
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+from ml_models.advanced_metrics import AdvancedVoIPMetrics
+from ml_models.parallel_analysis import ChunkState
+from ml_models.timeline import Timeline
+
+LOSSY = dict(dialogs=3, duration=20.0, loss=0.02, jitter=0.002, ssrc_changes=1, seed=7)
+
+
+def test_sequence_loss_unwraps_16_bit_sequence_numbers():
+    assert AdvancedVoIPMetrics._sequence_loss([65533, 65534, 65535, 0, 1, 2]) == 0
+    assert AdvancedVoIPMetrics._sequence_loss([65534, 0, 1]) == pytest.approx(1 / 4)
+
+def test_sequence_loss_ignores_duplicates_and_reordering():
+    assert AdvancedVoIPMetrics._sequence_loss([10, 12, 11, 12]) == 0
+
+def test_no_loss_across_interleaved_streams(voip_packets):
+    packets = voip_packets(dialogs=3, duration=10.0, ssrc_changes=1, seed=3)
+    flow_metrics = AdvancedVoIPMetrics().analyze_call_flow(packets)
+    assert flow_metrics['packet_loss_windows']
+    assert max(flow_metrics['packet_loss_windows']) == 0
+
+def test_known_loss_is_measured_per_stream(voip_packets):
+    quality_metrics = AdvancedVoIPMetrics()
+    packets = voip_packets(**LOSSY)
+    flow_metrics = quality_metrics.analyze_call_flow(packets)
+    state = ChunkState.from_packets(packets, quality_metrics)
+    report = quality_metrics.generate_qos_report(state.call_data(), flow_metrics)
+
+    assert report['quality_metrics']['packet_loss_rate'] == pytest.approx(LOSSY['loss'], abs=0.01)
+    assert report['quality_metrics']['mos'] > 3.5
+    assert len(flow_metrics['packet_loss_times']) == len(flow_metrics['packet_loss_windows'])
+
+def test_loss_windows_are_stitched_across_chunks(voip_packets):
+    quality_metrics = AdvancedVoIPMetrics()
+    packets = voip_packets(**LOSSY)
+    single = quality_metrics.analyze_call_flow(packets)
+
+    bounds = [0, 777, 1500, 4321, len(packets)]
+    merged = None
+    for start, end in zip(bounds, bounds[1:]):
+        state = ChunkState.from_packets(packets[start:end], quality_metrics, per_call=False)
+        merged = state if merged is None else merged.merge(state, quality_metrics)
+
+    flow_metrics = merged.flow_metrics()
+    assert flow_metrics['packet_loss'].count == len(single['packet_loss_windows'])
+    assert flow_metrics['packet_loss'].mean == pytest.approx(np.mean(single['packet_loss_windows']))
+    assert flow_metrics['packet_loss_max'] == max(single['packet_loss_windows'])
+
+    # The loss windows of the merged timeline sit at the same packets
+    timeline = merged.traffic.timeline.build()
+    expected = Timeline(timeline.start_time, timeline.end_time)
+    expected.add_series('packet_loss', single['packet_loss_times'], np.asarray(single['packet_loss_windows']) * 100)
+    actual = timeline.query('packet_loss', points=10 ** 6)
+    wanted = expected.query('packet_loss', points=10 ** 6)
+    assert actual['t'] == wanted['t'] and actual['count'] == wanted['count']
+    assert actual['mean'] == pytest.approx(wanted['mean'])
+
+def test_rtp_stream_stats_merge_across_chunks(voip_packets):
+    quality_metrics = AdvancedVoIPMetrics()
+    packets = voip_packets(**LOSSY)
+    single = quality_metrics.analyze_call_flow(packets)
+
+    first = ChunkState.from_packets(packets[:1000], quality_metrics, per_call=False)
+    second = ChunkState.from_packets(packets[1000:], quality_metrics, per_call=False)
+    merged = first.merge(second, quality_metrics).flow_metrics()['rtp_stream_stats']
+
+    assert merged.keys() == single['rtp_streams'].keys()
+    for ssrc, times in single['rtp_streams'].items():
+        assert merged[ssrc].packet_count == len(times)
+        assert (merged[ssrc].start_time, merged[ssrc].end_time) == (times[0], times[-1])
+        assert merged[ssrc].jitter == pytest.approx(np.std(np.diff(times)))
+
+def test_setup_time_is_invite_to_answer_duration(voip_packets):
+    quality_metrics = AdvancedVoIPMetrics()
+    packets = voip_packets(**LOSSY)
+    flow_metrics = quality_metrics.analyze_call_flow(packets)
+
+    # The generator answers each INVITE after 50-500 ms
+    assert 0.05 <= flow_metrics['setup_time'] <= 0.5
+    assert len(flow_metrics['sip_invites']) == LOSSY['dialogs']
+    assert 'Long call setup time' not in quality_metrics.detect_anomalies(flow_metrics)
+
+    # An INVITE and its answer in different chunks still give the same duration
+    answer = next(i for i, (protocol, packet) in enumerate(packets)
+                  if protocol == 'SIP' and bytes(packet['Raw'].load).startswith(b'SIP/2.0 200'))
+    first = ChunkState.from_packets(packets[:answer], quality_metrics, per_call=False)
+    second = ChunkState.from_packets(packets[answer:], quality_metrics, per_call=False)
+    merged = first.merge(second, quality_metrics).flow_metrics()
+    assert merged['setup_time'] == pytest.approx(flow_metrics['setup_time'])
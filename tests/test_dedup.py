@@ -0,0 +1,111 @@
+import struct
+from scapy.layers.l2 import Ether
+from benchmarks.synthetic_capture import build_rtp, build_sip, build_udp_frame
+from data_processing.dedup import DuplicateStats, PacketDeduplicator, deduplicate_packets
+from data_processing.pcap_stream import CaptureStreamParser
+
+
+def frame(ip_id, payload, src='10.0.0.1', sport=4000):
+    return build_udp_frame(src, '10.0.0.2', sport, 4000, payload, ip_id=ip_id)
+
+def packet(time, data):
+    packet = Ether(data)
+    packet.time = time
+    return packet
+
+def pcapng_block(block_type, body):
+    body += bytes(-len(body) % 4)
+    return struct.pack('<II', block_type, len(body) + 12) + body + struct.pack('<I', len(body) + 12)
+
+def pcapng(interfaces, packets):
+    """Return pcapng bytes for (if_name or None) interfaces and (interface, time, frame) packets."""
+    data = pcapng_block(0x0A0D0D0A, struct.pack('<IHHq', 0x1A2B3C4D, 1, 0, -1))
+    for name in interfaces:
+        options = b''
+        if name:
+            options = struct.pack('<HH', 2, len(name)) + name.encode() + bytes(-len(name) % 4)
+        data += pcapng_block(0x00000001, struct.pack('<HHI', 1, 0, 65535) + options)
+    for interface, time, raw in packets:
+        ticks = round(time * 10 ** 6)
+        data += pcapng_block(0x00000006, struct.pack(
+            '<IIIII', interface, ticks >> 32, ticks & 0xFFFFFFFF, len(raw), len(raw)) + raw)
+    return data
+
+
+def test_copies_within_the_window_are_dropped():
+    rtp = frame(7, build_rtp(1, 160, 0x1234))
+    sip = build_sip('OPTIONS sip:bob@example.com SIP/2.0', 'call-1', '1 OPTIONS', 'tag',
+                    'sip:alice@example.com', 'sip:bob@example.com', '10.0.0.1')
+    packets = [
+        packet(0.0, rtp),
+        packet(0.05, rtp),  # seen at a second tap
+        packet(0.06, frame(1, sip, sport=5060)),
+        packet(0.07, frame(2, sip, sport=5060)),  # a retransmission has its own IP ID
+        packet(0.5, rtp)  # long after the window
+    ]
+    deduplicator = PacketDeduplicator(window=0.1)
+    kept = list(deduplicate_packets(packets, deduplicator))
+
+    assert [float(p.time) for p in kept] == [0.0, 0.06, 0.07, 0.5]
+    assert deduplicator.stats.duplicates == 1
+
+def test_copies_are_caught_across_one_generation_boundary():
+    rtp = frame(7, build_rtp(1, 160, 0x1234))
+    deduplicator = PacketDeduplicator(window=0.1)
+    assert not deduplicator.is_duplicate(packet(0.09, rtp))
+    # The generation rotates at 0.1; the original is still in the previous one
+    assert not deduplicator.is_duplicate(packet(0.15, frame(8, build_rtp(2, 320, 0x1234))))
+    assert deduplicator._previous
+    assert deduplicator.is_duplicate(packet(0.16, rtp))
+    # Copies are remembered as well; once a whole slot has passed without one it is forgotten
+    assert deduplicator.is_duplicate(packet(0.21, rtp))
+    assert not deduplicator.is_duplicate(packet(0.41, rtp))
+
+def test_state_depends_only_on_the_last_two_slots():
+    rtp = [frame(seq, build_rtp(seq, 160 * seq, 0x1234)) for seq in range(30)]
+    stream = [packet(i * 0.013, rtp[i % 7]) for i in range(30)]
+    whole = PacketDeduplicator(window=0.1)
+    expected = [whole.is_duplicate(p) for p in stream]
+
+    # Replaying only the packets of the two slots before a point rebuilds the state there
+    for start in range(1, 30):
+        primed = PacketDeduplicator(window=0.1)
+        for p in stream[:start]:
+            if float(p.time) >= float(stream[start].time) - 0.2:
+                primed.is_duplicate(p)
+        assert [primed.is_duplicate(p) for p in stream[start:]] == expected[start:]
+
+def test_generations_are_bounded_by_max_entries():
+    deduplicator = PacketDeduplicator(window=10, max_entries=3)
+    for seq in range(10):
+        deduplicator.is_duplicate(packet(seq * 0.001, frame(seq, build_rtp(seq, 160 * seq, 0x1234))))
+        assert len(deduplicator._current) <= 3 and len(deduplicator._previous) <= 3
+
+def test_duplicates_are_counted_per_interface():
+    frames = [frame(seq, build_rtp(seq, 160 * seq, 0x1234)) for seq in range(20)]
+    # Every datagram is seen at the mirror port first, then again at the unnamed tap
+    captured = []
+    for seq, raw in enumerate(frames):
+        captured.append((0, seq * 0.02, raw))
+        captured.append((1, seq * 0.02 + 0.001, raw))
+    parser = CaptureStreamParser()
+    packets = list(parser.feed(pcapng(['mirror0', None], captured))) + parser.close()
+    assert {p.sniffed_on for p in packets} == {'mirror0', 'interface 1'}
+
+    deduplicator = PacketDeduplicator(tap='capture.pcapng')
+    assert len(list(deduplicate_packets(packets, deduplicator))) == 20
+    summary = deduplicator.stats.summary()
+    assert summary['duplicate_rate'] == 0.5
+    assert [(tap['tap'], tap['packets'], tap['duplicates']) for tap in summary['taps']] == [
+        ('interface 1', 20, 20), ('mirror0', 20, 0)]
+
+def test_packets_without_an_interface_are_counted_under_the_file():
+    deduplicator = PacketDeduplicator(tap='one.pcap')
+    deduplicator.is_duplicate(packet(0.0, frame(1, build_rtp(1, 160, 0x1234))))
+    other = PacketDeduplicator(tap='two.pcap')
+    other.is_duplicate(packet(0.0, frame(1, build_rtp(1, 160, 0x1234))))
+    other.is_duplicate(packet(0.01, frame(1, build_rtp(1, 160, 0x1234))))
+
+    stats = DuplicateStats().merge(deduplicator.stats).merge(other.stats)
+    assert stats.taps == {'one.pcap': [1, 0], 'two.pcap': [2, 1]}
+    assert stats.summary()['taps'][0]['tap'] == 'two.pcap'
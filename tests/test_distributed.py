@@ -0,0 +1,121 @@
+import socket
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+import pytest
+from ml_models import distributed
+from ml_models.distributed import Coordinator, run_cluster, run_worker
+from utils.config import Config
+
+KEY = b'test-cluster-key'
+CAPTURE = dict(dialogs=2, duration=5.0, seed=8)
+
+
+@pytest.fixture
+def no_configured_key(monkeypatch):
+    monkeypatch.setattr(Config, 'CLUSTER_AUTHKEY', None)
+
+@pytest.fixture
+def coordinator(make_capture):
+    coordinator = Coordinator([make_capture(**CAPTURE)], 'train', ('127.0.0.1', 0), authkey=KEY,
+                              idle_timeout=10, handshake_timeout=0.5).start()
+    yield coordinator
+    coordinator.close()
+
+def start_worker(address, **options):
+    processed = []
+    thread = threading.Thread(target=lambda: processed.append(run_worker(address, connect_timeout=5, **options)),
+                              daemon=True)
+    thread.start()
+    return thread, processed
+
+
+def test_a_key_is_required_off_loopback(no_configured_key):
+    with pytest.raises(ValueError):
+        Coordinator([], 'score', ('0.0.0.0', 0)).start()
+    with pytest.raises(ValueError):
+        run_worker(('127.0.0.1', 1))
+
+def test_loopback_without_a_key_uses_a_random_one(no_configured_key, make_capture):
+    results = []
+    report = run_cluster([make_capture(**CAPTURE)], 'train', lambda path, result: results.append(result),
+                         address=('127.0.0.1', 0), local_workers=1, idle_timeout=10)
+    assert report['processed'] == 1
+    assert results[0]['calls'] > 0
+
+    first = Coordinator([], 'score', ('localhost', 0)).start()
+    second = Coordinator([], 'score', ('localhost', 0)).start()
+    try:
+        assert len(first.authkey) == 32 and first.authkey != second.authkey
+    finally:
+        first.close()
+        second.close()
+
+def test_a_wrong_key_is_rejected_before_anything_is_unpickled(coordinator):
+    with pytest.raises(AuthenticationError):
+        Client(coordinator.address, family='AF_INET', authkey=b'guessed')
+    assert coordinator.connected == 0 and not coordinator.workers
+
+def test_a_stalled_client_does_not_hold_up_workers(coordinator):
+    # Connects, then never answers the challenge
+    stalled = socket.create_connection(coordinator.address)
+    try:
+        time.sleep(0.1)
+        thread, processed = start_worker(coordinator.address, authkey=KEY)
+        (task, result), = coordinator.results()
+        thread.join(timeout=10)
+        assert processed == [1]
+        assert result['calls'] > 0
+
+        # The stalled client is dropped after the handshake timeout
+        stalled.settimeout(5)
+        while stalled.recv(4096):
+            pass
+    finally:
+        stalled.close()
+    assert len(coordinator.workers) == 1  # the stalled client never got to say hello
+
+def test_keys_are_taken_from_the_environment_setting(monkeypatch):
+    monkeypatch.setattr(Config, 'CLUSTER_AUTHKEY', 'from-environment')
+    assert distributed.cluster_authkey() == b'from-environment'
+    assert distributed.cluster_authkey('from-cli') == b'from-cli'
+    assert distributed.is_loopback('127.0.0.1') and distributed.is_loopback('localhost')
+    assert not distributed.is_loopback('0.0.0.0')
+
+def test_malformed_messages_are_treated_as_a_lost_worker(coordinator):
+    with Client(coordinator.address, family='AF_INET', authkey=KEY) as conn:
+        conn.send({'type': 'hello'})
+        with pytest.raises(EOFError):
+            conn.recv()
+    assert not coordinator.workers
+
+    with Client(coordinator.address, family='AF_INET', authkey=KEY) as conn:
+        conn.send({'type': 'hello', 'worker': 'broken'})
+        assert conn.recv()['type'] == 'task'
+        conn.send({'type': 'result', 'result': None})
+        with pytest.raises(EOFError):
+            conn.recv()
+    # The capture is queued again and processed by a working worker
+    thread, processed = start_worker(coordinator.address, authkey=KEY)
+    (task, result), = coordinator.results()
+    thread.join(timeout=10)
+    assert processed == [1] and result['calls'] > 0
+    assert coordinator.retries == 1 and task['attempts'] == 2
+    assert coordinator.workers['broken']['errors'] == 1
+
+def test_both_modes_share_the_call_features(make_capture, monkeypatch):
+    capture = make_capture(**CAPTURE)
+    scored = []
+
+    class Model:
+        def predict(self, features):
+            scored.append(features)
+            return [1] * len(features)
+
+    monkeypatch.setattr(distributed, '_load_model', lambda path: Model())
+    training = distributed.process_capture(capture, 'train')
+    scoring = distributed.process_capture(capture, 'score')
+    assert training['calls'] == scoring['calls'] > 0
+    assert (training['features'] == scored[0]).all()
+    assert training['start_times'].tolist() == [record['start_time'] for record in scoring['records']]
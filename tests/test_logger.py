@@ -0,0 +1,70 @@
+import json
+import logging
+import pytest
+from utils import logger as logger_module
+from utils.config import Config
+from utils.logger import RateLimitFilter, setup_logger, stop_logging
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(logger_module.time, 'monotonic', clock)
+    return clock
+
+def record(lineno=10, level=logging.INFO):
+    return logging.LogRecord('test', level, 'worker.py', lineno, 'packet %d', (lineno,), None)
+
+def passed(log_filter, records):
+    return [r for r in records if log_filter.filter(r)]
+
+
+def test_burst_then_rate_with_suppressed_count(clock):
+    log_filter = RateLimitFilter(rate=2, burst=5, sample_every=0)
+    assert len(passed(log_filter, [record() for _ in range(20)])) == 5
+
+    # Half a second refills one token; the record carries the 15 dropped ones
+    clock.now += 0.5
+    first, = passed(log_filter, [record() for _ in range(3)])
+    assert first.suppressed == 15
+    clock.now += 0.5
+    second, = passed(log_filter, [record()])
+    assert second.suppressed == 2
+
+def test_records_over_the_limit_are_sampled(clock):
+    log_filter = RateLimitFilter(rate=1, burst=2, sample_every=10)
+    kept = passed(log_filter, [record() for _ in range(42)])
+    # The burst, then every 10th of the 40 over the limit
+    assert len(kept) == 2 + 4
+    assert [getattr(r, 'suppressed', 0) for r in kept] == [0, 0, 9, 9, 9, 9]
+
+def test_call_sites_and_warnings_are_limited_separately(clock):
+    log_filter = RateLimitFilter(rate=1, burst=1, sample_every=0)
+    assert len(passed(log_filter, [record(10), record(10)])) == 1
+    assert len(passed(log_filter, [record(11)])) == 1
+    assert len(passed(log_filter, [record(10, logging.WARNING) for _ in range(5)])) == 5
+
+def test_rate_limited_json_lines_are_written_by_the_listener(tmp_path, clock):
+    log_file = tmp_path / 'logs' / 'app.log'
+    log = setup_logger('test_logger_json', str(log_file), json_format=True, console=False)
+    try:
+        for packet in range(300):
+            log.info("packet %d", packet, extra={'capture': 'one.pcap'})
+        log.warning("done")
+    finally:
+        stop_logging('test_logger_json')
+
+    entries = [json.loads(line) for line in log_file.read_text().splitlines()]
+    # The burst, one sampled record of the 100 over it, and the warning
+    assert len(entries) == Config.LOG_RATE_BURST + 1 + 1
+    assert entries[0]['message'] == 'packet 0' and entries[0]['capture'] == 'one.pcap'
+    assert entries[-2]['suppressed'] == Config.LOG_SAMPLE_EVERY - 1
+    assert entries[-1]['level'] == 'WARNING'
+    assert not log.handlers
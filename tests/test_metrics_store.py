@@ -0,0 +1,75 @@
+import shutil
+import pytest
+from utils.metrics_store import MetricsStore, ingest
+
+
+def call(call_id, start_time, mos, caller='10.0.0.1', callee='10.0.0.2', streams=()):
+    return {
+        'call_id': call_id, 'start_time': start_time, 'end_time': start_time + 60, 'duration': 60.0,
+        'caller': caller, 'callee': callee, 'packet_count': 3000, 'sip_count': 6, 'rtp_count': 2994,
+        'jitter': 1.5, 'packet_loss_rate': 0.01, 'round_trip_time': 80.0,
+        'remote_packet_loss_rate': 0.02, 'mos': mos, 'streams': list(streams)
+    }
+
+def count(store, table):
+    return store.connection.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+@pytest.fixture
+def store(tmp_path):
+    with MetricsStore(str(tmp_path / 'metrics.db'), batch_size=10) as store:
+        yield store
+
+
+def test_calls_are_filtered_and_aggregated(store):
+    stream = {'ssrc': 7, 'start_time': 0.0, 'end_time': 60.0, 'packet_count': 3000, 'jitter': 1.0}
+    store.record_capture('a' * 64, 'one.pcap', [
+        call('c1', 1000.0, 4.2, streams=[stream]),
+        call('c2', 2000.0, 3.1, callee='10.0.0.3'),
+        call('c3', 90000.0, 2.5, caller='10.0.0.3')
+    ])
+
+    assert [row['call_id'] for row in store.calls(mos_below=3.5, order_by='mos')] == ['c3', 'c2']
+    assert [row['call_id'] for row in store.calls(endpoint='10.0.0.3')] == ['c3', 'c2']
+    assert [row['call_id'] for row in store.calls(since=1500, until=3000)] == ['c2']
+    assert store.calls(call_id='c1', with_streams=True)[0]['streams'][0]['ssrc'] == 7
+
+    total, = store.summary()
+    assert total['calls'] == 3 and total['poor_calls'] == 2
+    assert total['mean_mos'] == pytest.approx((4.2 + 3.1 + 2.5) / 3)
+    by_day = store.summary(group_by='day')
+    assert [(row['group'], row['calls']) for row in by_day] == [('1970-01-01', 2), ('1970-01-02', 1)]
+    with pytest.raises(ValueError):
+        store.summary(group_by='codec')
+
+def test_recording_a_capture_again_replaces_its_calls(store):
+    store.record_capture('a' * 64, 'one.pcap', [call('c1', 1000.0, 4.0), call('c2', 1000.0, 4.0)])
+    store.record_capture('a' * 64, 'one.pcap', [call('c1', 1000.0, 3.0)])
+    assert count(store, 'captures') == 1
+    assert [row['mos'] for row in store.calls()] == [3.0]
+
+def test_buffered_captures_are_written_with_their_calls(store):
+    store.record_capture('a' * 64, 'one.pcap', [call(f'c{i}', i, 4.0) for i in range(4)], flush=False)
+    assert store.has_capture('a' * 64)
+    assert count(store, 'captures') == 0 and count(store, 'calls') == 0
+
+    # Reaching batch_size writes every buffered capture
+    store.record_capture('b' * 64, 'two.pcap', [call(f'd{i}', i, 4.0) for i in range(6)], flush=False)
+    assert count(store, 'captures') == 2 and count(store, 'calls') == 10
+
+def test_capture_row_is_not_written_without_its_calls(store):
+    with pytest.raises(Exception):
+        store.record_capture('a' * 64, 'bad.pcap', [call('c1', 1000.0, 4.0), call('c2', 1000.0, object())])
+    assert count(store, 'captures') == 0 and count(store, 'calls') == 0
+
+def test_ingest_skips_known_captures_before_analyzing(store, make_capture, tmp_path):
+    directory = tmp_path / 'captures'
+    directory.mkdir()
+    capture = make_capture(dialogs=2, duration=5.0, seed=4)
+    shutil.copy(capture, directory / 'first.pcap')
+    shutil.copy(capture, directory / 'copy.pcap')
+
+    recorded = ingest(store, str(directory), workers=1)
+    assert recorded > 0
+    assert count(store, 'captures') == 1 and count(store, 'calls') == recorded
+    assert ingest(store, str(directory), workers=1) == 0
+    assert count(store, 'calls') == recorded
@@ -0,0 +1,102 @@
+import csv
+import json
+import os
+import numpy as np
+import pytest
+from ml_models import model_selection
+from ml_models.model import VoIPQualityModel
+from ml_models.model_selection import cv_candidates, load_features, make_search, promote, run_search
+from ml_models.training_data import TrainingSetBuilder
+
+GRID = {'n_estimators': [5, 20], 'max_depth': [1, None]}
+
+
+@pytest.fixture(scope='module')
+def training_dir(tmp_path_factory):
+    """A cached training set whose label depends on the first two features."""
+    directory = str(tmp_path_factory.mktemp('training'))
+    rng = np.random.default_rng(5)
+    X = rng.normal(size=(600, 6))
+    y = ((X[:, 0] > 0) & (X[:, 1] > -0.5)).astype(int)
+    builder = TrainingSetBuilder(directory, samples_per_class=1000, seed=5)
+    builder.add(X, y, rng.permutation(600).astype(float))
+    builder.split(test_fraction=0.2)
+    return directory
+
+@pytest.fixture(scope='module')
+def leaderboard_dir(training_dir, tmp_path_factory):
+    output_dir = str(tmp_path_factory.mktemp('model_selection'))
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(model_selection, 'PARAM_GRID', GRID)
+        run_search('grid', 'time', folds=3, jobs=1, top=3, output_dir=output_dir, training_dir=training_dir, seed=1)
+    return output_dir
+
+def leaderboard(output_dir):
+    with open(os.path.join(output_dir, 'leaderboard.json')) as f:
+        return json.load(f)
+
+
+def test_training_rows_are_loaded_in_time_order(training_dir):
+    X_train, X_test, y_train, y_test = load_features(training_dir)
+    t_train = np.load(os.path.join(training_dir, 't_train.npy'))
+    assert len(X_train) == len(y_train) == len(t_train) == 480
+    assert len(X_test) == len(y_test) == 120
+    saved = np.load(os.path.join(training_dir, 'X_train.npy'))
+    assert np.array_equal(X_train, saved[np.argsort(t_train, kind='stable')])
+
+@pytest.mark.parametrize('search', ['grid', 'random', 'halving'])
+def test_candidates_are_ranked_by_cv_accuracy(training_dir, search):
+    X_train, _, y_train, _ = load_features(training_dir)
+    search_cv = make_search(search, folds=3, jobs=1, n_iter=3, seed=1, param_grid=GRID)
+    search_cv.fit(X_train, y_train)
+    candidates = cv_candidates(search_cv)
+
+    scores = [c['cv_accuracy'] for c in candidates]
+    assert scores == sorted(scores, reverse=True)
+    # Successive halving lists every candidate once, with its last round
+    params = [json.dumps(c['params'], sort_keys=True) for c in candidates]
+    assert len(params) == len(set(params)) == (3 if search == 'random' else 4)
+    if search == 'halving':
+        assert candidates[0]['cv_samples'] == max(c['cv_samples'] for c in candidates)
+
+def test_search_writes_the_leaderboard(leaderboard_dir):
+    saved = leaderboard(leaderboard_dir)
+    rows = saved['leaderboard']
+    assert saved['settings'] == {'search': 'grid', 'cv': 'time', 'folds': 3, 'seed': 1}
+    assert [row['rank'] for row in rows] == [1, 2, 3]
+    assert rows[0]['cv_accuracy'] >= rows[-1]['cv_accuracy']
+    for row in rows:
+        assert os.path.getsize(os.path.join(leaderboard_dir, row['model_file'])) == row['model_bytes']
+        assert 0 <= row['test_accuracy'] <= 1 and row['predict_latency_ms'] > 0
+    with open(os.path.join(leaderboard_dir, 'leaderboard.csv')) as f:
+        table = list(csv.DictReader(f))
+    assert [json.loads(row['params']) for row in table] == [row['params'] for row in rows]
+
+def test_promotion_replaces_the_model(leaderboard_dir, tmp_path):
+    model_path = tmp_path / 'models' / 'voip_quality_model.pkl'
+    row = promote(2, leaderboard_dir, str(model_path))
+    assert row['rank'] == 2
+    model = VoIPQualityModel()
+    model.load_model(str(model_path))
+    assert model.model.get_params()['n_estimators'] == row['params']['n_estimators']
+
+    promote(1, leaderboard_dir, str(model_path))
+    with open(os.path.join(leaderboard_dir, 'candidate_1.pkl'), 'rb') as f:
+        assert model_path.read_bytes() == f.read()
+    assert os.listdir(model_path.parent) == ['voip_quality_model.pkl']
+
+def test_failed_promotion_keeps_the_current_model(leaderboard_dir, tmp_path):
+    model_path = tmp_path / 'voip_quality_model.pkl'
+    model_path.write_bytes(b'current model')
+    with pytest.raises(ValueError):
+        promote(9, leaderboard_dir, str(model_path))
+
+    missing = tmp_path / 'empty'
+    missing.mkdir()
+    board = leaderboard(leaderboard_dir)
+    board['leaderboard'][0]['model_file'] = 'gone.pkl'
+    (missing / 'leaderboard.json').write_text(json.dumps(board))
+    with pytest.raises(FileNotFoundError):
+        promote(1, str(missing), str(model_path))
+    assert model_path.read_bytes() == b'current model'
+    assert sorted(os.listdir(tmp_path)) == ['empty', 'voip_quality_model.pkl']
@@ -0,0 +1,84 @@
+import os
+import pytest
+from data_processing.dedup import PacketDeduplicator, deduplicate_packets
+from data_processing.pcap_processor import filter_voip_packets
+from data_processing.pcap_stream import iter_capture_packets
+from main import process_voip_call
+from ml_models.advanced_metrics import AdvancedVoIPMetrics
+from ml_models.parallel_analysis import analyze_capture_parallel, call_records, call_states
+from ml_models.traffic_analyzer import VoIPTrafficAnalyzer
+from ml_models.train import process_voip_calls
+
+CAPTURE = dict(dialogs=4, duration=15.0, loss=0.01, jitter=0.003, ssrc_changes=1, seed=11)
+# Media only recognized through SDP, and tap copies on both sides of chunk edges
+TAPPED = dict(CAPTURE, port_offset=30000, duplicates=0.2)
+
+
+@pytest.fixture(scope='module', params=[CAPTURE, TAPPED], ids=['plain', 'tapped'])
+def single_pass(make_capture, request):
+    """Reports of the single-pass pipeline of main.analyze_capture."""
+    path = make_capture(**request.param)
+    quality_metrics = AdvancedVoIPMetrics()
+    traffic_analyzer = VoIPTrafficAnalyzer()
+    deduplicator = PacketDeduplicator(tap=os.path.basename(path))
+    voip_packets = filter_voip_packets(deduplicate_packets(iter_capture_packets(path), deduplicator))
+    call_data = process_voip_call(voip_packets)
+    flow_metrics = quality_metrics.analyze_call_flow(voip_packets)
+    patterns = traffic_analyzer.extract_traffic_patterns(voip_packets)
+    return {
+        'path': path,
+        'call_data': call_data,
+        'qos_report': quality_metrics.generate_qos_report(call_data, flow_metrics),
+        'traffic_behavior': traffic_analyzer.analyze_traffic_behavior(patterns),
+        'calls': process_voip_calls(voip_packets),
+        'records': call_records(call_states(voip_packets)),
+        'duplicates': deduplicator.stats.summary()
+    }
+
+
+@pytest.mark.parametrize('options', [dict(workers=2), dict(workers=3, chunk_seconds=2.5)])
+def test_parallel_analysis_matches_single_pass(single_pass, options):
+    state = analyze_capture_parallel(single_pass['path'], **options)
+    quality_metrics = AdvancedVoIPMetrics()
+    traffic_analyzer = VoIPTrafficAnalyzer()
+
+    assert state.duplicates.summary() == single_pass['duplicates']
+    call_data = state.call_data()
+    assert call_data == pytest.approx(single_pass['call_data'])
+
+    qos_report = quality_metrics.generate_qos_report(call_data, state.flow_metrics())
+    expected = single_pass['qos_report']
+    assert qos_report['packet_stats'] == expected['packet_stats']
+    assert qos_report['quality_metrics'] == pytest.approx(expected['quality_metrics'])
+    assert sorted(qos_report['anomalies']) == sorted(expected['anomalies'])
+
+    behavior = traffic_analyzer.analyze_traffic_behavior(state.traffic_patterns())
+    expected = single_pass['traffic_behavior']
+    assert behavior['protocol_distribution'] == expected['protocol_distribution']
+    assert behavior['burst_statistics'] == pytest.approx(expected['burst_statistics'])
+    for key in ('size_distribution', 'timing_analysis'):
+        for name, value in behavior[key].items():
+            assert value == pytest.approx(expected[key][name], rel=1e-6, abs=1e-9)
+
+    calls = sorted(state.dialogs.completed_calls(), key=lambda call: call['start_time'])
+    expected_calls = sorted(single_pass['calls'], key=lambda call: call['start_time'])
+    assert calls
+    assert calls == [pytest.approx(call) for call in expected_calls]
+
+def by_call(records):
+    records = [dict(record, streams=sorted(record['streams'], key=lambda stream: stream['ssrc']))
+               for record in records]
+    return sorted(records, key=lambda record: record['call_id'])
+
+@pytest.mark.parametrize('options', [dict(workers=3), dict(workers=2, chunk_seconds=1.5)])
+def test_per_call_records_match_single_pass(single_pass, options):
+    state = analyze_capture_parallel(single_pass['path'], **options)
+    records = by_call(call_records(state.calls))
+    expected = by_call(single_pass['records'])
+
+    assert [record['call_id'] for record in records] == [record['call_id'] for record in expected]
+    for record, expected_record in zip(records, expected):
+        assert len(record['streams']) == len(expected_record['streams'])
+        for stream, expected_stream in zip(record['streams'], expected_record['streams']):
+            assert stream == pytest.approx(expected_stream)
+        assert dict(record, streams=None) == pytest.approx(dict(expected_record, streams=None))
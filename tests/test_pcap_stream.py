@@ -0,0 +1,84 @@
+import gzip
+import lzma
+import struct
+import pytest
+from data_processing import pcap_stream
+from data_processing.pcap_stream import CaptureStreamParser, iter_capture_packets
+
+zstandard = pytest.importorskip('zstandard')
+
+COMPRESSORS = {
+    'gzip': gzip.compress,
+    'xz': lzma.compress,
+    'zstd': lambda data: zstandard.ZstdCompressor().compress(data)
+}
+
+
+@pytest.fixture(scope='module')
+def capture_bytes(make_capture):
+    with open(make_capture(dialogs=1, duration=2.0, seed=3), 'rb') as f:
+        return f.read()
+
+def parse(data, block_size):
+    parser = CaptureStreamParser()
+    packets = []
+    for start in range(0, len(data), block_size):
+        packets.extend(parser.feed(data[start:start + block_size]))
+    packets.extend(parser.close())
+    return packets
+
+def signature(packets):
+    return [(float(packet.time), bytes(packet)) for packet in packets]
+
+@pytest.mark.parametrize('compression', sorted(COMPRESSORS))
+def test_concatenated_streams_are_all_read(capture_bytes, compression):
+    compress = COMPRESSORS[compression]
+    split = len(capture_bytes) // 3
+    # xz allows null stream padding between streams
+    padding = b'\0' * 8 if compression == 'xz' else b''
+    data = compress(capture_bytes[:split]) + padding + compress(capture_bytes[split:])
+
+    expected = signature(parse(capture_bytes, 1 << 20))
+    assert expected
+    assert signature(parse(data, 1000)) == expected
+
+@pytest.mark.parametrize('compression', sorted(COMPRESSORS))
+def test_decompressed_output_is_bounded(monkeypatch, compression):
+    monkeypatch.setattr(pcap_stream, 'DECOMPRESS_OUTPUT', 4096)
+    data = COMPRESSORS[compression](b'\0' * 10 ** 6)
+    decompressor = pcap_stream._make_decompressor(data)
+
+    outputs = [len(output) for output in decompressor.decompress(data)]
+    assert sum(outputs) == 10 ** 6
+    assert max(outputs) <= 4096
+
+def test_empty_timestamp_options_keep_the_defaults(capture_bytes):
+    # The first record of the classic pcap capture, as one Enhanced Packet block
+    sec, usec, caplen, wirelen = struct.unpack_from('<IIII', capture_bytes, 24)
+    frame = capture_bytes[40:40 + caplen]
+    ticks = sec * 10 ** 6 + usec
+
+    def block(block_type, body):
+        body += bytes(-len(body) % 4)
+        return struct.pack('<II', block_type, len(body) + 12) + body + struct.pack('<I', len(body) + 12)
+
+    empty_options = struct.pack('<HHHH', 9, 0, 14, 0)  # if_tsresol and if_tsoffset without a value
+    data = (block(0x0A0D0D0A, struct.pack('<IHHq', 0x1A2B3C4D, 1, 0, -1))
+            + block(0x00000001, struct.pack('<HHI', 1, 0, 65535) + empty_options)
+            + block(0x00000006, struct.pack('<IIIII', 0, ticks >> 32, ticks & 0xFFFFFFFF, caplen, wirelen) + frame))
+    packet, = parse(data, 1000)
+    assert signature([packet]) == signature(parse(capture_bytes, 1 << 20))[:1]
+
+def test_short_first_reads_are_buffered(capture_bytes, tmp_path):
+    path = tmp_path / 'capture.pcap.gz'
+    path.write_bytes(gzip.compress(capture_bytes))
+
+    expected = signature(iter_capture_packets(str(path)))
+    assert signature(parse(path.read_bytes(), 3)) == expected
+    assert signature(parse(capture_bytes, 1)) == expected
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError):
+        parse(b'not a capture', 5)
+    with pytest.raises(ValueError):
+        parse(b'\x01\x02', 5)
@@ -0,0 +1,25 @@
+import hashlib
+import os
+from data_processing.pcap_stream import iter_capture_packets
+from utils.result_cache import AnalysisCache, file_digest
+
+
+def test_capture_is_hashed_while_it_is_read(make_capture):
+    path = make_capture(dialogs=1, duration=2.0, seed=3)
+    digest = hashlib.sha256()
+    packets = list(iter_capture_packets(path, block_size=4096, digest=digest))
+    assert packets
+    assert digest.hexdigest() == file_digest(path)
+
+def test_digest_is_remembered_until_the_file_changes(tmp_path):
+    cache = AnalysisCache(cache_dir=str(tmp_path / 'cache'))
+    path = tmp_path / 'capture.pcap'
+    path.write_bytes(b'first')
+    assert cache.known_digest(str(path)) is None
+
+    cache.remember_digest(str(path), file_digest(str(path)))
+    assert cache.known_digest(str(path)) == file_digest(str(path))
+
+    path.write_bytes(b'second capture')
+    os.utime(path, ns=(0, 0))
+    assert cache.known_digest(str(path)) is None
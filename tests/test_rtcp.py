@@ -0,0 +1,61 @@
+import struct
+import pytest
+from benchmarks.synthetic_capture import build_rtcp_sr
+from data_processing.rtcp import RTCP_SR, RtcpStats, is_rtcp_payload, ntp_middle32, parse_rtcp
+from ml_models.advanced_metrics import AdvancedVoIPMetrics
+from ml_models.parallel_analysis import ChunkState
+
+WITH_RTCP = dict(dialogs=2, duration=20.0, loss=0.02, jitter=0.002, rtcp_interval=2.0, rtt=0.08, seed=9)
+
+
+def test_sender_report_blocks_are_parsed():
+    payload = build_rtcp_sr(0x1234, 1700000000.5, 4000, 50, 8000,
+                            report=(0x5678, 64, -3, 70000, 160, 0xAABBCCDD, 0x10000))
+    assert is_rtcp_payload(payload)
+    sr, = parse_rtcp(payload)  # the SDES is skipped
+    assert sr['type'] == RTCP_SR and sr['ssrc'] == 0x1234
+    assert sr['ntp'] == ntp_middle32(1700000000.5)
+    assert (sr['packet_count'], sr['octet_count']) == (50, 8000)
+    block, = sr['blocks']
+    assert block['ssrc'] == 0x5678
+    assert block['fraction_lost'] == 0.25
+    assert block['cumulative_lost'] == -3
+    assert (block['lsr'], block['dlsr']) == (0xAABBCCDD, 0x10000)
+
+def test_rtp_is_not_taken_for_rtcp():
+    rtp = struct.pack('!BBHII', 0x80, 0, 1, 160, 0x1234) + bytes(160)
+    assert not is_rtcp_payload(rtp)
+    # Lengths must add up to the payload
+    assert not is_rtcp_payload(build_rtcp_sr(1, 0.0, 0, 0, 0)[:-4])
+
+def test_round_trip_time_from_lsr_and_dlsr(voip_packets):
+    packets = voip_packets(**WITH_RTCP)
+    assert any(protocol == 'RTCP' for protocol, _ in packets)
+    summary = AdvancedVoIPMetrics().analyze_call_flow(packets)['rtcp'].summary()
+
+    assert summary['rtt_samples'] > 0
+    assert summary['round_trip_time'] == pytest.approx(WITH_RTCP['rtt'] * 1000, abs=1)
+    assert summary['remote_packet_loss_rate'] == pytest.approx(WITH_RTCP['loss'], abs=1 / 256)
+    assert summary['remote_jitter'] == pytest.approx(WITH_RTCP['jitter'] * 1000, abs=0.2)
+
+def test_round_trip_time_is_paired_across_chunks(voip_packets):
+    quality_metrics = AdvancedVoIPMetrics()
+    packets = voip_packets(**WITH_RTCP)
+    single = quality_metrics.analyze_call_flow(packets)['rtcp'].summary()
+
+    # Every split leaves some reports in a different chunk than their SR
+    merged = None
+    for start in range(0, len(packets), 997):
+        state = ChunkState.from_packets(packets[start:start + 997], quality_metrics, per_call=False)
+        merged = state if merged is None else merged.merge(state, quality_metrics)
+    summary = merged.rtcp.summary()
+    assert not merged.rtcp.pending
+    assert summary['rtt_samples'] == single['rtt_samples']
+    assert summary['round_trip_time'] == pytest.approx(single['round_trip_time'])
+
+def test_unmatched_reports_fall_back_to_the_capture_clock():
+    stats = RtcpStats()
+    lsr = ntp_middle32(1000.0)
+    stats.add(1000.25, build_rtcp_sr(1, 1000.25, 0, 0, 0, report=(2, 0, 0, 0, 0, lsr, int(0.05 * 65536))))
+    assert stats.pending
+    assert stats.summary()['round_trip_time'] == pytest.approx(200, abs=0.1)
@@ -0,0 +1,73 @@
+from scapy.layers.l2 import Ether
+from benchmarks.synthetic_capture import build_rtp, build_sdp, build_sip, build_udp_frame
+from data_processing.pcap_processor import VoIPPacketClassifier
+from data_processing.sdp import MediaFlowTable, parse_sdp
+
+
+def invite(call_id, ip, port, session_id=1, method='INVITE'):
+    return build_sip(f'{method} sip:bob@example.com SIP/2.0', call_id, f'1 {method}', call_id,
+                     'sip:alice@example.com', 'sip:bob@example.com', ip, build_sdp(session_id, ip, port))
+
+def request(method, call_id, ip):
+    return build_sip(f'{method} sip:bob@example.com SIP/2.0', call_id, f'2 {method}', call_id,
+                     'sip:alice@example.com', 'sip:bob@example.com', ip)
+
+def frame(time, src, dst, sport, dport, payload):
+    packet = Ether(build_udp_frame(src, dst, sport, dport, payload))
+    packet.time = time
+    return packet
+
+
+def test_sdp_attributes_are_parsed():
+    session = parse_sdp('v=0\r\no=- 7 2 IN IP4 10.0.0.1\r\nc=IN IP4 10.0.0.1\r\n'
+                        'm=audio 4000 RTP/AVP 8 96\r\na=rtpmap:96 opus/48000/2\r\n'
+                        'a=rtcp:4100\r\nm=video 0 RTP/AVP 97\r\n')
+    audio, video = session['media']
+    assert session['origin'] == '- 7 IN IP4 10.0.0.1'  # without the version
+    assert (audio['connection'], audio['port'], audio['rtcp_port']) == ('10.0.0.1', 4000, 4100)
+    assert audio['codecs'] == {8: ('PCMA', 8000), 96: ('opus', 48000)}
+    assert video['port'] == 0
+
+def test_endpoints_are_learned_and_moved_by_reinvite():
+    table = MediaFlowTable()
+    assert table.learn(invite('call-1', '10.0.0.1', 4000), time=0.0) == 2
+    assert table.lookup('10.0.0.9', 9999, '10.0.0.1', 4000)['protocol'] == 'RTP'
+    assert table.lookup('10.0.0.1', 4001, '10.0.0.9', 9999)['protocol'] == 'RTCP'
+    assert table.lookup('10.0.0.1', 4000, '10.0.0.9', 9999)['codec'] == 'PCMU'
+
+    # A re-offer from the same originator replaces that side's endpoints
+    table.learn(invite('call-1', '10.0.0.1', 6000, session_id=1), time=5.0)
+    assert table.lookup('10.0.0.9', 9999, '10.0.0.1', 4000) is None
+    assert table.lookup('10.0.0.9', 9999, '10.0.0.1', 6000)['call_id'] == 'call-1'
+    assert len(table) == 2
+
+def test_bye_forgets_the_dialog():
+    table = MediaFlowTable()
+    table.learn(invite('call-1', '10.0.0.1', 4000), time=0.0)
+    table.learn(invite('call-2', '10.0.0.2', 4000, session_id=2), time=0.0)
+    table.learn(request('BYE', 'call-1', '10.0.0.1'), time=10.0)
+    assert table.lookup('10.0.0.9', 9999, '10.0.0.1', 4000) is None
+    assert table.lookup('10.0.0.9', 9999, '10.0.0.2', 4000)['call_id'] == 'call-2'
+
+def test_idle_dialogs_expire_after_the_ttl():
+    table = MediaFlowTable(ttl=100)
+    table.learn(invite('idle', '10.0.0.1', 4000), time=0.0)
+    table.learn(invite('busy', '10.0.0.2', 4000, session_id=2), time=0.0)
+    # SIP of a dialog without SDP still keeps it alive
+    table.learn(request('INFO', 'busy', '10.0.0.2'), time=90.0)
+    table.learn(invite('late', '10.0.0.3', 4000, session_id=3), time=150.0)
+    assert table.lookup('10.0.0.9', 9999, '10.0.0.1', 4000) is None
+    assert table.lookup('10.0.0.9', 9999, '10.0.0.2', 4000)['call_id'] == 'busy'
+    assert table.lookup('10.0.0.9', 9999, '10.0.0.3', 4000)['call_id'] == 'late'
+
+def test_negotiated_media_is_classified_on_any_port():
+    # Port 3001 is outside the RTP heuristic (even ports in Config.RTP_PORT_RANGE)
+    rtp = frame(1.0, '10.0.0.9', '10.0.0.1', 7777, 3001, build_rtp(1, 160, 0x1234))
+    assert VoIPPacketClassifier().classify(rtp) is None
+
+    classifier = VoIPPacketClassifier()
+    assert classifier.classify(frame(0.0, '10.0.0.1', '10.0.0.9', 5060, 5060,
+                                     invite('call-1', '10.0.0.1', 3001))) == 'SIP'
+    assert classifier.classify(rtp) == 'RTP'
+    classifier.classify(frame(2.0, '10.0.0.1', '10.0.0.9', 5060, 5060, request('BYE', 'call-1', '10.0.0.1')))
+    assert classifier.classify(rtp) is None
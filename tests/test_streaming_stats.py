@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from ml_models.streaming_stats import QuantileSketch, StreamSummary
+
+ACCURACY = 0.01
+
+
+@pytest.fixture
+def values():
+    rng = np.random.default_rng(5)
+    return np.concatenate([rng.lognormal(0, 2, 20000), -rng.exponential(3, 2000), np.zeros(100)])
+
+
+def test_quantiles_are_within_the_relative_error_bound(values):
+    sketch = QuantileSketch(ACCURACY)
+    sketch.update_batch(values)
+    ranked = np.sort(values)
+    for q in (0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99):
+        # The sketch is exact up to the relative accuracy at every rank
+        exact = ranked[int(q * (len(ranked) - 1))]
+        assert sketch.quantile(q) == pytest.approx(exact, rel=ACCURACY, abs=1e-12)
+    assert sketch.quantile(0) == values.min()
+    assert sketch.quantile(1) == values.max()
+
+def test_merged_sketches_equal_a_single_sketch(values):
+    single = QuantileSketch(ACCURACY)
+    single.update_batch(values)
+    merged = QuantileSketch(ACCURACY)
+    for part in np.array_split(values, 7):
+        sketch = QuantileSketch(ACCURACY)
+        sketch.update_batch(part)
+        merged.merge(sketch)
+    one_by_one = QuantileSketch(ACCURACY)
+    for value in values[:500]:
+        one_by_one.update(value)
+    batch = QuantileSketch(ACCURACY)
+    batch.update_batch(values[:500])
+
+    for q in (0.05, 0.5, 0.95):
+        assert merged.quantile(q) == single.quantile(q)
+        assert one_by_one.quantile(q) == batch.quantile(q)
+    assert merged.count == single.count == len(values)
+
+def test_memory_is_bounded_by_max_bins():
+    sketch = QuantileSketch(ACCURACY, max_bins=64)
+    sketch.update_batch(np.logspace(-9, 9, 10000))
+    assert len(sketch._positive) <= 64
+    # Collapsing only folds the smallest values
+    assert sketch.quantile(0.99) == pytest.approx(np.quantile(np.logspace(-9, 9, 10000), 0.99), rel=ACCURACY)
+
+def test_sketches_with_different_accuracy_do_not_merge():
+    with pytest.raises(ValueError):
+        QuantileSketch(0.01).merge(QuantileSketch(0.02))
+
+def test_stream_summary_matches_numpy(values):
+    summary = StreamSummary.from_values(values[:1000], ACCURACY)
+    summary.merge(StreamSummary.from_values(values[1000:], ACCURACY))
+    assert summary.count == len(values)
+    assert summary.mean == pytest.approx(np.mean(values))
+    assert summary.std == pytest.approx(np.std(values))
+    assert summary.percentile(50) == pytest.approx(np.percentile(values, 50), rel=ACCURACY)
+    assert StreamSummary().percentile(50) is None
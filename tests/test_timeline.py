@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+from ml_models.advanced_metrics import AdvancedVoIPMetrics
+from ml_models.timeline import Timeline, TimelineBuilder, build_timeline, lttb
+from ml_models.traffic_analyzer import VoIPTrafficAnalyzer
+
+CAPTURE = dict(dialogs=2, duration=30.0, loss=0.02, jitter=0.003, seed=21)
+
+
+def test_lttb_keeps_the_ends_and_the_peaks():
+    x = np.arange(10000, dtype=float)
+    y = np.sin(x / 500)
+    y[4321] = 25.0
+    selected, groups = lttb(x, y, 100)
+
+    assert len(selected) == len(groups) == 100
+    assert selected[0] == 0 and selected[-1] == len(x) - 1
+    assert 4321 in selected
+    assert np.all(np.diff(selected) > 0)
+    # Every selected point lies in the group it represents
+    assert np.all(groups <= selected) and np.all(selected[:-1] < groups[1:])
+    assert lttb(x[:50], y[:50], 100)[0].tolist() == list(range(50))
+
+def test_queries_are_downsampled_with_the_envelope_kept():
+    times = np.arange(0, 7200, 0.02)
+    values = np.full(len(times), 100.0)
+    values[123456] = 900.0
+    timeline = Timeline(times[0], times[-1])
+    timeline.add_series('packet_size', times, values)
+
+    overview = timeline.query('packet_size', points=200)
+    assert len(overview['t']) <= 200
+    assert overview['resolution'] > 1
+    assert max(overview['max']) == 900.0
+    assert sum(overview['count']) == len(times)
+
+    # Zooming in uses the per-second buckets
+    zoom = timeline.query('packet_size', start=2460, end=2480, points=200)
+    assert zoom['resolution'] == 1
+    assert zoom['t'][0] == 2460 and zoom['t'][-1] == 2480
+    assert max(zoom['max']) == 900.0
+    with pytest.raises(KeyError):
+        timeline.query('mos')
+
+def test_chunked_builders_merge_into_the_single_pass_timeline():
+    rng = np.random.default_rng(3)
+    times = np.cumsum(rng.exponential(0.01, 20000)) + 1000.3
+    sizes = rng.integers(60, 1500, len(times))
+
+    whole = TimelineBuilder()
+    whole.add_packets(times, sizes)
+    merged = TimelineBuilder(consolidate_every=2)
+    for part in np.array_split(np.arange(len(times)), 9):
+        builder = TimelineBuilder()
+        builder.add_packets(times[part], sizes[part])
+        merged.merge(builder)
+
+    expected, actual = whole.build(), merged.build()
+    assert actual.describe() == expected.describe()
+    for name in ('packet_rate', 'packet_size', 'inter_arrival'):
+        assert actual.query(name) == pytest.approx(expected.query(name))
+
+def test_sketch_only_patterns_give_the_same_timeline(voip_packets):
+    packets = voip_packets(**CAPTURE)
+    analyzer = VoIPTrafficAnalyzer()
+    flow_metrics = AdvancedVoIPMetrics().analyze_call_flow(packets)
+    listed = build_timeline(analyzer.extract_traffic_patterns(packets), flow_metrics)
+    sketched = build_timeline(analyzer.extract_traffic_patterns(packets, sketch_only=True), flow_metrics)
+
+    assert sketched.describe() == listed.describe()
+    for name in ('packet_rate', 'packet_size', 'inter_arrival', 'packet_loss'):
+        expected = listed.query(name, points=10 ** 6)
+        actual = sketched.query(name, points=10 ** 6)
+        assert actual['t'] == expected['t'] and actual['count'] == expected['count']
+        assert actual['mean'] == pytest.approx(expected['mean'])
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+from ml_models.traffic_analyzer import TrafficSummary, VoIPTrafficAnalyzer, packet_arrays
+
+CAPTURE = dict(dialogs=3, duration=10.0, loss=0.01, jitter=0.004, seed=21)
+
+
+def split_summary(packets, bounds, sample_size=None):
+    summary = TrafficSummary(sample_size=sample_size)
+    for start, end in zip(bounds, bounds[1:]):
+        summary.update_batch(*packet_arrays(packets[start:end]))
+    return summary
+
+
+def test_sketch_only_patterns_give_the_same_behavior(voip_packets):
+    analyzer = VoIPTrafficAnalyzer()
+    packets = voip_packets(**CAPTURE)
+    full = analyzer.extract_traffic_patterns(packets)
+    sketch = analyzer.extract_traffic_patterns(packets, sketch_only=True)
+
+    assert 'packet_sizes' not in sketch and 'burst_patterns' not in sketch
+    assert sketch['packet_count'] == full['packet_count'] == len(packets)
+    behavior = analyzer.analyze_traffic_behavior(full)
+    sketch_behavior = analyzer.analyze_traffic_behavior(sketch)
+    assert sketch_behavior['protocol_distribution'] == behavior['protocol_distribution']
+    assert sketch_behavior['burst_statistics'] == pytest.approx(behavior['burst_statistics'])
+    assert sketch_behavior['size_distribution'] == behavior['size_distribution']
+
+def test_batch_extraction_matches_per_packet_bursts(voip_packets):
+    analyzer = VoIPTrafficAnalyzer()
+    packets = voip_packets(**CAPTURE)
+    patterns = analyzer.extract_traffic_patterns(packets)
+
+    # Per-packet reference of the burst rule: runs at most BURST_THRESHOLD
+    # apart, never opened by the first packet
+    bursts, current = [], []
+    for previous, (time, size) in zip(patterns['time_series'], list(zip(patterns['time_series'],
+                                                                         patterns['packet_sizes']))[1:]):
+        if time - previous <= analyzer.BURST_THRESHOLD:
+            current.append((time, size))
+        else:
+            if len(current) > analyzer.MIN_BURST_SIZE:
+                bursts.append(current)
+            current = [(time, size)]
+    if len(current) > analyzer.MIN_BURST_SIZE:
+        bursts.append(current)
+    assert patterns['burst_patterns'] == bursts
+    assert patterns['inter_arrival_times'] == pytest.approx(np.diff(patterns['time_series']))
+
+@pytest.mark.parametrize('bounds', [[0, 1, 2, 3], [0, 7, 500, 501, 3000], [0, 1234]])
+def test_summaries_merge_across_any_split(voip_packets, bounds):
+    packets = voip_packets(**CAPTURE)
+    bounds = bounds + [len(packets)]
+    whole = TrafficSummary(sample_size=300).update_batch(*packet_arrays(packets)).patterns()
+    merged = split_summary(packets, bounds, sample_size=300).patterns()
+
+    assert merged['protocol_counts'] == whole['protocol_counts']
+    assert merged['protocol_transitions'] == whole['protocol_transitions']
+    assert merged['burst_statistics'] == pytest.approx(whole['burst_statistics'])
+    assert merged['inter_arrival_summary'].count == len(packets) - 1
+    assert merged['inter_arrival_summary'].mean == pytest.approx(whole['inter_arrival_summary'].mean)
+    # Sampling priorities depend on the packet, not on the split
+    assert len(merged['packet_sample']['time']) == 300
+    for field in ('time', 'size', 'protocol'):
+        assert np.array_equal(merged['packet_sample'][field], whole['packet_sample'][field])
+    assert np.isnan(merged['packet_sample']['inter_arrival']).sum() <= 1
+
+def test_anomalies_are_detected_on_the_sample(voip_packets):
+    analyzer = VoIPTrafficAnalyzer()
+    packets = voip_packets(**CAPTURE)
+    patterns = TrafficSummary(sample_size=1000).update_batch(*packet_arrays(packets)).patterns()
+    anomalies = analyzer.detect_anomalies(patterns)
+    assert 0 < len(anomalies) <= 1000
+    assert {anomaly['protocol'] for anomaly in anomalies} <= {'SIP', 'RTP', 'RTCP'}
+    assert all(anomaly['inter_arrival'] is not None for anomaly in anomalies)
+
+def test_anomaly_report_keeps_the_most_anomalous(voip_packets):
+    analyzer = VoIPTrafficAnalyzer()
+    patterns = analyzer.extract_traffic_patterns(voip_packets(**CAPTURE))
+    anomalies = analyzer.detect_anomalies(patterns, limit=10 ** 9)
+    capped = analyzer.detect_anomalies(patterns, limit=25)
+
+    assert len(anomalies) > 25 and len(capped) == 25
+    assert [a['timestamp'] for a in capped] == sorted(a['timestamp'] for a in capped)
+    assert all(anomaly in anomalies for anomaly in capped)
@@ -0,0 +1,82 @@
+import shutil
+import numpy as np
+import pytest
+from data_processing.dedup import deduplicate_packets
+from data_processing.pcap_processor import filter_voip_packets
+from data_processing.pcap_stream import iter_capture_packets
+from ml_models.feature_extraction import extract_features
+from ml_models.train import build_training_set, iter_capture_calls, process_voip_calls
+from ml_models.training_data import TrainingSetBuilder, load_training_set
+
+CAPTURE = dict(dialogs=3, duration=8.0, loss=0.01, jitter=0.002, seed=17)
+
+
+def offer(builder, labels, batch=1000):
+    """Offer calls whose single feature is their position, started one second apart."""
+    labels = np.asarray(labels)
+    for start in range(0, len(labels), batch):
+        positions = np.arange(start, min(start + batch, len(labels)))
+        builder.add(positions[:, None].astype(float), labels[positions], positions.astype(float))
+
+
+def test_every_label_keeps_a_bounded_uniform_sample(tmp_path):
+    builder = TrainingSetBuilder(str(tmp_path), samples_per_class=500, seed=1)
+    labels = np.ones(50000, dtype=int)
+    labels[::100] = 0  # a rare label
+    offer(builder, labels)
+
+    assert builder.seen == {0: 500, 1: 49500}
+    assert builder.sampled(0) == builder.sampled(1) == 500
+    rare = np.sort(builder._features[0][:, 0])
+    assert rare.tolist() == list(range(0, 50000, 100))
+    common = builder._features[1][:, 0]
+    assert len(np.unique(common)) == 500
+    assert np.all(labels[common.astype(int)] == 1)
+    # Every position is equally likely to be kept: the sample spans the stream evenly
+    assert common.mean() == pytest.approx(25000, rel=0.1)
+    assert np.histogram(common, bins=5, range=(0, 50000))[0].min() > 60
+
+def test_sample_times_stay_with_their_rows(tmp_path):
+    builder = TrainingSetBuilder(str(tmp_path), samples_per_class=100, seed=2)
+    offer(builder, np.arange(5000) % 2, batch=333)
+    for label in (0, 1):
+        assert np.array_equal(builder._features[label][:, 0], builder._times[label])
+
+def test_split_puts_the_latest_calls_in_the_test_set(tmp_path):
+    builder = TrainingSetBuilder(str(tmp_path), samples_per_class=1000, seed=3)
+    offer(builder, np.arange(2000) % 2)
+    X_train, X_test, y_train, y_test = builder.split(test_fraction=0.25)
+
+    assert len(X_train) + len(X_test) == 2000
+    assert len(X_test) == pytest.approx(500, abs=2)
+    assert X_train[:, 0].max() < X_test[:, 0].min()
+    assert np.array_equal(y_train, X_train[:, 0].astype(int) % 2)
+    assert set(y_test.tolist()) == {0, 1}
+
+    saved = load_training_set(str(tmp_path))
+    assert np.array_equal(saved[0], X_train) and np.array_equal(saved[3], y_test)
+    assert np.array_equal(saved[4], X_train[:, 0])
+
+    X_train, X_test, _, _ = builder.split(test_after=1500)
+    assert len(X_test) == 500 and X_test[:, 0].min() == 1500
+
+def test_split_without_calls_is_refused(tmp_path):
+    with pytest.raises(ValueError):
+        TrainingSetBuilder(str(tmp_path)).split()
+
+def test_captures_are_streamed_into_the_training_set(make_capture, tmp_path):
+    capture = make_capture(**CAPTURE)
+    directory = tmp_path / 'captures'
+    directory.mkdir()
+    shutil.copy(capture, directory / 'calls.pcap')
+    (directory / 'broken.pcap').write_bytes(b'not a capture')
+
+    expected = process_voip_calls(filter_voip_packets(deduplicate_packets(iter_capture_packets(capture))))
+    calls, = iter_capture_calls(str(directory))  # the broken capture is skipped
+    by_start = sorted(calls, key=lambda call: call['start_time'])
+    assert by_start == [pytest.approx(call) for call in sorted(expected, key=lambda call: call['start_time'])]
+
+    X_train, X_test, y_train, y_test = build_training_set(
+        str(directory), TrainingSetBuilder(str(tmp_path / 'training'), seed=4))
+    assert len(X_train) + len(X_test) == len(calls)
+    assert X_train.shape[1] == extract_features(calls).shape[1]
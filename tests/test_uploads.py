@@ -0,0 +1,58 @@
+import importlib
+import os
+import time
+import pytest
+from utils.config import Config
+
+
+@pytest.fixture(scope='module')
+def app_module(tmp_path_factory):
+    """The Flask app, with its cache, metrics store and uploads in a scratch directory."""
+    workdir = tmp_path_factory.mktemp('app')
+    patch = pytest.MonkeyPatch()
+    patch.chdir(workdir)
+    patch.setattr(Config, 'CACHE_DIR', str(workdir / 'cache'))
+    patch.setattr(Config, 'METRICS_DB', str(workdir / 'metrics.db'))
+    module = importlib.import_module('app')
+    patch.setitem(module.app.config, 'UPLOAD_FOLDER', str(workdir))
+    yield module
+    patch.undo()
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+def start_upload(client):
+    response = client.post('/uploads?filename=capture.pcap')
+    assert response.status_code == 201
+    return response.get_json()['upload_id']
+
+def test_upload_total_size_is_limited(client, monkeypatch):
+    monkeypatch.setattr(Config, 'MAX_UPLOAD_BYTES', 100)
+    upload_id = start_upload(client)
+
+    assert client.put(f'/uploads/{upload_id}', data=b'x' * 60).status_code == 200
+    response = client.put(f'/uploads/{upload_id}', data=b'x' * 60,
+                          headers={'Content-Range': 'bytes 60-119/*'})
+    assert response.status_code == 413
+    assert response.get_json()['offset'] == 60
+    assert client.get(f'/uploads/{upload_id}').get_json()['offset'] == 60
+
+def test_idle_upload_sessions_expire(app_module, client):
+    idle = start_upload(client)
+    active = start_upload(client)
+    client.put(f'/uploads/{active}', data=b'x' * 10)
+    path = app_module.upload_sessions[idle]['path']
+
+    # An orphaned spool file, e.g. from before a restart
+    orphan = os.path.join(app_module.app.config['UPLOAD_FOLDER'], 'f' * 32 + '.part')
+    open(orphan, 'wb').close()
+    stale = time.time() - Config.UPLOAD_SESSION_TTL - 60
+    os.utime(orphan, (stale, stale))
+    app_module.upload_sessions[idle]['updated_at'] = stale
+
+    app_module.expire_upload_sessions()
+    assert idle not in app_module.upload_sessions and not os.path.exists(path)
+    assert not os.path.exists(orphan)
+    assert client.put(f'/uploads/{idle}', data=b'x').status_code == 404
+    assert client.get(f'/uploads/{active}').get_json()['offset'] == 10
@@ -1,13 +1,17 @@
 """
 Utilities Package
 
-This package provides utility modules for logging configuration and application settings.
+This package provides utility modules for logging configuration, application settings
+and pipeline profiling.
 """
 
 from .logger import setup_logger
 from .config import Config
+from .profiling import StageProfiler, MetricsRegistry
 
 __all__ = [
     'setup_logger',
     'Config',
+    'StageProfiler',
+    'MetricsRegistry',
 ]
@@ -1,8 +1,81 @@
-import os
-
-class Config:
-    # Set directories relative to the application directory
-    BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    DATA_DIR = os.path.join(BASE_DIR, 'DATA_DIR')
-    OUTPUT_DIR = os.path.join(BASE_DIR, 'OUTPUT')
-    MODEL_PATH = os.path.join(BASE_DIR, 'MODELS/voip_quality_model.pkl')
+import os
+
+class Config:
+    # Set directories relative to the application directory
+    BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    DATA_DIR = os.path.join(BASE_DIR, 'DATA_DIR')
+    OUTPUT_DIR = os.path.join(BASE_DIR, 'OUTPUT')
+    MODEL_PATH = os.path.join(BASE_DIR, 'MODELS/voip_quality_model.pkl')
+
+    # Relative error bound of the streaming percentile sketches, and how many
+    # packets the streaming and chunked analyses sample for anomaly detection
+    SKETCH_RELATIVE_ACCURACY = 0.01
+    ANOMALY_SAMPLE_SIZE = 20000
+    # Most anomalous packets kept in a report (and in its cached copy)
+    ANOMALY_REPORT_LIMIT = 1000
+
+    # Uploads: overall request (and resumable upload) cap, per-chunk cap for
+    # resumable uploads, the block size used to stream request bodies into
+    # the parser, and the idle seconds after which a resumable upload is dropped
+    MAX_UPLOAD_BYTES = 8 * 1024 ** 3
+    UPLOAD_CHUNK_MAX_BYTES = 64 * 1024 ** 2
+    UPLOAD_BLOCK_BYTES = 1024 ** 2
+    UPLOAD_SESSION_TTL = 24 * 3600
+
+    # Content-addressed cache of analysis results
+    CACHE_DIR = os.path.join(BASE_DIR, 'CACHE')
+    CACHE_MAX_BYTES = 1024 ** 3
+
+    # Per-call metrics store and how many calls to buffer per write transaction
+    METRICS_DB = os.path.join(OUTPUT_DIR, 'metrics.db')
+    METRICS_BATCH_SIZE = 1000
+
+    # Result-page timelines: bucket widths in seconds (each a multiple of the
+    # previous) and the default number of points returned per query
+    TIMELINE_RESOLUTIONS = (1, 10, 60, 600, 3600)
+    TIMELINE_POINTS = 500
+
+    # Tap duplicate removal: capture-time window per key generation and the
+    # key count at which a generation is rotated early
+    DEDUP_WINDOW_SECONDS = 0.1
+    DEDUP_MAX_ENTRIES = 500000
+
+    # Media classification: the port range heuristically treated as RTP (even
+    # ports) and RTCP (the odd port above), and the capture time in seconds
+    # without SIP after which a dialog's SDP endpoints are forgotten
+    RTP_PORT_RANGE = (10000, 20000)
+    MEDIA_FLOW_TTL = 2 * 3600
+
+    # Logging: 'text' or 'json' lines, and the per-call-site rate limit for
+    # INFO/DEBUG records (burst, then records per second, then 1 in N sampled)
+    LOG_FORMAT = 'text'
+    LOG_RATE_BURST = 200
+    LOG_RATE_PER_SECOND = 50
+    LOG_SAMPLE_EVERY = 100
+
+    # Training: stratified reservoir sample size per quality label, share of
+    # the most recent sampled calls held out for testing, and where the
+    # memory-mapped sample and split matrices are written
+    TRAINING_SAMPLES_PER_CLASS = 500000
+    TRAINING_TEST_FRACTION = 0.2
+    TRAINING_SEED = 42
+    TRAINING_DATA_DIR = os.path.join(OUTPUT_DIR, 'training_data')
+
+    # Leaderboard and candidate models of ml_models.model_selection
+    MODEL_SELECTION_DIR = os.path.join(OUTPUT_DIR, 'model_selection')
+
+    # Multi-node processing (ml_models.distributed): coordinator address,
+    # shared secret authenticating workers (no default: a known key allows
+    # remote code execution), seconds a client may take to answer the
+    # authentication challenge, seconds a capture may run before an idle
+    # worker starts a backup copy, attempts per capture, seconds without any
+    # connected worker before the coordinator gives up, and where batch
+    # scores are written
+    CLUSTER_HOST = '127.0.0.1'
+    CLUSTER_PORT = 7070
+    CLUSTER_AUTHKEY = os.environ.get('VOIP_CLUSTER_AUTHKEY')
+    CLUSTER_HANDSHAKE_TIMEOUT = 10
+    CLUSTER_STEAL_AFTER = 30
+    CLUSTER_MAX_ATTEMPTS = 3
+    CLUSTER_IDLE_TIMEOUT = 300
+    CLUSTER_SCORES_PATH = os.path.join(OUTPUT_DIR, 'scores.jsonl')
@@ -1,14 +1,124 @@
+import atexit
+import json
 import logging
 import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from utils.config import Config
 
-def setup_logger(name="voip_analysis_ml", log_file="app.log", level=logging.INFO):
+# Attributes every LogRecord has; anything else was passed with extra= and
+# goes into the JSON output as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# Listener threads started by setup_logger, by logger name
+_listeners = {}
+
+
+class TextFormatter(logging.Formatter):
+    """The plain text format, noting how many similar messages were rate limited."""
+
+    def format(self, record):
+        message = super().format(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            message += f" ({suppressed} similar messages suppressed)"
+        return message
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with extra= fields as top-level keys."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per call site for records at or below `max_level`.
+
+    Each logging statement may emit `burst` records at once and `rate` per
+    second after that. Over the limit, every `sample_every`-th record still
+    passes (0 drops them all); the next record that passes carries the
+    number dropped in between as `suppressed`.
+    """
+
+    def __init__(self, rate=None, burst=None, sample_every=None, max_level=logging.INFO):
+        super().__init__()
+        self.rate = rate if rate is not None else Config.LOG_RATE_PER_SECOND
+        self.burst = burst if burst is not None else Config.LOG_RATE_BURST
+        self.sample_every = sample_every if sample_every is not None else Config.LOG_SAMPLE_EVERY
+        self.max_level = max_level
+        self._sites = {}  # (pathname, lineno) -> [tokens, last refill, dropped since last pass, dropped total]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            site = self._sites.get((record.pathname, record.lineno))
+            if site is None:
+                site = self._sites[(record.pathname, record.lineno)] = [self.burst, now, 0, 0]
+            site[0] = min(self.burst, site[0] + (now - site[1]) * self.rate)
+            site[1] = now
+            if site[0] >= 1:
+                site[0] -= 1
+            else:
+                site[3] += 1
+                if not self.sample_every or site[3] % self.sample_every:
+                    site[2] += 1
+                    return False
+            if site[2]:
+                record.suppressed = site[2]
+                site[2] = 0
+        return True
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    Queue handler that leaves message formatting to the listener thread.
+
+    The stock QueueHandler merges the arguments into the message in the
+    logging thread so records can be pickled; the queue here never leaves
+    the process, so the record is passed on as is. Arguments must not be
+    mutated after the logging call.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logger(name="voip_analysis_ml", log_file="app.log", level=logging.INFO, json_format=None,
+                 rate_limit=True, console=True):
     """
     Sets up a logger with the specified name, log file, and logging level.
 
+    Records are put on an in-memory queue and written to the file and the
+    console by a background QueueListener, so logging never blocks on I/O.
+
     Parameters:
         name (str): Name of the logger.
         log_file (str): File path for the log file.
         level (int): Logging level (e.g., logging.INFO, logging.DEBUG).
+        json_format (bool): Write JSON lines instead of text (defaults to
+            Config.LOG_FORMAT == 'json').
+        rate_limit (bool): Rate limit and sample high-volume INFO/DEBUG
+            messages per call site.
+        console (bool): Also log to the console.
 
     Returns:
         logging.Logger: Configured logger instance.
@@ -21,22 +131,48 @@ def setup_logger(name="voip_analysis_ml", log_file="app.log", level=logging.INFO
     logger = logging.getLogger(name)
     logger.setLevel(level)
 
-    # Create a file handler
-    file_handler = logging.FileHandler(os.path.join(log_directory, os.path.basename(log_file)))
-    file_handler.setLevel(level)
+    # Add handlers to the logger if they aren't already added
+    if not logger.handlers:
+        if json_format is None:
+            json_format = Config.LOG_FORMAT == 'json'
+        formatter = JsonFormatter() if json_format else TextFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
-    # Create a console handler
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(level)
+        file_handler = logging.FileHandler(os.path.join(log_directory, os.path.basename(log_file)))
+        file_handler.setLevel(level)
+        file_handler.setFormatter(formatter)
 
-    # Create a formatter and set it for both handlers
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
+        handlers = [file_handler]
+        if console:
+            console_handler = logging.StreamHandler()
+            console_handler.setLevel(level)
+            console_handler.setFormatter(formatter)
+            handlers.append(console_handler)
 
-    # Add handlers to the logger if they aren't already added
-    if not logger.handlers:
-        logger.addHandler(file_handler)
-        logger.addHandler(console_handler)
+        queue_handler = LazyQueueHandler(queue.SimpleQueue())
+        if rate_limit:
+            queue_handler.addFilter(RateLimitFilter())
+        listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+        listener.start()
+        _listeners[name] = listener
+        logger.addHandler(queue_handler)
 
     return logger
+
+def stop_logging(name=None):
+    """
+    Write out queued records and stop the listener of the named logger, or
+    of every logger set up by setup_logger (as done at exit).
+    """
+    for logger_name in [name] if name is not None else list(_listeners):
+        listener = _listeners.pop(logger_name, None)
+        if listener is None:
+            continue
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+        logger = logging.getLogger(logger_name)
+        for handler in list(logger.handlers):
+            if isinstance(handler, LazyQueueHandler):
+                logger.removeHandler(handler)
+
+atexit.register(stop_logging)
@@ -0,0 +1,344 @@
+"""
+Persistent per-call and per-stream metrics in an embedded SQLite database.
+
+Every analyzed capture adds one row per SIP dialog to `calls` and one row per
+RTP stream of the dialog to `streams`. Captures are written in batches inside
+a single transaction, each together with its calls, and the indexes on time,
+Call-ID, endpoints and MOS keep filtered and aggregate queries fast on
+millions of calls.
+
+Usage:
+    python -m utils.metrics_store ingest /path/to/captures --workers 8
+    python -m utils.metrics_store calls --endpoint 10.1.0.7 --mos-below 3.5 --since 7d
+    python -m utils.metrics_store summary --group-by callee --since 2026-10-01
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from utils.config import Config
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS captures (
+    id INTEGER PRIMARY KEY,
+    digest TEXT UNIQUE,
+    name TEXT,
+    analyzed_at REAL
+);
+CREATE TABLE IF NOT EXISTS calls (
+    id INTEGER PRIMARY KEY,
+    capture_id INTEGER NOT NULL REFERENCES captures(id) ON DELETE CASCADE,
+    call_id TEXT,
+    start_time REAL,
+    end_time REAL,
+    duration REAL,
+    caller TEXT,
+    callee TEXT,
+    packet_count INTEGER,
+    sip_count INTEGER,
+    rtp_count INTEGER,
+    jitter REAL,
+    packet_loss_rate REAL,
+    round_trip_time REAL,
+    remote_packet_loss_rate REAL,
+    mos REAL
+);
+CREATE TABLE IF NOT EXISTS streams (
+    id INTEGER PRIMARY KEY,
+    call_row INTEGER NOT NULL REFERENCES calls(id) ON DELETE CASCADE,
+    ssrc INTEGER,
+    start_time REAL,
+    end_time REAL,
+    packet_count INTEGER,
+    jitter REAL,
+    remote_packet_loss_rate REAL,
+    remote_jitter REAL
+);
+CREATE INDEX IF NOT EXISTS calls_start_time ON calls(start_time);
+CREATE INDEX IF NOT EXISTS calls_call_id ON calls(call_id);
+CREATE INDEX IF NOT EXISTS calls_caller ON calls(caller, start_time);
+CREATE INDEX IF NOT EXISTS calls_callee ON calls(callee, start_time);
+CREATE INDEX IF NOT EXISTS calls_mos ON calls(mos, start_time);
+CREATE INDEX IF NOT EXISTS calls_capture ON calls(capture_id);
+CREATE INDEX IF NOT EXISTS streams_call ON streams(call_row);
+CREATE INDEX IF NOT EXISTS streams_ssrc ON streams(ssrc);
+"""
+
+CALL_COLUMNS = (
+    'call_id', 'start_time', 'end_time', 'duration', 'caller', 'callee',
+    'packet_count', 'sip_count', 'rtp_count', 'jitter', 'packet_loss_rate',
+    'round_trip_time', 'remote_packet_loss_rate', 'mos'
+)
+STREAM_COLUMNS = (
+    'ssrc', 'start_time', 'end_time', 'packet_count', 'jitter',
+    'remote_packet_loss_rate', 'remote_jitter'
+)
+GROUP_BY = {
+    'caller': 'caller',
+    'callee': 'callee',
+    'endpoint': 'caller',  # expanded to caller and callee in summary()
+    'hour': "strftime('%Y-%m-%d %H:00', start_time, 'unixepoch')",
+    'day': "date(start_time, 'unixepoch')",
+}
+
+
+def parse_time(value):
+    """
+    Parse a query time: Unix seconds, an ISO date/time (UTC if no zone) or a
+    relative age such as '30m', '24h' or '7d'.
+    """
+    if value is None or isinstance(value, (int, float)):
+        return value
+    value = value.strip()
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+    if value[-1:] in units and value[:-1].replace('.', '', 1).isdigit():
+        return time.time() - float(value[:-1]) * units[value[-1]]
+    try:
+        return float(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+
+def _value(value):
+    # NumPy scalars are not accepted by sqlite3
+    return value.item() if hasattr(value, 'item') else value
+
+
+class MetricsStore:
+    """
+    SQLite metrics store.
+
+    One connection is shared between threads behind a lock. Captures are
+    buffered until they hold `batch_size` calls; flush() (or close()) writes
+    whatever is left. A capture row is only ever written in the same
+    transaction as its calls.
+    """
+
+    def __init__(self, path=None, batch_size=None):
+        self.path = path or Config.METRICS_DB
+        self.batch_size = batch_size or Config.METRICS_BATCH_SIZE
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._pending = []  # (digest, name, analyzed_at, call records) of unwritten captures
+        self._pending_calls = 0
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('PRAGMA foreign_keys=ON')
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def has_capture(self, digest):
+        """Whether a capture is in the store or buffered for it."""
+        with self._lock:
+            if any(pending[0] == digest for pending in self._pending):
+                return True
+            row = self.connection.execute('SELECT 1 FROM captures WHERE digest = ?', (digest,)).fetchone()
+        return row is not None
+
+    def record_capture(self, digest, name, calls, flush=True):
+        """
+        Record the per-call metrics of one capture. A capture already in the
+        store (same digest) is replaced, so re-analysis does not duplicate rows.
+        With flush=False the capture stays buffered until batch_size calls are.
+        """
+        calls = list(calls)
+        with self._lock:
+            self._pending = [pending for pending in self._pending if pending[0] != digest]
+            self._pending.append((digest, name, time.time(), calls))
+            self._pending_calls = sum(len(pending[3]) for pending in self._pending)
+            if flush or self._pending_calls >= self.batch_size:
+                self._flush_locked()
+        logger.info(f"Recorded {len(calls)} calls from {name}")
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        call_sql = (f"INSERT INTO calls (capture_id, {', '.join(CALL_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * (len(CALL_COLUMNS) + 1))})")
+        stream_sql = (f"INSERT INTO streams (call_row, {', '.join(STREAM_COLUMNS)}) "
+                      f"VALUES ({', '.join('?' * (len(STREAM_COLUMNS) + 1))})")
+        # A batch whose transaction fails is dropped (and the error raised)
+        # rather than retried by every later flush
+        pending, self._pending, self._pending_calls = self._pending, [], 0
+        with self.connection:
+            cursor = self.connection.cursor()
+            streams = []
+            for digest, name, analyzed_at, calls in pending:
+                cursor.execute('DELETE FROM captures WHERE digest = ?', (digest,))
+                capture_id = cursor.execute(
+                    'INSERT INTO captures (digest, name, analyzed_at) VALUES (?, ?, ?)',
+                    (digest, name, analyzed_at)
+                ).lastrowid
+                for call in calls:
+                    cursor.execute(call_sql, [capture_id] + [_value(call.get(c)) for c in CALL_COLUMNS])
+                    streams.extend(
+                        [cursor.lastrowid] + [_value(stream.get(c)) for c in STREAM_COLUMNS]
+                        for stream in call.get('streams', [])
+                    )
+            cursor.executemany(stream_sql, streams)
+
+    @staticmethod
+    def _where(since=None, until=None, endpoint=None, call_id=None, mos_below=None, mos_above=None):
+        clauses, params = [], []
+        if since is not None:
+            clauses.append('start_time >= ?')
+            params.append(parse_time(since))
+        if until is not None:
+            clauses.append('start_time < ?')
+            params.append(parse_time(until))
+        if endpoint:
+            clauses.append('(caller = ? OR callee = ?)')
+            params.extend([endpoint, endpoint])
+        if call_id:
+            clauses.append('call_id = ?')
+            params.append(call_id)
+        if mos_below is not None:
+            clauses.append('mos < ?')
+            params.append(float(mos_below))
+        if mos_above is not None:
+            clauses.append('mos >= ?')
+            params.append(float(mos_above))
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def calls(self, limit=100, order_by='start_time', with_streams=False, **filters):
+        """Return matching calls (newest first) as dicts."""
+        if order_by not in ('start_time', 'mos', 'duration'):
+            raise ValueError(f"Cannot order calls by {order_by}")
+        where, params = self._where(**filters)
+        direction = 'ASC' if order_by == 'mos' else 'DESC'
+        with self._lock:
+            rows = [dict(row) for row in self.connection.execute(
+                f'SELECT * FROM calls{where} ORDER BY {order_by} {direction} LIMIT ?', params + [int(limit)])]
+            if with_streams:
+                for row in rows:
+                    row['streams'] = [dict(s) for s in self.connection.execute(
+                        'SELECT * FROM streams WHERE call_row = ?', (row['id'],))]
+        return rows
+
+    def summary(self, group_by=None, **filters):
+        """
+        Aggregate matching calls: count, mean/min MOS, mean loss, RTT and
+        jitter and the number of calls under 3.5 MOS, optionally per group.
+        """
+        if group_by is not None and group_by not in GROUP_BY:
+            raise ValueError(f"Cannot group calls by {group_by}")
+        where, params = self._where(**filters)
+        aggregates = (
+            'COUNT(*) AS calls, AVG(mos) AS mean_mos, MIN(mos) AS min_mos, '
+            'SUM(mos < 3.5) AS poor_calls, AVG(packet_loss_rate) AS mean_packet_loss_rate, '
+            'AVG(round_trip_time) AS mean_round_trip_time, AVG(jitter) AS mean_jitter, '
+            'SUM(duration) AS total_duration'
+        )
+        if group_by is None:
+            sql = f'SELECT {aggregates} FROM calls{where}'
+        elif group_by == 'endpoint':
+            # Each call counts for both of its endpoints
+            sql = (f'SELECT endpoint AS "group", {aggregates} FROM ('
+                   f'SELECT caller AS endpoint, * FROM calls{where} UNION ALL '
+                   f'SELECT callee AS endpoint, * FROM calls{where}) GROUP BY endpoint ORDER BY calls DESC')
+            params = params + params
+        else:
+            sql = (f'SELECT {GROUP_BY[group_by]} AS "group", {aggregates} FROM calls{where} '
+                   f'GROUP BY 1 ORDER BY 1')
+        with self._lock:
+            return [dict(row) for row in self.connection.execute(sql, params)]
+
+
+def ingest(store, directory, workers=None, skip_known=True):
+    """
+    Analyze every capture in a directory with a process pool and record the
+    calls. Workers only analyze; the parent writes their results in batches.
+    With skip_known, captures are hashed first and those already in the
+    store (or seen earlier in the directory) are not analyzed at all.
+    """
+    from data_processing.pcap_stream import find_capture_files
+    from ml_models.streaming_analysis import capture_calls
+    from utils.result_cache import file_digest
+
+    files = find_capture_files(directory)
+    if skip_known:
+        seen = set()
+        unknown = []
+        for capture_file in files:
+            digest = file_digest(capture_file)
+            if digest not in seen and not store.has_capture(digest):
+                unknown.append(capture_file)
+            seen.add(digest)
+        logger.info(f"Skipping {len(files) - len(unknown)} of {len(files)} captures already recorded")
+        files = unknown
+
+    recorded = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for capture_file, (digest, calls) in zip(files, executor.map(capture_calls, files)):
+            store.record_capture(digest, os.path.basename(capture_file), calls, flush=False)
+            recorded += len(calls)
+    store.flush()
+    return recorded
+
+def main():
+    parser = argparse.ArgumentParser(description="Record and query per-call metrics")
+    parser.add_argument('command', choices=['ingest', 'calls', 'summary'])
+    parser.add_argument('directory', nargs='?', help='captures to ingest')
+    parser.add_argument('--workers', type=int, default=None, help='analysis processes for ingest')
+    parser.add_argument('--db', default=None, help='database path (defaults to Config.METRICS_DB)')
+    parser.add_argument('--since', help='Unix time, ISO date/time or age such as 24h or 7d')
+    parser.add_argument('--until')
+    parser.add_argument('--endpoint', help='caller or callee address')
+    parser.add_argument('--call-id')
+    parser.add_argument('--mos-below', type=float)
+    parser.add_argument('--mos-above', type=float)
+    parser.add_argument('--group-by', choices=sorted(GROUP_BY))
+    parser.add_argument('--order-by', choices=['start_time', 'mos', 'duration'], default='start_time')
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--streams', action='store_true', help='include the RTP streams of each call')
+    args = parser.parse_args()
+
+    filters = {
+        'since': args.since, 'until': args.until, 'endpoint': args.endpoint,
+        'call_id': args.call_id, 'mos_below': args.mos_below, 'mos_above': args.mos_above
+    }
+    with MetricsStore(args.db) as store:
+        started = time.perf_counter()
+        if args.command == 'ingest':
+            if not args.directory:
+                parser.error('ingest needs a capture directory')
+            recorded = ingest(store, args.directory, workers=args.workers)
+            print(f"Recorded {recorded} calls in {time.perf_counter() - started:.1f} s")
+            return
+        if args.command == 'calls':
+            rows = store.calls(limit=args.limit, order_by=args.order_by, with_streams=args.streams, **filters)
+        else:
+            rows = store.summary(group_by=args.group_by, **filters)
+        elapsed = time.perf_counter() - started
+    print(json.dumps(rows, indent=2))
+    print(f"{len(rows)} rows in {elapsed * 1000:.1f} ms", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+import cProfile
+import logging
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Latency histogram buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+def peak_rss_bytes():
+    """Return the peak resident set size of this process in bytes (0 if unknown)."""
+    if resource is None:
+        return 0
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MetricsRegistry:
+    """
+    Per-stage latency histograms and packet counters, rendered in the
+    Prometheus text exposition format.
+    """
+
+    def __init__(self, prefix='voip_analysis', buckets=DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._histograms = {}  # stage -> [bucket counts..., count, sum]
+        self._packets = {}
+        self._errors = {}
+
+    def observe(self, stage, seconds, packets=None):
+        with self._lock:
+            histogram = self._histograms.setdefault(stage, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+            if packets:
+                self._packets[stage] = self._packets.get(stage, 0) + packets
+
+    def record_error(self, stage):
+        with self._lock:
+            self._errors[stage] = self._errors.get(stage, 0) + 1
+
+    def render(self):
+        """Return all metrics in the Prometheus text format."""
+        name = f"{self.prefix}_stage_duration_seconds"
+        lines = [
+            f"# HELP {name} Wall-clock time spent per pipeline stage.",
+            f"# TYPE {name} histogram",
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self._histograms.items()):
+                for bound, count in zip(self.buckets, histogram):
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {histogram[-2]}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {histogram[-2]}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {histogram[-1]}')
+
+            packets_name = f"{self.prefix}_stage_packets_total"
+            lines.append(f"# HELP {packets_name} Packets processed per pipeline stage.")
+            lines.append(f"# TYPE {packets_name} counter")
+            for stage, count in sorted(self._packets.items()):
+                lines.append(f'{packets_name}{{stage="{stage}"}} {count}')
+
+            errors_name = f"{self.prefix}_stage_errors_total"
+            lines.append(f"# HELP {errors_name} Failed runs per pipeline stage.")
+            lines.append(f"# TYPE {errors_name} counter")
+            for stage, count in sorted(self._errors.items()):
+                lines.append(f'{errors_name}{{stage="{stage}"}} {count}')
+
+        rss_name = f"{self.prefix}_peak_rss_bytes"
+        lines.append(f"# HELP {rss_name} Peak resident set size of the process.")
+        lines.append(f"# TYPE {rss_name} gauge")
+        lines.append(f"{rss_name} {peak_rss_bytes()}")
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry served by the Flask /metrics endpoint
+metrics = MetricsRegistry()
+
+
+class StageTiming:
+    """Measurements for one run of a pipeline stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.packets = None
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.peak_rss = 0
+        self.alloc_peak_bytes = None
+        self.alloc_blocks = None
+
+    @property
+    def packets_per_second(self):
+        if self.packets and self.wall_time > 0:
+            return self.packets / self.wall_time
+        return None
+
+    def as_dict(self):
+        return {
+            'stage': self.name,
+            'wall_time': self.wall_time,
+            'cpu_time': self.cpu_time,
+            'packets': self.packets,
+            'packets_per_second': self.packets_per_second,
+            'peak_rss': self.peak_rss,
+            'alloc_peak_bytes': self.alloc_peak_bytes,
+            'alloc_blocks': self.alloc_blocks,
+        }
+
+
+class StageProfiler:
+    """
+    Times pipeline stages and optionally records allocations and a cProfile
+    trace of the whole run.
+
+    Usage:
+        profiler = StageProfiler()
+        with profiler.stage('read') as stage:
+            packets = extract_packets(path)
+            stage.packets = len(packets)
+    """
+
+    def __init__(self, registry=None, trace_allocations=False, cprofile=False):
+        self.registry = registry
+        self.trace_allocations = trace_allocations
+        self.stages = []
+        self._profile = cProfile.Profile() if cprofile else None
+        self._started_tracemalloc = False
+
+    def start(self):
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        if self._profile:
+            self._profile.enable()
+        return self
+
+    def stop(self):
+        if self._profile:
+            self._profile.disable()
+
+    @contextmanager
+    def stage(self, name, packets=None):
+        timing = StageTiming(name)
+        timing.packets = packets
+        tracing = self.trace_allocations and tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            blocks_before = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield timing
+        except Exception:
+            if self.registry:
+                self.registry.record_error(name)
+            raise
+        finally:
+            timing.wall_time = time.perf_counter() - wall_start
+            timing.cpu_time = time.process_time() - cpu_start
+            timing.peak_rss = peak_rss_bytes()
+            if tracing:
+                timing.alloc_peak_bytes = tracemalloc.get_traced_memory()[1]
+                blocks_after = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+                timing.alloc_blocks = blocks_after - blocks_before
+            self.stages.append(timing)
+            if self.registry:
+                self.registry.observe(name, timing.wall_time, timing.packets)
+
+    def report(self):
+        """Return the recorded stages as a list of dictionaries."""
+        return [timing.as_dict() for timing in self.stages]
+
+    def log_report(self, log=None):
+        log = log or logger
+        log.info("\n=== Pipeline Profile ===")
+        for timing in self.stages:
+            line = f"{timing.name:<20} wall={timing.wall_time:8.3f}s cpu={timing.cpu_time:8.3f}s"
+            if timing.packets_per_second:
+                line += f" {timing.packets_per_second:10.0f} pkt/s"
+            line += f" peak_rss={timing.peak_rss / 2**20:.1f}MiB"
+            if timing.alloc_peak_bytes is not None:
+                line += f" alloc_peak={timing.alloc_peak_bytes / 2**20:.1f}MiB blocks={timing.alloc_blocks:+d}"
+            log.info(line)
+
+    def dump(self, prefix, top=25):
+        """
+        Write the cProfile trace to <prefix>.prof and, when allocations are
+        traced, the largest allocation sites to <prefix>.tracemalloc.txt.
+        """
+        written = []
+        if self._profile:
+            self._profile.dump_stats(f"{prefix}.prof")
+            written.append(f"{prefix}.prof")
+        if self.trace_allocations and tracemalloc.is_tracing():
+            with open(f"{prefix}.tracemalloc.txt", 'w') as f:
+                for stat in tracemalloc.take_snapshot().statistics('lineno')[:top]:
+                    f.write(f"{stat}\n")
+            written.append(f"{prefix}.tracemalloc.txt")
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+        return written
@@ -0,0 +1,182 @@
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import threading
+from utils.config import Config
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever a change to the analysis code changes its output, so stale
+# cached results are not served
+ANALYZER_VERSION = 11
+
+HASH_BLOCK_SIZE = 4 * 1024 * 1024
+
+def file_digest(path, digest=None):
+    """
+    Return the SHA-256 hex digest of a file, read in large blocks. A given
+    hashlib `digest` is updated instead of a new SHA-256.
+    """
+    digest = digest if digest is not None else hashlib.sha256()
+    with open(path, 'rb', buffering=0) as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def model_fingerprint(model_path=None):
+    """Identify the model version by the size and modification time of its file."""
+    model_path = model_path or Config.MODEL_PATH
+    try:
+        stat = os.stat(model_path)
+    except OSError:
+        return 'no-model'
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+class HashingFile:
+    """
+    File wrapper that hashes everything written through it, so the digest
+    of a spooled upload is ready as soon as the upload is. Reads are passed
+    through unhashed; see HashingReader.
+    """
+
+    def __init__(self, fileobj):
+        self._file = fileobj
+        self._digest = hashlib.sha256()
+
+    def write(self, data):
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class HashingReader:
+    """Read-side counterpart of HashingFile for request bodies."""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        self._digest.update(data)
+        return data
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+
+class AnalysisCache:
+    """
+    On-disk cache of analysis results keyed by capture content.
+
+    Entries are pickled dictionaries stored as <key>.pkl. Reads refresh the
+    file modification time, and writes evict the least recently used entries
+    once the cache exceeds max_bytes.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cache_dir or Config.CACHE_DIR
+        self.max_bytes = max_bytes if max_bytes is not None else Config.CACHE_MAX_BYTES
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(content_digest, model_path=None):
+        """Combine the capture digest with the analyzer and model versions."""
+        key = f"{content_digest}:{ANALYZER_VERSION}:{model_fingerprint(model_path)}"
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def _digest_path(self, path):
+        stat = os.stat(path)
+        name = f"{os.path.realpath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        return os.path.join(self.cache_dir, f"{hashlib.sha256(name.encode()).hexdigest()}.digest")
+
+    def known_digest(self, path):
+        """
+        Return the content digest remembered for a file with this path, size
+        and modification time, so a repeat analysis need not read it, or None.
+        """
+        try:
+            with open(self._digest_path(path)) as f:
+                digest = f.read().strip()
+        except OSError:
+            return None
+        return digest if len(digest) == 64 else None
+
+    def remember_digest(self, path, digest):
+        """Remember the content digest of a file (see known_digest)."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(digest)
+            os.replace(tmp_path, self._digest_path(path))
+        except Exception:
+            self._remove(tmp_path)
+            raise
+
+    def get(self, key):
+        """Return the cached result for key, or None."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Discarding unreadable cache entry {key}: {e}")
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+        logger.info(f"Analysis cache hit for {key[:12]}")
+        return result
+
+    def put(self, key, result):
+        """Store a result atomically and enforce the size cap."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except Exception:
+            self._remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith(('.pkl', '.digest')):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,59 @@
+import math
+import numpy as np
+
+
+class RunningStats:
+    """
+    Welford mean/variance accumulator.
+
+    Accumulators can be updated one value or one batch at a time and merged
+    with accumulators built over other slices of the data (Chan et al.), so
+    the result does not depend on how the data was partitioned.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def update(self, value):
+        """Add a single value."""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    def update_batch(self, values):
+        """Add a batch of values."""
+        values = np.asarray(values, dtype=float)
+        if values.size == 0:
+            return
+        batch = RunningStats()
+        batch.count = int(values.size)
+        batch.mean = float(np.mean(values))
+        batch._m2 = float(np.sum((values - batch.mean) ** 2))
+        self.merge(batch)
+
+    def merge(self, other):
+        """Merge another accumulator into this one."""
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self._m2 = other.count, other.mean, other._m2
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self._m2 += other._m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        return self
+
+    @property
+    def variance(self):
+        """Population variance (matches np.var)."""
+        return self._m2 / self.count if self.count else 0.0
+
+    @property
+    def std(self):
+        """Population standard deviation (matches np.std)."""
+        return math.sqrt(max(self.variance, 0.0))